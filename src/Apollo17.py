@@ -12,10 +12,9 @@ It uses LRO observation data instead of KAGUYA as elevation data.
 To plot SLIM-related plots, run LRO.py instead of main.py.
 """
 
-import Area as area
-import Effect as ef
-import Plot as pl
-import Save as sv
+import Simulation as sim
+import Trace as trace
+import Extent as extent
 
 """
 LRO 観測データ： https://pds.lroc.asu.edu/data/LRO-L-LROC-5-RDR-V1.0/LROLRC_2001/DATA/SDP/NAC_DTM/APOLLO17/
@@ -26,16 +25,6 @@ LRO 観測データ： https://pds.lroc.asu.edu/data/LRO-L-LROC-5-RDR-V1.0/LROLR
     データ型： IEEE浮動小数点数 32bit big endian
 """
 
-# LBLファイルから情報を取得
-# データサイズ
-LINES, LINE_SAMPLES = 11600, 9985
-# 左上の緯度と経度を定義
-UPPER_LEFT_LATITUDE = 21.3033847
-UPPER_LEFT_LONGITUDE = 29.905747
-# マップスケールを定義 <pixel/deg>
-MAP_RESOLUTION = 6064.67008483
-
-
 if __name__ == "__main__":
     
     print("=== Apollo 17 専用モジュール実行中 ===")
@@ -43,6 +32,8 @@ if __name__ == "__main__":
     # ------------ シュミレーション条件の設定 ----------------
     # 標高データのファイル名
     tif_name = "NAC_DTM_APOLLO17.tif"
+    # ラベルのファイル名（データサイズ、左上の緯度経度、マップスケールを読み取る）
+    lbl_name = "NAC_DTM_APOLLO17.LBL"
     # 緯度経度の設定 = [float]
     # データ領域内で設定 
     target_longitude = 30.5662
@@ -52,51 +43,35 @@ if __name__ == "__main__":
     # altdeg:  地平線0度、直上90度（0から90度の間） 
     sun_azimuth = 90
     sun_altdeg = 20
+    # 太陽の方位と高度のスイープ = [(azimuth, altdeg), ...]
+    # 指定した組み合わせごとに結果を保存する（空の場合は無効）
+    sun_sweep = []
+    # 影（投影）の合成 = [bool]
+    # 地形が落とす影を陰影起伏に合成する
+    shadow_active = False
+    # 地平線高度の事前計算 = [bool]
+    # 有効の場合、方位ごとの地平線高度を data/horizon に保存し、以降は比較だけで影を求める
+    horizon_cache = False
     # スムージング機能の有効化 = [bool]
     smoothing_active = False
-    # 描画範囲の設定 = [0, 1, 2, 3] 
+    # 描画範囲の設定 = [0, 1, 2, 3] 又は extent.from_size(東西, 南北) <単位: m>
     # 0: 6,000m, 1: 3,000m, 2: 600m, 3: 300m
     plot_range = 0
     # 月面からの視点の高さ = [float]
     # plot_range に応じたデフォルト設定 <単位: m>
-    if plot_range == 0:
-        viewpoint = 36
-    elif plot_range == 1:
-        viewpoint = 20
-    elif plot_range == 2:
-        viewpoint = 3.6
-    else:
-        viewpoint = 1.8
+    viewpoint = extent.viewpoint(plot_range)
         
     # オルソ画像の使用（現在、使用不可）= [bool]
     ortho_active = False
     # ------------------------------------------------------
     
-    # 標高データを取得する
-    elevation_data = area.get_elevation_LRO(tif_name)
-
-    # 描画範囲のデータを抽出する
-    selected_data, selected_x, selected_y, haversine_data = area.select_area(elevation_data, target_latitude, target_longitude, 
-                                                            LINE_SAMPLES, LINES, UPPER_LEFT_LATITUDE,
-                                                            UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range)
+    # 各段階の所要時間とメモリ使用量は、環境変数 HVTS_TRACE を指定した場合に記録する
     
-    # 陰影起伏の計算
-    hillshade = ef.calculate_hillshade(haversine_data, sun_azimuth, sun_altdeg)
-    
-    # スムージングが有効の場合
-    # 地形と陰影起伏に対してスムージングを行う
-    if smoothing_active == True:
-        adjusted_data = ef.smoothing_data(haversine_data)
-        adjusted_hillshade = ef.smoothing_data(hillshade)
-    # 無効の場合
-    else:
-        adjusted_data = selected_data
-        adjusted_hillshade = hillshade
-
-    # 3Dプロットの作成
-    fig = pl.plot_3d(adjusted_data, haversine_data, adjusted_hillshade, selected_x, selected_y,
-                target_latitude, target_longitude, sun_azimuth, sun_altdeg,
-                plot_range, viewpoint, smoothing_active, ortho_active)
+    # 読み込み以降の処理（陰影起伏、影、スムージング、プロット、保存）は main.py と共通
+    # スイープの場合は展開しない
+    sim.simulate_LRO(tif_name, lbl_name, target_latitude, target_longitude, sun_azimuth, sun_altdeg,
+                     smoothing_active, plot_range, viewpoint, sun_sweep=sun_sweep,
+                     shadow_active=shadow_active, horizon_cache=horizon_cache)
     
-    # 3Dプロットを保存して展開する
-    sv.save_expand_LRO(fig, target_latitude, target_longitude, sun_azimuth, sun_altdeg, smoothing_active, plot_range)
\ No newline at end of file
+    # 段階ごとの合計を出力する（記録が無効の場合は何もしない）
+    trace.emit_summary()
\ No newline at end of file
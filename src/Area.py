@@ -7,8 +7,16 @@ This module obtains the elevation from the specified elevation tile and adjusts
 
 import os
 import numpy as np
-import tifffile
 import math
+import Cache as cache
+import Trace as trace
+import Lazy as lazy
+import Pyramid as pyramid
+import Read_lbl as read
+import Extent as extent
+
+# tifffile は LRO のデータを読む時点で読み込む
+tifffile = lazy.lazy_import("tifffile")
 
 # 標高データを取得
 def get_elevation(img_path, LINE_SAMPLES, LINES):
@@ -28,6 +36,300 @@ def get_elevation(img_path, LINE_SAMPLES, LINES):
     return elevation_data
 
 
+# 標高データを読み取り専用のメモリマップとして開く
+def open_elevation(img_path, LINE_SAMPLES, LINES, dtype=">i2", offset=0):
+    """
+    Args:
+    img_path: 標高データのパス
+    LINES_SAMPLES, LINES: データサイズ
+    dtype: データ型（KAGUYA TC は 16bit 符号付き整数 big endian）
+    offset: データ先頭までのバイト数
+    
+    Return:
+    elevation_map: 標高データのメモリマップ（この時点ではファイルを読み込まない）
+    """
+    
+    return np.memmap(img_path, dtype=dtype, mode="r", offset=offset, shape=(LINES, LINE_SAMPLES))
+
+
+# 標高データを開く（Cache.DISK_CACHE_ACTIVE の場合は展開済みキャッシュから開き、初回のみネイティブエンディアンへ変換して保存する）
+def open_elevation_cached(img_path, LINE_SAMPLES, LINES, dtype=">i2", offset=0):
+    """
+    Args:
+    img_path: 標高データのパス
+    LINES_SAMPLES, LINES: データサイズ
+    dtype: データ型（KAGUYA TC は 16bit 符号付き整数 big endian）
+    offset: データ先頭までのバイト数
+    
+    Return:
+    elevation_map: 標高データのメモリマップ（ディスク上の保存領域が無効の場合は元のファイル）
+    
+    既定では元のファイルのメモリマップを返し、抽出範囲だけを読み込む（タイル全体は展開しない）。
+    """
+    
+    elevation_map = open_elevation(img_path, LINE_SAMPLES, LINES, dtype, offset)
+    if not (cache.CACHE_ACTIVE and cache.DISK_CACHE_ACTIVE):
+        return elevation_map
+    return cache.load_tile(img_path, elevation_map.shape, elevation_map.dtype,
+                           lambda out: copy_rows(elevation_map, out))
+
+
+# 行ごとに分けて変換しながら書き写す（タイル全体をメモリに載せない）
+def copy_rows(source, out, block_rows=1024):
+    """
+    Args:
+    source: 元の配列（メモリマップ）
+    out: 書き込み先の配列
+    block_rows: 一度に書き写す行数
+    
+    Return:
+    None
+    """
+    
+    for start in range(0, source.shape[0], block_rows):
+        out[start:start + block_rows] = source[start:start + block_rows]
+
+
+# 抽出範囲を含む行と列の範囲を求める
+def window_bounds(target_latitude, target_longitude, LINE_SAMPLES, LINES,
+                  UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range, margin=1, clip=True):
+    """
+    Args:
+    target_latitude: 対象の緯度
+    target_longitude: 対象の経度
+    LINE_SAMPLES, LINES: データサイズ
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: タイル左上の緯度経度
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    margin: 丸め誤差に備えて上下左右に追加するピクセル数
+    clip: タイルの外側を切り捨てるか（False の場合はタイル外の番号も返す）
+    
+    Returns:
+    row_slice: 抽出範囲の行
+    col_slice: 抽出範囲の列
+    """
+    
+    lat_range, lon_range = extent.half_range_deg(plot_range, target_latitude)
+    
+    # 緯度は行方向に減少し、経度は列方向に増加する
+    row_start = math.floor((UPPER_LEFT_LATITUDE - (target_latitude + lat_range)) * MAP_RESOLUTION) - margin
+    row_stop = math.ceil((UPPER_LEFT_LATITUDE - (target_latitude - lat_range)) * MAP_RESOLUTION) + 1 + margin
+    col_start = math.floor((target_longitude - lon_range - UPPER_LEFT_LONGITUDE) * MAP_RESOLUTION) - margin
+    col_stop = math.ceil((target_longitude + lon_range - UPPER_LEFT_LONGITUDE) * MAP_RESOLUTION) + 1 + margin
+    
+    if not clip:
+        return slice(row_start, row_stop), slice(col_start, col_stop)
+    
+    # タイルの外側は切り捨てる
+    row_start, row_stop = min(max(row_start, 0), LINES), min(max(row_stop, 0), LINES)
+    col_start, col_stop = min(max(col_start, 0), LINE_SAMPLES), min(max(col_stop, 0), LINE_SAMPLES)
+    return slice(row_start, max(row_start, row_stop)), slice(col_start, max(col_start, col_stop))
+
+
+# 抽出範囲に含まれる行と列の範囲を求める
+# 緯度経度の格子を作らずに、左上の緯度経度とマップスケールから直接計算する
+def select_bounds(target_latitude, target_longitude, LINE_SAMPLES, LINES,
+                  UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range):
+    """
+    Args:
+    target_latitude: 対象の緯度
+    target_longitude: 対象の経度
+    LINE_SAMPLES, LINES: データサイズ
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: タイル左上の緯度経度
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    
+    Returns:
+    row_slice: 抽出範囲の行
+    col_slice: 抽出範囲の列
+    
+    境界のピクセルは np.where で lon, lat 全体を比較した場合と同じ判定になる。
+    """
+    
+    lat_range, lon_range = extent.half_range_deg(plot_range, target_latitude)
+    
+    # 行・列番号に対応する緯度経度（格子を作る場合と同じ式）
+    def lon_at(i):
+        return UPPER_LEFT_LONGITUDE + i / MAP_RESOLUTION
+    def lat_at(i):
+        return UPPER_LEFT_LATITUDE - i / MAP_RESOLUTION
+    
+    # 抽出範囲の大きさは Extent.py で東西と南北を別々に求める
+    lon_min, lon_max = target_longitude - lon_range, target_longitude + lon_range
+    lat_min, lat_max = target_latitude - lat_range, target_latitude + lat_range
+    
+    # 推定値を求めてから、境界のピクセルを実際の判定式で確認する
+    col_start = _first_index(lambda i: lon_at(i) >= lon_min,
+                             math.ceil((lon_min - UPPER_LEFT_LONGITUDE) * MAP_RESOLUTION), LINE_SAMPLES)
+    col_stop = _first_index(lambda i: lon_at(i) > lon_max,
+                            math.floor((lon_max - UPPER_LEFT_LONGITUDE) * MAP_RESOLUTION) + 1, LINE_SAMPLES)
+    row_start = _first_index(lambda i: lat_at(i) <= lat_max,
+                             math.ceil((UPPER_LEFT_LATITUDE - lat_max) * MAP_RESOLUTION), LINES)
+    row_stop = _first_index(lambda i: lat_at(i) < lat_min,
+                            math.floor((UPPER_LEFT_LATITUDE - lat_min) * MAP_RESOLUTION) + 1, LINES)
+    
+    return slice(row_start, max(row_start, row_stop)), slice(col_start, max(col_start, col_stop))
+
+
+# 単調な条件が初めて成り立つ番号を推定値の近傍で探す
+def _first_index(condition, estimate, size):
+    index = min(max(estimate, 0), size)
+    while index > 0 and condition(index - 1):
+        index -= 1
+    while index < size and not condition(index):
+        index += 1
+    return index
+
+
+# メモリマップから抽出範囲のみを読み込む
+def read_window(elevation_map, row_slice, col_slice):
+    """
+    Args:
+    elevation_map: 標高データのメモリマップ
+    row_slice: 抽出範囲の行
+    col_slice: 抽出範囲の列
+    
+    Return:
+    elevation_data: 抽出範囲の標高データ（ネイティブエンディアン）
+    """
+    
+    window = elevation_map[row_slice, col_slice]
+    # 読み込みとエンディアン変換を一度のコピーで行う
+    return np.array(window, dtype=window.dtype.newbyteorder("="))
+
+
+# 抽出範囲をプロセス内キャッシュから取り出す（同じ範囲を繰り返し読む場合に使う）
+def read_window_cached(source_path, elevation_map, row_slice, col_slice):
+    """
+    Args:
+    source_path: 元のファイルのパス
+    elevation_map: 標高データのメモリマップ
+    row_slice: 抽出範囲の行
+    col_slice: 抽出範囲の列
+    
+    Return:
+    elevation_data: 抽出範囲の標高データ（ネイティブエンディアン、書き込み不可）
+    """
+    
+    if not cache.CACHE_ACTIVE:
+        return read_window(elevation_map, row_slice, col_slice)
+    key = ("window", cache.source_key(source_path), row_slice.start, row_slice.stop, col_slice.start, col_slice.stop)
+    return cache.remember(key, lambda: read_window(elevation_map, row_slice, col_slice))
+
+
+# 描画範囲に応じた解像度の段（元の解像度又は作成済みの概観データ）を開く
+def open_level(source_path, topographic_info, plot_range, target_latitude, max_factor=None):
+    """
+    Args:
+    source_path: 標高データのパス
+    topographic_info: 元のデータの地理情報（LINES, LINE_SAMPLES, UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE,
+                      MAP_RESOLUTION の辞書）
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    target_latitude: ターゲットの緯度（東西の範囲の換算に使う）
+    max_factor: 倍率の上限（複数のタイルで倍率を揃える場合に使う）
+    
+    Returns:
+    elevation_map: 選んだ段の標高データ（元の解像度の場合は None）
+    level_info: 選んだ段の地理情報（topographic_info と同じ項目と、倍率 FACTOR、ファイルのパス SOURCE）
+    
+    描画範囲のピクセル数が Plot.VERTEX_BUDGET を下回らない範囲で、最も粗い段を選ぶ。
+    概観データは作成しないため、作成済みでない場合は元の解像度となる（precompute_pyramid を参照）。
+    """
+    
+    lat_range, lon_range = extent.half_range_deg(plot_range, target_latitude)
+    window_lines = 2 * lat_range * topographic_info["MAP_RESOLUTION"]
+    window_samples = 2 * lon_range * topographic_info["MAP_RESOLUTION"]
+    factor = pyramid.choose_factor(window_lines, window_samples)
+    if max_factor is not None:
+        factor = min(factor, max_factor)
+    elevation_map, factor = pyramid.open_level(source_path, factor)
+    level_info = dict(topographic_info, FACTOR=factor, SOURCE=source_path)
+    if elevation_map is not None:
+        (level_info["UPPER_LEFT_LATITUDE"], level_info["UPPER_LEFT_LONGITUDE"],
+         level_info["MAP_RESOLUTION"]) = pyramid.level_geometry(topographic_info["UPPER_LEFT_LATITUDE"],
+                                                                topographic_info["UPPER_LEFT_LONGITUDE"],
+                                                                topographic_info["MAP_RESOLUTION"], factor)
+        level_info["LINES"], level_info["LINE_SAMPLES"] = elevation_map.shape
+        level_info["SOURCE"] = pyramid.pyramid_paths(source_path, factor)
+    return elevation_map, level_info
+
+
+# 概観データを事前に作成する（描画時には作成しない。Pyramid.py 又は Seed.py --pyramid から呼ぶ）
+def precompute_pyramid(source_path, lbl_path=None):
+    """
+    Args:
+    source_path: 標高データのパス（KAGUYA の img 又は LRO の GeoTIFF）
+    lbl_path: KAGUYA の lbl ファイルのパス（GeoTIFF の場合は None）
+    
+    Return:
+    index: 概観データの索引
+    """
+    
+    if lbl_path is None:
+        def open_base():
+            if cache.CACHE_ACTIVE and cache.DISK_CACHE_ACTIVE:
+                return open_tiff_cached(source_path)
+            with tifffile.TiffFile(source_path) as tif:
+                lines, samples = tif.pages[0].shape[-2:]
+            return read_tiff_region(source_path, slice(0, lines), slice(0, samples))
+    else:
+        # データ型、エンディアン、データ先頭の位置はラベルの記載に従う
+        label = read.parse_lbl(lbl_path)
+        geometry = read.get_geometry(label)
+        def open_base():
+            return open_elevation_cached(source_path, geometry["LINE_SAMPLES"], geometry["LINES"],
+                                         read.get_sample_dtype(label), read.get_image_offset(label))
+    return pyramid.ensure_pyramid(source_path, open_base)
+
+
+# 対象を中心とした抽出範囲の標高データだけをタイルから取得する
+def get_elevation_window(img_path, LINE_SAMPLES, LINES, UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE,
+                         MAP_RESOLUTION, target_latitude, target_longitude, plot_range, dtype=">i2", offset=0):
+    """
+    Args:
+    img_path: 標高データのパス
+    LINE_SAMPLES, LINES: データサイズ
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: タイル左上の緯度経度
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    target_latitude: 対象の緯度
+    target_longitude: 対象の経度
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    dtype: データ型（Read_lbl.get_sample_dtype でラベルから求める）
+    offset: データ先頭までのバイト数（Read_lbl.get_image_offset でラベルから求める）
+    
+    Returns:
+    elevation_data: 抽出範囲を含む標高データ
+    LINE_SAMPLES, LINES: 読み込んだデータのサイズ
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: 読み込んだデータ左上の緯度経度
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    
+    select_area にはタイル全体の代わりにこの戻り値をそのまま渡す。
+    """
+    
+    print("標高データ構築中...")
+    
+    # 広い描画範囲では、出力の解像度を満たす最も粗い概観データ（作成済みの場合）から読み込む
+    elevation_map, level_info = open_level(
+        img_path,
+        {"LINES": LINES, "LINE_SAMPLES": LINE_SAMPLES, "UPPER_LEFT_LATITUDE": UPPER_LEFT_LATITUDE,
+         "UPPER_LEFT_LONGITUDE": UPPER_LEFT_LONGITUDE, "MAP_RESOLUTION": MAP_RESOLUTION}, plot_range, target_latitude)
+    if elevation_map is None:
+        elevation_map = open_elevation_cached(img_path, LINE_SAMPLES, LINES, dtype, offset)
+    LINES, LINE_SAMPLES = level_info["LINES"], level_info["LINE_SAMPLES"]
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE = level_info["UPPER_LEFT_LATITUDE"], level_info["UPPER_LEFT_LONGITUDE"]
+    MAP_RESOLUTION = level_info["MAP_RESOLUTION"]
+    
+    row_slice, col_slice = window_bounds(target_latitude, target_longitude, LINE_SAMPLES, LINES,
+                                         UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range)
+    elevation_data = read_window_cached(level_info["SOURCE"], elevation_map, row_slice, col_slice)
+    
+    # 読み込んだ範囲の左上の緯度経度
+    window_latitude = UPPER_LEFT_LATITUDE - row_slice.start / MAP_RESOLUTION
+    window_longitude = UPPER_LEFT_LONGITUDE + col_slice.start / MAP_RESOLUTION
+    return (elevation_data, elevation_data.shape[1], elevation_data.shape[0],
+            window_latitude, window_longitude, MAP_RESOLUTION)
+
+
 # 対象を中心として特定範囲の標高データを抽出する
 def select_area(elevation_data, target_latitude, target_longitude, LINE_SAMPLES, LINES,
                 UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range):
@@ -39,8 +341,8 @@ def select_area(elevation_data, target_latitude, target_longitude, LINE_SAMPLES,
     LINE_SAMPLES, LINES: データサイズ
     UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: タイル左上の緯度経度
     MAP_RESOLUTION: マップスケーリング係数 <km/pixel>
-    plot_range: プロット管理番号
-
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    
     Returns:
     selected_data: 抽出された標高データ
     selected_x: 抽出されたピクセルの経度データ
@@ -50,50 +352,31 @@ def select_area(elevation_data, target_latitude, target_longitude, LINE_SAMPLES,
     
     print("標高データ整形中...")
     
-    # 第1段階 ピクセル座標を緯度と経度に変換
-    lon = UPPER_LEFT_LONGITUDE + np.arange(LINE_SAMPLES) / MAP_RESOLUTION
-    lat = UPPER_LEFT_LATITUDE - np.arange(LINES) / MAP_RESOLUTION
-    x, y = np.meshgrid(lon, lat)
-    
-    # 第2段階 管理番号に基づいて抽出範囲を指定
-    if plot_range == 0:   # range: 6,000m
-        plot_range = 0.1    # <deg>
-    elif plot_range == 1: # range: 3,000m
-        plot_range = 0.05   # <deg>
-    elif plot_range == 2: # range: 600m
-        plot_range = 0.01   # <deg>
-    else:                 # range: 300m
-        plot_range = 0.005  # <deg>
-
-    # 通常の抽出（変更の必要なければこのまま）
-    x_indices = np.where((lon >= target_longitude - plot_range) & (lon <= target_longitude + plot_range))[0]
-    y_indices = np.where((lat >= target_latitude - plot_range) & (lat <= target_latitude + plot_range))[0]
-    
-    # 抽出範囲を変化させる場合はコチラ
-    # Plot.py のアスペクト比の変更をあわせて推奨します。
-    #x_indices = np.where((lon >= target_longitude - (plot_range)) & (lon <= target_longitude + (plot_range)))[0]
-    #y_indices = np.where((lat >= target_latitude - plot_range*10) & (lat <= target_latitude + 0))[0]
+    # 第1段階 抽出範囲の行と列を求める
+    row_slice, col_slice = select_bounds(target_latitude, target_longitude, LINE_SAMPLES, LINES,
+                                         UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range)
+    
+    # 第2段階 抽出範囲のピクセル座標のみを緯度と経度に変換
+    lon = UPPER_LEFT_LONGITUDE + np.arange(col_slice.start, col_slice.stop) / MAP_RESOLUTION
+    lat = UPPER_LEFT_LATITUDE - np.arange(row_slice.start, row_slice.stop) / MAP_RESOLUTION
     
     # 第3段階 範囲内のデータを抽出
-    selected_x = x[y_indices[:, np.newaxis], x_indices]
-    selected_y = y[y_indices[:, np.newaxis], x_indices]
-    selected_data = elevation_data[y_indices[:, np.newaxis], x_indices]
+    # スライスによる抽出のため、コピーは作らない
+    selected_data = elevation_data[row_slice, col_slice]
+    # 緯度経度の格子は1次元配列のビュー（読み取り専用）
+    selected_x = np.broadcast_to(lon, selected_data.shape)
+    selected_y = np.broadcast_to(lat[:, np.newaxis], selected_data.shape)
     
     print("曲率補正中...")
     
     # 第4段階 曲率による標高補正
-    haversine_data = np.array([haversine_distance(elevation, LAT, LON, target_latitude, target_longitude)
-                            for elevation, LAT, LON in zip(selected_data.flatten(), selected_y.flatten(), selected_x.flatten())])
-    haversine_data = haversine_data.reshape(selected_data.shape)
+    # 抽出範囲全体を一括で補正する（float32 で出力）
+    with trace.stage("curvature_correction") as event:
+        haversine_data = curvature_correction(selected_data, lat[:, np.newaxis], lon,
+                                              target_latitude, target_longitude, dtype=np.float32)
+        event.arrays(haversine_data=haversine_data)
     
-    # データ間隔を調整する場合（結果のファイルサイズが大きくなりすぎる場合）
-    # データを1つ飛ばしで再調整する
-    """
-    haversine_data = haversine_data[::2, ::2]
-    selected_data = selected_data[::2, ::2]
-    selected_x = selected_x[::2, ::2]
-    selected_y = selected_y[::2, ::2]
-    """
+    # 結果のファイルサイズは Plot.plot_3d の頂点数の上限（VERTEX_BUDGET）で調整する
     return selected_data, selected_x, selected_y, haversine_data
 
 
@@ -113,14 +396,183 @@ def get_elevation_LRO(tif_name):
     script_directory = os.path.dirname(os.path.abspath(__file__))
     elevation_file_path = os.path.join(script_directory, "..", "data", tif_name)
     # tifffileで読み込む
+    # tifffile はネイティブエンディアンに変換済みの配列を返す
     data = tifffile.imread(elevation_file_path)
-    # エンディアン変換（ビッグエンディアンからリトルエンディアンへ）
-    data_endian = data.byteswap().newbyteorder()
-    # float 32 に変換
-    elevation_data = data_endian.astype('float32')
+    # float 32 に変換（すでに float 32 の場合はコピーしない）
+    elevation_data = data.astype('float32', copy=False)
     return elevation_data
 
 
+# LRO: 対象を中心とした抽出範囲の標高データだけを GeoTIFF から取得する
+def get_elevation_LRO_window(tif_name, LINE_SAMPLES, LINES, UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE,
+                             MAP_RESOLUTION, target_latitude, target_longitude, plot_range):
+    """
+    Args:
+    tif_name: ファイル名
+    LINE_SAMPLES, LINES: データサイズ
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: データ左上の緯度経度
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    target_latitude: 対象の緯度
+    target_longitude: 対象の経度
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    
+    Returns:
+    elevation_data: 抽出範囲を含む標高データ（float 32）
+    LINE_SAMPLES, LINES: 読み込んだデータのサイズ
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: 読み込んだデータ左上の緯度経度
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    
+    select_area にはデータ全体の代わりにこの戻り値をそのまま渡す。
+    """
+    
+    print("標高データ構築中...")
+    
+    # データにアクセス
+    script_directory = os.path.dirname(os.path.abspath(__file__))
+    elevation_file_path = os.path.join(script_directory, "..", "data", tif_name)
+    
+    # 広い描画範囲では、出力の解像度を満たす最も粗い概観データ（作成済みの場合）から読み込む
+    elevation_map, level_info = open_level(
+        elevation_file_path,
+        {"LINES": LINES, "LINE_SAMPLES": LINE_SAMPLES, "UPPER_LEFT_LATITUDE": UPPER_LEFT_LATITUDE,
+         "UPPER_LEFT_LONGITUDE": UPPER_LEFT_LONGITUDE, "MAP_RESOLUTION": MAP_RESOLUTION}, plot_range, target_latitude)
+    LINES, LINE_SAMPLES = level_info["LINES"], level_info["LINE_SAMPLES"]
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE = level_info["UPPER_LEFT_LATITUDE"], level_info["UPPER_LEFT_LONGITUDE"]
+    MAP_RESOLUTION = level_info["MAP_RESOLUTION"]
+    
+    row_slice, col_slice = window_bounds(target_latitude, target_longitude, LINE_SAMPLES, LINES,
+                                         UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range)
+    if elevation_map is not None:
+        elevation_data = read_window_cached(level_info["SOURCE"], elevation_map, row_slice, col_slice)
+    else:
+        elevation_data = read_tiff_window(elevation_file_path, row_slice, col_slice)
+    
+    # 読み込んだ範囲の左上の緯度経度
+    window_latitude = UPPER_LEFT_LATITUDE - row_slice.start / MAP_RESOLUTION
+    window_longitude = UPPER_LEFT_LONGITUDE + col_slice.start / MAP_RESOLUTION
+    return (elevation_data, elevation_data.shape[1], elevation_data.shape[0],
+            window_latitude, window_longitude, MAP_RESOLUTION)
+
+
+# GeoTIFF から抽出範囲を含むストリップ（又はタイル）だけを読み込む
+def read_tiff_window(tif_path, row_slice, col_slice):
+    """
+    Args:
+    tif_path: GeoTIFF のパス
+    row_slice: 抽出範囲の行
+    col_slice: 抽出範囲の列
+    
+    Return:
+    elevation_data: 抽出範囲の標高データ（ネイティブエンディアンの float 32）
+    """
+    
+    if not cache.CACHE_ACTIVE:
+        return read_tiff_region(tif_path, row_slice, col_slice)
+    
+    # ディスク上の保存領域が有効の場合は、タイル全体を一度だけ展開して以降はメモリマップで切り出す
+    if cache.DISK_CACHE_ACTIVE:
+        elevation_map = open_tiff_cached(tif_path)
+        return read_window_cached(tif_path, elevation_map, row_slice, col_slice)
+    
+    # 無効の場合は、読み込んだ抽出範囲だけをプロセス内キャッシュに保持する
+    key = ("window", cache.source_key(tif_path), row_slice.start, row_slice.stop, col_slice.start, col_slice.stop)
+    return cache.remember(key, lambda: read_tiff_region(tif_path, row_slice, col_slice))
+
+
+# GeoTIFF から指定した範囲を含むストリップ（又はタイル）だけを展開する（キャッシュを使わない）
+def read_tiff_region(tif_path, row_slice, col_slice):
+    """
+    Args:
+    tif_path: GeoTIFF のパス
+    row_slice: 読み込む範囲の行
+    col_slice: 読み込む範囲の列
+    
+    Return:
+    elevation_data: 範囲の標高データ（ネイティブエンディアンの float 32）
+    """
+    
+    with tifffile.TiffFile(tif_path) as tif:
+        page = tif.pages[0]
+        # ファイル上のデータ型（NAC DTM は float 32 big endian）
+        file_dtype = page.dtype.newbyteorder(tif.byteorder)
+        
+        # 非圧縮で連続している場合はメモリマップで範囲を直接切り出す
+        if page.is_contiguous:
+            elevation_map = np.memmap(tif_path, dtype=file_dtype, mode="r",
+                                      offset=page.dataoffsets[0], shape=page.shape[-2:])
+            # 読み込み、エンディアン変換、float 32 への変換を一度のコピーで行う
+            return np.array(elevation_map[row_slice, col_slice], dtype=np.float32)
+        
+        # 圧縮されている場合は、範囲に重なるストリップ（又はタイル）だけを展開する
+        rows = range(page.shape[-2])[row_slice]
+        cols = range(page.shape[-1])[col_slice]
+        elevation_data = np.empty((len(rows), len(cols)), dtype=np.float32)
+        decode_tiff_chunks(tif, page, rows, cols, elevation_data)
+        return elevation_data
+
+
+# GeoTIFF 全体を展開済みキャッシュから開く（初回のみ float 32 ネイティブエンディアンへ変換して保存する）
+def open_tiff_cached(tif_path):
+    """
+    Arg:
+    tif_path: GeoTIFF のパス
+    
+    Return:
+    elevation_map: 標高データのメモリマップ（float 32）
+    """
+    
+    with tifffile.TiffFile(tif_path) as tif:
+        shape = tif.pages[0].shape[-2:]
+    
+    def fill(out):
+        with tifffile.TiffFile(tif_path) as tif:
+            page = tif.pages[0]
+            if page.is_contiguous:
+                elevation_map = np.memmap(tif_path, dtype=page.dtype.newbyteorder(tif.byteorder), mode="r",
+                                          offset=page.dataoffsets[0], shape=page.shape[-2:])
+                copy_rows(elevation_map, out)
+            else:
+                decode_tiff_chunks(tif, page, range(shape[0]), range(shape[1]), out)
+    
+    return cache.load_tile(tif_path, shape, np.float32, fill)
+
+
+# 範囲に重なるストリップ（又はタイル）を展開して書き込む
+def decode_tiff_chunks(tif, page, rows, cols, out):
+    """
+    Args:
+    tif: 開いている TiffFile
+    page: 標高データのページ
+    rows: 書き込む範囲の行（range）
+    cols: 書き込む範囲の列（range）
+    out: 書き込み先の配列（rows, cols と同じ大きさ）
+    
+    Return:
+    None
+    """
+    
+    if len(rows) == 0 or len(cols) == 0:
+        return
+    
+    # ストリップは (rowsperstrip, 幅)、タイルは (tilelength, tilewidth) 単位
+    chunk_rows, chunk_cols = page.chunks[0], page.chunks[1]
+    chunks_across = page.chunked[1]
+    for chunk_y in range(rows.start // chunk_rows, (rows.stop - 1) // chunk_rows + 1):
+        for chunk_x in range(cols.start // chunk_cols, (cols.stop - 1) // chunk_cols + 1):
+            index = chunk_y * chunks_across + chunk_x
+            tif.filehandle.seek(page.dataoffsets[index])
+            chunk, position, _ = page.decode(tif.filehandle.read(page.databytecounts[index]), index,
+                                             jpegtables=page.jpegtables)
+            chunk = chunk.reshape(chunk.shape[-3], chunk.shape[-2])
+            top, left = position[-3], position[-2]
+            
+            # 範囲と重なる部分を貼り付ける
+            y0, y1 = max(rows.start, top), min(rows.stop, top + chunk.shape[0])
+            x0, x1 = max(cols.start, left), min(cols.stop, left + chunk.shape[1])
+            out[y0 - rows.start:y1 - rows.start, x0 - cols.start:x1 - cols.start] = \
+                chunk[y0 - top:y1 - top, x0 - left:x1 - left]
+
+
 # 標高データの曲率補正
 # 参考サイト： https://qiita.com/port-development/items/eea3a0a225be47db0fd4
 # 参考サイト： https://manabitimes.jp/math/1233
@@ -136,7 +588,7 @@ def haversine_distance(elevation, LAT, LON, target_latitude, target_longitude):
     Return: 
     haversine_elevation: 曲率補正後の標高
     """
-
+    
     # 月の半径 <m>
     R = 1737400
     # ラジアン変換
@@ -153,4 +605,71 @@ def haversine_distance(elevation, LAT, LON, target_latitude, target_longitude):
     # 曲率補正を適応する
     haversine_elevation = elevation - h
     
-    return haversine_elevation
\ No newline at end of file
+    return haversine_elevation
+
+
+# ピクセル間隔をメートル単位で求める
+def pixel_size(MAP_RESOLUTION, target_latitude):
+    """
+    Args:
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    target_latitude: ターゲット地点の緯度
+    
+    Returns:
+    dx: 列方向（東西）のピクセル間隔 <m>
+    dy: 行方向（南北）のピクセル間隔 <m>
+    """
+    
+    # 月の半径 <m>
+    R = 1737400
+    dy = R * math.pi / 180 / MAP_RESOLUTION
+    dx = dy * math.cos(math.radians(target_latitude))
+    return dx, dy
+
+
+# 標高データの曲率補正（配列一括版）
+# haversine_distance と同じ補正を NumPy で抽出範囲全体に対して行う
+def curvature_correction(elevation_data, LAT, LON, target_latitude, target_longitude,
+                         dtype=np.float64, out=None):
+    """
+    Args:
+    elevation_data: 計算対象の標高データ
+    LAT: 計算対象の緯度（elevation_data とブロードキャスト可能な配列）
+    LON: 計算対象の経度（elevation_data とブロードキャスト可能な配列）
+    target_latitude: ターゲット地点の緯度
+    target_longitude: ターゲット地点の経度
+    dtype: 出力のデータ型（np.float64 又は np.float32）
+    out: 出力先の配列。elevation_data 自身を渡すとその場で補正する
+    
+    Return:
+    haversine_data: 曲率補正後の標高データ
+    
+    haversine_distance との差は float64 出力で 1e-6 m 以内、
+    float32 出力では float32 への丸め誤差（標高の約 1e-7 倍、10,000 m で 1e-3 m 程度）以内。
+    """
+    
+    # 月の半径 <m>
+    R = 1737400
+    # ラジアン変換
+    rad = np.pi/180
+    LAT = np.asarray(LAT, dtype=np.float64) * rad
+    LON = np.asarray(LON, dtype=np.float64) * rad
+    target_LAT, target_LON = target_latitude*rad, target_longitude*rad
+    
+    # 2点間と月中心で構成される角度 theta を haversine の形で求める
+    # 1 - cos(theta) = 2 * (sin^2(緯度差/2) + cos(LAT)cos(target_LAT)sin^2(経度差/2))
+    # acos を経由しないため、theta が小さい場合も桁落ちしない
+    half_chord = np.sin((LON - target_LON) / 2)
+    half_chord *= half_chord
+    half_chord = half_chord * (np.cos(LAT) * math.cos(target_LAT))
+    half_chord += np.sin((LAT - target_LAT) / 2) ** 2
+    half_chord *= 2
+    # 標高差を求める <m>  h = R/cos(theta) - R
+    h = np.divide(half_chord, 1 - half_chord, out=half_chord)
+    h *= R
+    
+    # 曲率補正を適応する
+    if out is None:
+        out = np.empty(np.broadcast_shapes(np.shape(elevation_data), h.shape), dtype=dtype)
+    np.subtract(elevation_data, h, out=out)
+    return out
\ No newline at end of file
@@ -0,0 +1,263 @@
+# Batch.py
+
+"""
+ジョブ一覧（マニフェスト）に記載された複数のシミュレーションを対話なしで実行するモジュールです。
+ジョブはタイルごとにまとめられ、各グループがプロセスプールで並列に実行されます。
+This module runs the simulations listed in a manifest without user interaction.
+Jobs are grouped by tile and each group runs on a process pool.
+"""
+
+import os
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import Input as input
+import Tile as tile
+import Download as dl
+import Extent as extent
+import Simulation as sim
+
+# マニフェストの列名
+# latitude, longitude, sun_azimuth, sun_altdeg は必須
+# plot_range, width, height, smoothing, ortho, shadow, viewpoint, id は省略可能
+# width, height（東西、南北の大きさ <m>）を指定した場合は plot_range より優先する
+REQUIRED_FIELDS = ["latitude", "longitude", "sun_azimuth", "sun_altdeg"]
+
+
+# マニフェストを読み込む
+def read_manifest(manifest_path):
+    """
+    Arg:
+    manifest_path: マニフェスト（CSV 又は JSON）のパス
+    
+    Return:
+    jobs: ジョブの辞書のリスト
+    """
+    
+    print("ジョブ一覧の読み込み中...")
+    
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        if manifest_path.lower().endswith('.json'):
+            records = json.load(file)
+            # {"jobs": [...]} の形式にも対応する
+            if isinstance(records, dict):
+                records = records["jobs"]
+        else:
+            records = list(csv.DictReader(file))
+    
+    return [parse_job(record, number) for number, record in enumerate(records)]
+
+
+# 1件のジョブを検証し、シミュレーション条件に変換する
+def parse_job(record, number):
+    """
+    Args:
+    record: マニフェストの1行（辞書）
+    number: マニフェスト内の番号
+    
+    Return:
+    job: シミュレーション条件の辞書
+    """
+    
+    for field in REQUIRED_FIELDS:
+        if record.get(field) in (None, ""):
+            raise ValueError(f"ジョブ {number}: {field} が指定されていません。")
+    
+    job = {
+        "number": number,
+        "id": str(record.get("id") or number),
+        "latitude": float(record["latitude"]),
+        "longitude": float(record["longitude"]),
+        "sun_azimuth": float(record["sun_azimuth"]),
+        "sun_altdeg": float(record["sun_altdeg"]),
+        "smoothing": _parse_bool(record.get("smoothing")),
+        "ortho": _parse_bool(record.get("ortho")),
+        "shadow": _parse_bool(record.get("shadow")),
+    }
+    
+    # 描画範囲はプロット管理番号（"0" など）又は 東西x南北 <m>（"2000x1000" など）で指定する
+    try:
+        if record.get("width") not in (None, ""):
+            plot_range = extent.from_size(record["width"], record.get("height") or None)
+        else:
+            plot_range = extent.parse(record.get("plot_range") or 0)
+    except ValueError as e:
+        raise ValueError(f"ジョブ {job['id']}: {e}")
+    # プロット管理番号の場合は、結果一覧などに従来どおり番号で記録する
+    job["plot_range"] = plot_range if plot_range.preset is None else plot_range.preset
+    viewpoint = record.get("viewpoint")
+    job["viewpoint"] = float(viewpoint) if viewpoint not in (None, "") else input.default_viewpoint(job["plot_range"])
+    
+    # 対話モードと同じ範囲で検証する
+    if not (-90 <= job["latitude"] < 90 and 0 <= job["longitude"] < 360):
+        raise ValueError(f"ジョブ {job['id']}: 緯度経度が範囲外です。")
+    if not (0 <= job["sun_azimuth"] < 360 and 0 <= job["sun_altdeg"] <= 90):
+        raise ValueError(f"ジョブ {job['id']}: 太陽の方位又は仰角が範囲外です。")
+    return job
+
+
+# y/n, true/false, 1/0 を bool に変換する
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('y', 'yes', 'true', '1')
+
+
+# ターゲットを含むタイルごとにジョブをまとめる
+def group_jobs(jobs):
+    """
+    Arg:
+    jobs: ジョブの辞書のリスト
+    
+    Return:
+    groups: タイル名をキー、ジョブのリストを値とする辞書
+    """
+    
+    groups = {}
+    for job in jobs:
+        _, tile_name = tile.generate_name(job["latitude"], job["longitude"])
+        groups.setdefault(tile_name, []).append(job)
+    return groups
+
+
+# 1つのグループのジョブを順に実行する（ワーカープロセス内）
+# 同じプロセスで実行するため、タイルのメモリマップとlblファイルの情報は使い回される
+def run_group(jobs):
+    """
+    Arg:
+    jobs: 同じタイルのジョブのリスト
+    
+    Return:
+    results: ジョブごとの結果の辞書のリスト
+    """
+    
+    results = []
+    for job in jobs:
+        start = time.perf_counter()
+        result = job_result(job)
+        try:
+            result["output"] = sim.simulate(job["latitude"], job["longitude"], job["sun_azimuth"], job["sun_altdeg"],
+                                            job["smoothing"], job["plot_range"], job["viewpoint"], job["ortho"],
+                                            open_browser=False, shadow_active=job["shadow"])
+            result["status"] = "ok"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        results.append(result)
+    return results
+
+
+# 結果一覧に記録するジョブの条件
+def job_result(job, error=None):
+    """
+    Args:
+    job: ジョブの辞書
+    error: 実行前に失敗した場合のエラー（指定した場合は status を "error" とする）
+    
+    Return:
+    result: 結果の辞書
+    """
+    
+    result = {"number": job["number"], "id": job["id"], "latitude": job["latitude"], "longitude": job["longitude"],
+              "sun_azimuth": job["sun_azimuth"], "sun_altdeg": job["sun_altdeg"], "plot_range": job["plot_range"]}
+    if error is not None:
+        result["status"] = "error"
+        result["error"] = f"{type(error).__name__}: {error}"
+        result["seconds"] = 0.0
+    return result
+
+
+# ジョブに必要なタイルをダウンロードする
+def download_job_tiles(job, failures):
+    """
+    Args:
+    job: ジョブの辞書
+    failures: 失敗したファイル組とエラーの辞書（同じタイルを何度も試さないように、ジョブの間で共有する）
+    
+    Return:
+    None（失敗した場合は Download.DownloadError）
+    """
+    
+    lat_range, lon_range = extent.half_range_deg(job["plot_range"], job["latitude"])
+    for prefix, tile_name, _, _ in tile.generate_names_area(job["latitude"] - lat_range, job["latitude"] + lat_range,
+                                                            job["longitude"] - lon_range, job["longitude"] + lon_range):
+        downloads = [("DTM", dl.download_data)] + ([("TCO", dl.download_ortho)] if job["ortho"] else [])
+        for kind, download in downloads:
+            if (kind, tile_name) in failures:
+                raise failures[(kind, tile_name)]
+            try:
+                download(prefix, tile_name)
+            except dl.DownloadError as e:
+                failures[(kind, tile_name)] = e
+                raise
+
+
+# マニフェストのジョブをすべて実行する
+def run_batch(manifest_path, workers=None, summary_path=None):
+    """
+    Args:
+    manifest_path: マニフェスト（CSV 又は JSON）のパス
+    workers: 並列プロセス数（None の場合は CPU 数）
+    summary_path: 結果一覧（JSON）の保存先（None の場合は result ディレクトリ）
+    
+    Return:
+    results: ジョブごとの結果の辞書のリスト
+    """
+    
+    batch_start = time.perf_counter()
+    jobs = read_manifest(manifest_path)
+    groups = group_jobs(jobs)
+    print(f"{len(jobs)} 件のジョブを {len(groups)} タイルにまとめました。")
+    
+    # ワーカー同士が同じファイルを書き込まないように、必要なタイルを先にダウンロードする
+    # ダウンロードに失敗したジョブは失敗として記録し、他のジョブは続ける
+    print("タイルの事前ダウンロード中...")
+    results = []
+    failures = {}
+    pending = []
+    for group in groups.values():
+        runnable = []
+        for job in group:
+            try:
+                download_job_tiles(job, failures)
+                runnable.append(job)
+            except dl.DownloadError as e:
+                result = job_result(job, e)
+                print(f"[{result['status']}] job {result['id']} ({result['error']})")
+                results.append(result)
+        if runnable:
+            pending.append(runnable)
+    
+    # タイルのグループごとにプロセスプールで実行する
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_group, group): group for group in pending}
+        for future in as_completed(futures):
+            try:
+                group_results = future.result()
+            except Exception as e:
+                # ワーカーが異常終了した場合も、グループのジョブを失敗として結果一覧に残す
+                group_results = [job_result(job, e) for job in futures[future]]
+            for result in group_results:
+                print(f"[{result['status']}] job {result['id']} ({result['seconds']} s)")
+                results.append(result)
+    
+    # 結果一覧を保存する
+    results.sort(key=lambda result: result["number"])
+    summary = {
+        "manifest": os.path.abspath(manifest_path),
+        "jobs": len(jobs),
+        "tiles": len(groups),
+        "failed": sum(result["status"] != "ok" for result in results),
+        "seconds": round(time.perf_counter() - batch_start, 3),
+        "results": results,
+    }
+    if summary_path is None:
+        summary_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "result",
+                                    time.strftime("HVTS_BATCH_%Y%m%d_%H%M%S.json"))
+    with open(summary_path, 'w', encoding='utf-8') as file:
+        json.dump(summary, file, ensure_ascii=False, indent=2)
+    print(f"結果一覧を保存しました: {summary_path}")
+    return results
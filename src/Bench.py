@@ -0,0 +1,304 @@
+# Bench.py
+
+"""
+合成した標高データを使って、処理の段階ごとの所要時間を計測するモジュールです。
+実際の KAGUYA / LRO のデータをダウンロードせずに性能を比較できます。
+This module benchmarks every pipeline stage on synthetic DEM fixtures and writes the timings to a JSON file.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import contextlib
+import numpy as np
+import tifffile
+
+import Area as area
+import Effect as ef
+import Plot as pl
+import Save as sv
+import Cache as cache
+import Input as input
+import ImportCheck as importcheck
+
+# 合成データの保存先（Area.get_elevation_LRO が data からの相対パスで読むため data 内に置く）
+BENCH_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "bench")
+# 合成データのファイル名
+KAGUYA_NAME = "DTM_MAPs02_BENCH"
+LRO_NAME = "NAC_DTM_BENCH"
+# 合成データの位置（対象はデータの中央）
+KAGUYA_UPPER_LEFT = (3.0, 30.0)
+LRO_UPPER_LEFT = (-12.5816902, 25.0548146)
+LRO_RESOLUTION = 10107.78347472
+# 計測する描画範囲
+PLOT_RANGES = [0, 1, 2, 3]
+
+
+# 起伏のある合成地形を作る（クレーター状の窪みと緩やかな起伏）
+def synthetic_terrain(lines, samples, seed=0):
+    """
+    Args:
+    lines, samples: データサイズ
+    seed: 乱数の種
+    
+    Return:
+    terrain: 標高 <m>（float 32）
+    """
+    
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, lines, dtype=np.float32)[:, np.newaxis]
+    x = np.linspace(0, 1, samples, dtype=np.float32)[np.newaxis, :]
+    terrain = 400 * np.sin(7 * x) * np.cos(5 * y) + 80 * np.sin(53 * x + 31 * y)
+    for _ in range(20):
+        cy, cx, radius = rng.random(), rng.random(), rng.uniform(0.01, 0.08)
+        distance = np.sqrt((x - cx) ** 2 + (y - cy) ** 2) / radius
+        terrain -= 300 * radius / 0.08 * np.clip(1 - distance ** 2, 0, None)
+    return terrain.astype(np.float32)
+
+
+# KAGUYA 形式の合成データ（16bit 符号付き整数 big endian の .img と PDS3 ラベル）を作る
+def make_kaguya_fixture(directory, resolution):
+    """
+    Args:
+    directory: 保存先
+    resolution: マップスケーリング係数 <pixel/deg>（タイルは3度四方）
+    
+    Returns:
+    img_path: .img のパス
+    lbl_path: .lbl のパス
+    """
+    
+    size = int(3 * resolution)
+    img_path = os.path.join(directory, KAGUYA_NAME + ".img")
+    lbl_path = os.path.join(directory, KAGUYA_NAME + ".lbl")
+    synthetic_terrain(size, size).astype(">i2").tofile(img_path)
+    with open(lbl_path, 'w') as file:
+        file.write("PDS_VERSION_ID = PDS3\n"
+                   f"^IMAGE = \"{KAGUYA_NAME}.img\"\n"
+                   "OBJECT = IMAGE\n"
+                   f"  LINES = {size}\n"
+                   f"  LINE_SAMPLES = {size}\n"
+                   "  SAMPLE_TYPE = MSB_INTEGER\n"
+                   "  SAMPLE_BITS = 16\n"
+                   "END_OBJECT = IMAGE\n"
+                   "OBJECT = IMAGE_MAP_PROJECTION\n"
+                   f"  UPPER_LEFT_LATITUDE = {KAGUYA_UPPER_LEFT[0]} <deg>\n"
+                   f"  UPPER_LEFT_LONGITUDE = {KAGUYA_UPPER_LEFT[1]} <deg>\n"
+                   f"  MAP_RESOLUTION = {resolution} <pix/deg>\n"
+                   "END_OBJECT = IMAGE_MAP_PROJECTION\n"
+                   "END\n")
+    return img_path, lbl_path
+
+
+# LRO NAC DTM 形式の合成データ（float 32 big endian の GeoTIFF とラベル）を作る
+def make_lro_fixture(directory, lines, samples):
+    """
+    Args:
+    directory: 保存先
+    lines, samples: データサイズ
+    
+    Returns:
+    tif_path: .tif のパス
+    lbl_path: .LBL のパス
+    """
+    
+    tif_path = os.path.join(directory, LRO_NAME + ".tif")
+    lbl_path = os.path.join(directory, LRO_NAME + ".LBL")
+    tifffile.imwrite(tif_path, synthetic_terrain(lines, samples, seed=1).astype(">f4"), byteorder=">",
+                     rowsperstrip=64)
+    with open(lbl_path, 'w') as file:
+        file.write("PDS_VERSION_ID = PDS3\n"
+                   "OBJECT = IMAGE\n"
+                   f"  LINES = {lines}\n"
+                   f"  LINE_SAMPLES = {samples}\n"
+                   "  SAMPLE_TYPE = IEEE_REAL\n"
+                   "  SAMPLE_BITS = 32\n"
+                   "END_OBJECT = IMAGE\n"
+                   "OBJECT = IMAGE_MAP_PROJECTION\n"
+                   f"  MAXIMUM_LATITUDE = {LRO_UPPER_LEFT[0]} <DEG>\n"
+                   f"  WESTERNMOST_LONGITUDE = {LRO_UPPER_LEFT[1]} <DEG>\n"
+                   f"  MAP_RESOLUTION = {LRO_RESOLUTION} <PIX/DEG>\n"
+                   "END_OBJECT = IMAGE_MAP_PROJECTION\n"
+                   "END\n")
+    return tif_path, lbl_path
+
+
+# 関数の所要時間を計測する（処理中の表示は抑制する）
+def time_stage(function, repeat):
+    """
+    Args:
+    function: 引数なしで呼び出す関数
+    repeat: 繰り返し回数
+    
+    Returns:
+    result: 最後の呼び出しの戻り値
+    timings: 各回の所要時間 <s>
+    """
+    
+    timings = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+# 計測結果を記録する
+def record(results, dataset, stage, plot_range, timings, shape=None):
+    entry = {
+        "dataset": dataset,
+        "stage": stage,
+        "plot_range": plot_range,
+        "repeat": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "shape": list(shape) if shape is not None else None,
+    }
+    results.append(entry)
+    range_txt = "-" if plot_range is None else plot_range
+    print(f"{dataset:7} {stage:26} {range_txt:>2}  min {entry['min'] * 1000:9.2f} ms  "
+          f"median {entry['median'] * 1000:9.2f} ms")
+
+
+# 描画範囲ごとに、抽出から保存までの各段階を計測する
+def bench_pipeline(results, dataset, elevation_data, target_latitude, target_longitude, LINE_SAMPLES, LINES,
+                   UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, repeat):
+    for plot_range in PLOT_RANGES:
+        (selected_data, selected_x, selected_y, haversine_data), timings = time_stage(
+            lambda: area.select_area(elevation_data, target_latitude, target_longitude, LINE_SAMPLES, LINES,
+                                     UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range), repeat)
+        record(results, dataset, "select_area", plot_range, timings, haversine_data.shape)
+    
+        hillshade, timings = time_stage(lambda: ef.calculate_hillshade(haversine_data, 90, 20), repeat)
+        record(results, dataset, "calculate_hillshade", plot_range, timings, hillshade.shape)
+    
+        _, timings = time_stage(lambda: ef.smoothing_data(haversine_data), repeat)
+        record(results, dataset, "smoothing_data", plot_range, timings, haversine_data.shape)
+    
+        fig, timings = time_stage(
+            lambda: pl.plot_3d(selected_data, haversine_data, hillshade, selected_x, selected_y,
+                               target_latitude, target_longitude, 90, 20, plot_range,
+                               input.default_viewpoint(plot_range), False, False), repeat)
+        record(results, dataset, "plot_3d", plot_range, timings, haversine_data.shape)
+    
+        def save():
+            save_filename = sv.save_expand(fig, target_latitude, target_longitude, 90, 20, False, False, plot_range,
+                                           open_browser=False)
+            nbytes = os.path.getsize(save_filename)
+            os.remove(save_filename)
+            return nbytes
+        nbytes, timings = time_stage(save, repeat)
+        record(results, dataset, "save_expand", plot_range, timings, haversine_data.shape)
+        results[-1]["bytes"] = nbytes
+
+
+# すべての段階を計測する
+def run_bench(resolution=1024, lro_size=(4096, 2048), repeat=3, output_path=None, keep=False):
+    """
+    Args:
+    resolution: KAGUYA 形式の合成データのマップスケーリング係数 <pixel/deg>
+    lro_size: LRO 形式の合成データのサイズ (LINES, LINE_SAMPLES)
+    repeat: 各段階の繰り返し回数
+    output_path: 計測結果（JSON）の保存先（None の場合は result ディレクトリ）
+    keep: 合成データを削除せずに残すか
+    
+    Return:
+    output_path: 計測結果の保存先
+    """
+    
+    print("起動時の読み込み時間の計測中...")
+    import_results = importcheck.check_import_budget()
+    
+    print("合成データの作成中...")
+    os.makedirs(BENCH_DIRECTORY, exist_ok=True)
+    img_path, _ = make_kaguya_fixture(BENCH_DIRECTORY, resolution)
+    tif_path, _ = make_lro_fixture(BENCH_DIRECTORY, *lro_size)
+    tif_name = os.path.relpath(tif_path, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data"))
+    
+    # キャッシュの有無で結果が変わらないように、計測中は元のファイルから読み込む
+    cache_active = cache.CACHE_ACTIVE
+    cache.CACHE_ACTIVE = False
+    results = []
+    try:
+        print("計測中...")
+        # KAGUYA: タイル全体の読み込み、描画範囲の読み込み、以降の各段階
+        size = int(3 * resolution)
+        latitude = KAGUYA_UPPER_LEFT[0] - size / 2 / resolution
+        longitude = KAGUYA_UPPER_LEFT[1] + size / 2 / resolution
+        elevation_data, timings = time_stage(lambda: area.get_elevation(img_path, size, size), repeat)
+        record(results, "KAGUYA", "get_elevation", None, timings, elevation_data.shape)
+        for plot_range in PLOT_RANGES:
+            window, timings = time_stage(
+                lambda: area.get_elevation_window(img_path, size, size, *KAGUYA_UPPER_LEFT, resolution,
+                                                  latitude, longitude, plot_range), repeat)
+            record(results, "KAGUYA", "get_elevation_window", plot_range, timings, window[0].shape)
+        bench_pipeline(results, "KAGUYA", elevation_data, latitude, longitude, size, size,
+                       *KAGUYA_UPPER_LEFT, resolution, repeat)
+    
+        # LRO: GeoTIFF 全体の読み込み、描画範囲の読み込み、以降の各段階
+        lines, samples = lro_size
+        latitude = LRO_UPPER_LEFT[0] - lines / 2 / LRO_RESOLUTION
+        longitude = LRO_UPPER_LEFT[1] + samples / 2 / LRO_RESOLUTION
+        elevation_data, timings = time_stage(lambda: area.get_elevation_LRO(tif_name), repeat)
+        record(results, "LRO", "get_elevation_LRO", None, timings, elevation_data.shape)
+        for plot_range in PLOT_RANGES:
+            window, timings = time_stage(
+                lambda: area.get_elevation_LRO_window(tif_name, samples, lines, *LRO_UPPER_LEFT, LRO_RESOLUTION,
+                                                      latitude, longitude, plot_range), repeat)
+            record(results, "LRO", "get_elevation_LRO_window", plot_range, timings, window[0].shape)
+        bench_pipeline(results, "LRO", elevation_data, latitude, longitude, samples, lines,
+                       *LRO_UPPER_LEFT, LRO_RESOLUTION, repeat)
+    finally:
+        cache.CACHE_ACTIVE = cache_active
+        if not keep:
+            shutil.rmtree(BENCH_DIRECTORY, ignore_errors=True)
+    
+    # 計測結果を保存する
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {"resolution": resolution, "lro_size": list(lro_size), "repeat": repeat},
+        "import_time": import_results,
+        "results": results,
+    }
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "result",
+                                   time.strftime("HVTS_BENCH_%Y%m%d_%H%M%S.json"))
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"計測結果を保存しました: {output_path}")
+    return output_path
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="合成データによる処理時間の計測")
+    parser.add_argument("--resolution", type=float, default=1024,
+                        help="KAGUYA 形式の合成データのマップスケーリング係数 <pixel/deg>（実データは 4096）")
+    parser.add_argument("--lro-size", type=int, nargs=2, default=[4096, 2048], metavar=("LINES", "LINE_SAMPLES"),
+                        help="LRO 形式の合成データのサイズ")
+    parser.add_argument("--repeat", type=int, default=3, help="各段階の繰り返し回数")
+    parser.add_argument("--output", help="計測結果（JSON）の保存先")
+    parser.add_argument("--keep", action="store_true", help="合成データを削除せずに残す")
+    parser.add_argument("--import-only", action="store_true",
+                        help="起動時の読み込み時間のみを確認する（上限を超えた場合は終了コード 1）")
+    parser.add_argument("--import-budget", type=float, default=importcheck.IMPORT_BUDGET, help="起動時の読み込み時間の上限 <s>")
+    args = parser.parse_args()
+    
+    if args.import_only:
+        import_results = importcheck.check_import_budget(budget=args.import_budget)
+        sys.exit(0 if all(result["passed"] for result in import_results) else 1)
+    
+    run_bench(args.resolution, tuple(args.lro_size), args.repeat, args.output, args.keep)
@@ -0,0 +1,283 @@
+# Cache.py
+
+"""
+展開済みの標高データを保持するキャッシュのモジュールです。
+プロセス内の LRU キャッシュ（容量上限つき）と、ネイティブエンディアンに変換済みのタイルをメモリマップで開けるディスク上の保存領域（任意）の2段構成です。
+ディスク上の保存領域は初回の読み込みがタイル全体の変換となり、抽出範囲だけを読む初回の処理より遅くなるため、既定では無効です。
+有効にすると、別のプロセスでも2回目以降は変換を行わずにメモリマップで開けます（環境変数 HVTS_DISK_CACHE=1 又は DISK_CACHE_ACTIVE）。
+This module caches decoded elevation data in two levels:
+an in-process LRU with a byte budget and an opt-in on-disk store of native-endian tiles that can be memory-mapped.
+The disk store is off by default because filling it decodes the whole tile on the first read, while a cold read
+otherwise touches only the window; without it a new process decodes its windows again.
+Set HVTS_DISK_CACHE=1 (or DISK_CACHE_ACTIVE) to let new processes skip decoding.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# キャッシュの有効化（無効の場合は毎回元のファイルから読み込む）
+CACHE_ACTIVE = True
+# タイル全体をディスク上の保存領域へ展開するか（初回の読み込みがタイル全体の変換になるため、既定では無効）
+# 無効の場合も、読み込んだ抽出範囲はプロセス内キャッシュに保持する
+# 環境変数 HVTS_DISK_CACHE=1 で有効にできる（バッチモードのワーカープロセスにも引き継がれる）
+DISK_CACHE_ACTIVE = os.environ.get("HVTS_DISK_CACHE", "0").strip().lower() in ("1", "y", "yes", "true")
+# 保存先の設定
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache")
+# プロセス内キャッシュの容量上限 <byte>（メモリマップは容量に含めない）
+MEMORY_BUDGET = 256 * 1024 * 1024
+# ディスク上の保存領域の容量上限 <byte>
+DISK_BUDGET = 8 * 1024 * 1024 * 1024
+
+# プロセス内キャッシュ
+# キー: (配列, 容量)、最後に使用したものが末尾
+_memory = OrderedDict()
+_memory_bytes = 0
+# プロセス内キャッシュの排他制御（Server.py などで複数のスレッドから使う場合に備える）
+_memory_lock = threading.Lock()
+# 読み込み中のキーごとの排他制御（同じタイルを同時に展開しないようにする）
+_loading_locks = {}
+
+
+# 元のファイルのパス、更新時刻、サイズからキーを作る
+def source_key(source_path):
+    """
+    Arg:
+    source_path: 元のファイルのパス
+    
+    Return:
+    key: キャッシュのキー（ファイルが更新されると変わる）
+    """
+    
+    stat = os.stat(source_path)
+    text = f"{os.path.abspath(source_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+# プロセス内キャッシュから取り出す（ない場合は読み込んで保持する）
+def remember(key, load):
+    """
+    Args:
+    key: キャッシュのキー
+    load: キャッシュにない場合に配列を返す関数
+    
+    Return:
+    array: 配列（書き込み不可）
+    """
+    
+    global _memory_bytes
+    
+    with _memory_lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key][0]
+        loading_lock = _loading_locks.setdefault(key, threading.Lock())
+    
+    # 同じキーは1つのスレッドだけが読み込み、他のスレッドはその結果を使う
+    try:
+        with loading_lock:
+            with _memory_lock:
+                if key in _memory:
+                    _memory.move_to_end(key)
+                    return _memory[key][0]
+            
+            array = load()
+            array.flags.writeable = False
+            # メモリマップはファイルを参照するだけなので容量に含めない
+            nbytes = 0 if isinstance(array, np.memmap) else array.nbytes
+            
+            with _memory_lock:
+                _memory[key] = (array, nbytes)
+                _memory_bytes += nbytes
+                
+                # 容量を超えた場合は、最も長く使用されていないものから削除する
+                while _memory_bytes > MEMORY_BUDGET and len(_memory) > 1:
+                    _, (_, evicted_bytes) = _memory.popitem(last=False)
+                    _memory_bytes -= evicted_bytes
+    finally:
+        # 読み込みに失敗した場合も排他制御を残さない
+        with _memory_lock:
+            _loading_locks.pop(key, None)
+    return array
+
+
+# 展開済みのタイルを読み込む（ない場合は展開してディスクに保存する）
+def load_tile(source_path, shape, dtype, fill):
+    """
+    Args:
+    source_path: 元のファイルのパス
+    shape: タイルの形状
+    dtype: 展開後のデータ型（ネイティブエンディアン）
+    fill: 書き込み先の配列を受け取り、展開したデータを書き込む関数
+    
+    Return:
+    tile: 展開済みのタイル（読み取り専用のメモリマップ）
+    """
+    
+    key = source_key(source_path)
+    return remember(("tile", key), lambda: _load_tile_from_disk(source_path, key, shape, dtype, fill))
+
+
+def _load_tile_from_disk(source_path, key, shape, dtype, fill):
+    tile_path = os.path.join(CACHE_DIRECTORY, key + ".npy")
+    meta_path = os.path.join(CACHE_DIRECTORY, key + ".json")
+    
+    # 保存済みの場合は展開せずにメモリマップとして開く
+    # 他のプロセスが同時に削除した場合や、索引が読めない場合は保存されていないものとして扱う
+    meta = read_meta(meta_path)
+    if meta is not None:
+        try:
+            tile = np.load(tile_path, mmap_mode="r")
+        except (OSError, ValueError):
+            tile = None
+        if tile is not None:
+            meta["last_used"] = time.time()
+            write_json(meta_path, meta)
+            return tile
+    
+    print("展開済みタイルの保存中...")
+    
+    # 書き込み途中のファイルが残らないように、プロセスごとに別名の一時ファイルに展開してから置き換える
+    # 更新前の同じファイルの保存は、他のプロセスが開いている場合があるためここでは削除せず、容量上限による削除に任せる
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    partial_path = temporary_path(tile_path)
+    try:
+        tile = np.lib.format.open_memmap(partial_path, mode="w+", dtype=np.dtype(dtype).newbyteorder("="),
+                                         shape=tuple(shape))
+        fill(tile)
+        tile.flush()
+        del tile
+        os.replace(partial_path, tile_path)
+    except BaseException:
+        _remove_file(partial_path)
+        raise
+    
+    stat = os.stat(source_path)
+    meta = {"source": os.path.abspath(source_path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+            "shape": list(shape), "dtype": np.dtype(dtype).newbyteorder("=").str,
+            "nbytes": os.path.getsize(tile_path), "last_used": time.time()}
+    write_json(meta_path, meta)
+    
+    evict_disk(DISK_BUDGET)
+    return np.load(tile_path, mmap_mode="r")
+
+
+# ディスク上の保存領域を容量上限まで削除する（最も長く使用されていないものから）
+def evict_disk(budget=DISK_BUDGET, directory=CACHE_DIRECTORY):
+    """
+    Args:
+    budget: 容量上限 <byte>
+    directory: 保存先（.npy と、nbytes, last_used を含む .json の組を保存するディレクトリ）
+    
+    Return:
+    None
+    
+    他のプロセスがメモリマップで開いている保存も削除する場合がある。
+    POSIX では削除後も開いているメモリマップは有効なまま残り、Windows では使用中のファイルの削除は失敗するため残す。
+    """
+    
+    entries = sorted(_disk_entries(directory), key=lambda entry: entry[1].get("last_used", 0))
+    total = sum(meta.get("nbytes", 0) for _, meta in entries)
+    # 最新の1件は残す
+    for entry_key, meta in entries[:-1]:
+        if total <= budget:
+            break
+        if _remove_entry(entry_key, directory):
+            total -= meta.get("nbytes", 0)
+
+
+# プロセス内キャッシュを空にする
+def clear_memory():
+    global _memory_bytes
+    with _memory_lock:
+        _memory.clear()
+        _memory_bytes = 0
+
+
+# 保存先と同じディレクトリに、他のプロセスと重ならない一時ファイルを作る
+def temporary_path(path):
+    """
+    Arg:
+    path: 最終的な保存先のパス
+    
+    Return:
+    partial_path: 一時ファイルのパス（os.replace で保存先に置き換える）
+    """
+    
+    descriptor, partial_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".part",
+                                                dir=os.path.dirname(path))
+    os.close(descriptor)
+    return partial_path
+
+
+# JSON を一時ファイルに書いてから置き換える（読み込み側が書き込み途中の内容を読まないようにする）
+def write_json(path, data):
+    """
+    Args:
+    path: 保存先のパス
+    data: 保存する内容
+    
+    Return:
+    None
+    """
+    
+    partial_path = temporary_path(path)
+    try:
+        with open(partial_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=2)
+        os.replace(partial_path, path)
+    except BaseException:
+        _remove_file(partial_path)
+        raise
+
+
+# 索引の JSON を読み込む（ない場合、壊れている場合は None）
+def read_meta(meta_path):
+    """
+    Arg:
+    meta_path: 索引のパス
+    
+    Return:
+    meta: 索引の内容
+    """
+    
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return meta if isinstance(meta, dict) else None
+
+
+def _disk_entries(directory=CACHE_DIRECTORY):
+    if not os.path.isdir(directory):
+        return []
+    entries = []
+    for filename in os.listdir(directory):
+        if filename.endswith(".json"):
+            meta = read_meta(os.path.join(directory, filename))
+            if meta is not None:
+                entries.append((filename[:-5], meta))
+    return entries
+
+
+def _remove_entry(key, directory=CACHE_DIRECTORY):
+    # 使用中で削除できない場合は、次回の削除で再び対象になるように索引を残す
+    if not _remove_file(os.path.join(directory, key + ".npy")):
+        return False
+    return _remove_file(os.path.join(directory, key + ".json"))
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False
+    return True
@@ -6,8 +6,61 @@ This module downloads the two corresponding files (elevation data and label file
 """
 
 import os
-import requests
-import sys
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import Read_lbl as read
+import Lazy as lazy
+
+# requests はダウンロードする時点で読み込む
+requests = lazy.lazy_import("requests")
+
+# ダウンロード元の設定（環境変数で変更可能、ローカルのサーバーで試す場合など）
+DTM_BASE_URL = os.environ.get("HVTS_DTM_BASE_URL",
+                              "https://data.darts.isas.jaxa.jp/pub/pds3/sln-l-tc-5-dtm-map-seamless-v2.0")
+ORTHO_BASE_URL = os.environ.get("HVTS_ORTHO_BASE_URL",
+                                "https://data.darts.isas.jaxa.jp/pub/pds3/sln-l-tc-5-ortho-map-seamless-v2.0")
+# 一度に書き込むバイト数
+CHUNK_SIZE = 1024 * 1024
+# 接続と読み込みのタイムアウト <s>
+TIMEOUT = (10, 60)
+# 同時に接続する数の上限
+POOL_SIZE = 16
+
+# 保存先の設定
+script_directory = os.path.dirname(os.path.abspath(__file__))
+save_directory = os.path.join(script_directory, "..", "data")
+
+# 接続を使い回すためのセッション（スレッド間で共有する）
+_session = None
+_session_lock = threading.Lock()
+# ファイルごとの排他制御（Server.py などで同じタイルを複数のスレッドから同時に受信しないようにする）
+_pair_locks = {}
+
+
+class DownloadError(Exception):
+    """
+    ダウンロード又はラベルとの照合に失敗した場合の例外です。
+    終了するかどうかは呼び出し側（main.py など）で判断します。
+    """
+
+
+# 共有のセッションを取得する
+def get_session():
+    """
+    Return:
+    session: 接続を使い回すセッション
+    """
+    
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
 
 # 対象のファイルをダウンロードする
 def download_data(prefix, name):
@@ -21,51 +74,90 @@ def download_data(prefix, name):
     lbl_filename: lblファイルの名前
     """
     
-    # URLの構築
-    base_url = f'https://data.darts.isas.jaxa.jp/pub/pds3/sln-l-tc-5-dtm-map-seamless-v2.0/{prefix}/data/'
-    img_url = base_url + f'DTM_MAPs02_{name}SC.img'
-    lbl_url = base_url + f'DTM_MAPs02_{name}SC.lbl'
+    return download_pair(DTM_BASE_URL, prefix, f'DTM_MAPs02_{name}SC')
+
+
+# 対象のオルソをダウンロードする
+def download_ortho(prefix, name):
+    """
+    Args:
+    prefix: 経度の分類
+    name: タイルの名前
     
-    # 保存先の設定
-    script_directory = os.path.dirname(os.path.abspath(__file__))
-    save_directory = os.path.join(script_directory, "..", "data")
+    Returns:
+    img_filename: imgファイルの名前
+    lbl_filename: lblファイルの名前
+    """
+    
+    return download_pair(ORTHO_BASE_URL, prefix, f'TCO_MAPs02_{name}SC')
+
 
-    # ダウンロードするファイル名を指定
-    img_filename = os.path.join(save_directory, f'DTM_MAPs02_{name}SC.img')
-    lbl_filename = os.path.join(save_directory, f'DTM_MAPs02_{name}SC.lbl')
+# imgとlblを同時にダウンロードし、ラベルの記載と照合する
+def download_pair(base_url, prefix, stem):
+    """
+    Args:
+    base_url: ダウンロード元
+    prefix: 経度の分類
+    stem: 拡張子を除いたファイル名
     
-    # すでにファイルが存在する場合はダウンロードを中止して、続行
-    if os.path.exists(img_filename) or os.path.exists(lbl_filename):
-        print(f'[{img_filename}] or [{lbl_filename}] already exists. Abort download.')
-        return img_filename, lbl_filename
+    Returns:
+    img_filename: imgファイルの名前
+    lbl_filename: lblファイルの名前
+    
+    失敗した場合は DownloadError を送出する。
+    """
+    
+    img_filename, lbl_filename = tile_paths(stem)
+    with _session_lock:
+        pair_lock = _pair_locks.setdefault(stem, threading.Lock())
+    with pair_lock:
+        return _download_pair(base_url, prefix, stem, img_filename, lbl_filename)
+
 
+def _download_pair(base_url, prefix, stem, img_filename, lbl_filename):
+    # すでに正しいファイルが存在する場合はダウンロードを中止して、続行
+    if is_complete(img_filename, lbl_filename):
+        print(f'[{img_filename}] and [{lbl_filename}] already exist. Abort download.')
+        return img_filename, lbl_filename
+    
     try:
-        # imgをダウンロード
-        img_response = requests.get(img_url)
-        with open(img_filename, 'wb') as img_file:
-            img_file.write(img_response.content)
+        fetch_pair(base_url, prefix, stem)
         print(f'{img_filename} ダウンロード成功')
-
-        # lblをダウンロード
-        lbl_response = requests.get(lbl_url)
-        with open(lbl_filename, 'wb') as lbl_file:
-            lbl_file.write(lbl_response.content)
         print(f'{lbl_filename} ダウンロード成功')
         
         # ダウンロードしたファイルのパスを返す
         return img_filename, lbl_filename
-
-    except requests.RequestException as e:
+    
+    except (requests.RequestException, ValueError, OSError) as e:
+        # 容量不足や権限の不足（OSError）も、通信の失敗と同じく呼び出し側に通知する
         print(f'Error: {e}')
-        # エラーが発生した場合、プログラムを終了
-        sys.exit()
+        # エラーが発生した場合は呼び出し側に通知する（サーバーやバッチモードでは他の処理を続ける）
+        raise DownloadError(f'{stem}: {e}') from e
 
-# 対象のオルソをダウンロードする
-def download_ortho(prefix, name):
+
+# 保存先のファイル名を求める
+def tile_paths(stem):
+    """
+    Arg:
+    stem: 拡張子を除いたファイル名
+    
+    Returns:
+    img_filename: imgファイルの名前
+    lbl_filename: lblファイルの名前
+    """
+    
+    img_filename = os.path.join(save_directory, f'{stem}.img')
+    lbl_filename = os.path.join(save_directory, f'{stem}.lbl')
+    return img_filename, lbl_filename
+
+
+# imgとlblを同時にダウンロードして照合する（失敗した場合は例外を送出する）
+def fetch_pair(base_url, prefix, stem):
     """
     Args:
+    base_url: ダウンロード元
     prefix: 経度の分類
-    name: タイルの名前
+    stem: 拡張子を除いたファイル名
     
     Returns:
     img_filename: imgファイルの名前
@@ -73,40 +165,179 @@ def download_ortho(prefix, name):
     """
     
     # URLの構築
-    base_url = f'https://data.darts.isas.jaxa.jp/pub/pds3/sln-l-tc-5-ortho-map-seamless-v2.0/{prefix}/data/'
-    img_url = base_url + f'TCO_MAPs02_{name}SC.img'
-    lbl_url = base_url + f'TCO_MAPs02_{name}SC.lbl'
+    img_url = f'{base_url}/{prefix}/data/{stem}.img'
+    lbl_url = f'{base_url}/{prefix}/data/{stem}.lbl'
+    img_filename, lbl_filename = tile_paths(stem)
+    
+    os.makedirs(save_directory, exist_ok=True)
+    # 途中まで保存されたファイルを続きから受信できるように整える
+    prepare_resume(img_filename, lbl_filename)
+    # imgとlblを同時にダウンロード（途中まで保存されている場合は続きから）
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(fetch_file, img_url, img_filename),
+                   executor.submit(fetch_file, lbl_url, lbl_filename, label_complete)]
+        for future in futures:
+            future.result()
     
-    # 保存先の設定
-    script_directory = os.path.dirname(os.path.abspath(__file__))
-    save_directory = os.path.join(script_directory, "..", "data")
+    # ラベルに記載されたサイズとチェックサムで照合する
+    verify_image(img_filename, lbl_filename, checksum=True)
+    return img_filename, lbl_filename
+
 
-    # ダウンロードするファイル名を指定
-    img_filename = os.path.join(save_directory, f'TCO_MAPs02_{name}SC.img')
-    lbl_filename = os.path.join(save_directory, f'TCO_MAPs02_{name}SC.lbl')
+# ファイルを分割して受信し、完了後に置き換える
+def fetch_file(url, filename, verify=None):
+    """
+    Args:
+    url: ダウンロード元のURL
+    filename: 保存先のファイル名
+    verify: 保存済みのファイルを確認する関数（False を返した場合は続きから受信し直す、None の場合は確認しない）
     
-    # すでにファイルが存在する場合はダウンロードを中止して、続行
-    if os.path.exists(img_filename) or os.path.exists(lbl_filename):
-        print(f'[{img_filename}] or [{lbl_filename}] already exists. Abort download.')
-        return img_filename, lbl_filename
+    Return:
+    filename: 保存先のファイル名
+    
+    受信中は "<ファイル名>.part" に書き込み、途中で止まった場合は次回 Range 指定で続きから受信する。
+    """
+    
+    partial_filename = filename + ".part"
+    if os.path.exists(filename):
+        if verify is None or verify(filename):
+            return filename
+        # 以前の形式で途中まで書き込まれたファイルは、続きから受信できるように移す
+        if os.path.exists(partial_filename):
+            os.remove(filename)
+        else:
+            os.replace(filename, partial_filename)
+    
+    received = os.path.getsize(partial_filename) if os.path.exists(partial_filename) else 0
+    headers = {"Range": f"bytes={received}-"} if received else {}
+    
+    with get_session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        # 受信済みの部分がすでに全体の場合
+        if response.status_code == 416:
+            os.replace(partial_filename, filename)
+            return filename
+        response.raise_for_status()
+    
+        # 続きから受信できない場合（サーバーが Range に対応していない）は最初から
+        mode = 'ab' if received and response.status_code == 206 else 'wb'
+        with open(partial_filename, mode) as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                file.write(chunk)
+    
+    os.replace(partial_filename, filename)
+    return filename
 
+
+# ダウンロード済みで、imgのサイズがラベルの記載と一致するか確認する
+def is_complete(img_filename, lbl_filename):
+    """
+    Args:
+    img_filename: imgファイルの名前
+    lbl_filename: lblファイルの名前
+    
+    Return:
+    complete: 完了している場合は True
+    """
+    
+    if not (os.path.exists(img_filename) and label_complete(lbl_filename)):
+        return False
     try:
-        # imgをダウンロード
-        img_response = requests.get(img_url)
-        with open(img_filename, 'wb') as img_file:
-            img_file.write(img_response.content)
-        print(f'{img_filename} ダウンロード成功')
+        verify_image(img_filename, lbl_filename)
+        return True
+    except (ValueError, OSError):
+        return False
 
-        # lblをダウンロード
-        lbl_response = requests.get(lbl_url)
-        with open(lbl_filename, 'wb') as lbl_file:
-            lbl_file.write(lbl_response.content)
-        print(f'{lbl_filename} ダウンロード成功')
-        
-        # ダウンロードしたファイルのパスを返す
-        return img_filename, lbl_filename
 
-    except requests.RequestException as e:
-        print(f'Error: {e}')
-        # エラーが発生した場合、プログラムを終了
-        sys.exit()
\ No newline at end of file
+# 完了していないimgを、続きから受信できるように移す（又は削除する）
+def prepare_resume(img_filename, lbl_filename):
+    """
+    Args:
+    img_filename: imgファイルの名前
+    lbl_filename: lblファイルの名前
+    
+    Return:
+    None
+    
+    fetch_pair の開始時にだけ呼ばれ、is_complete はファイルを変更しない。
+    """
+    
+    if not os.path.exists(img_filename) or is_complete(img_filename, lbl_filename):
+        return
+    
+    if not label_complete(lbl_filename):
+        # lblがない（又は途中までの）場合、以前の形式で途中まで書き込まれたimgは、続きから受信できるように移す
+        if not os.path.exists(img_filename + ".part"):
+            os.replace(img_filename, img_filename + ".part")
+        return
+    
+    # サイズが足りない場合は続きから受信し、それ以外（サイズ超過など）は最初から受信する
+    expected_size = image_size(lbl_filename)
+    if expected_size is not None and os.path.getsize(img_filename) < expected_size:
+        os.replace(img_filename, img_filename + ".part")
+    else:
+        os.remove(img_filename)
+
+
+# lblが最後（END）まで保存されているか確認する
+def label_complete(lbl_filename):
+    """
+    Arg:
+    lbl_filename: lblファイルの名前
+    
+    Return:
+    complete: 最後の行が END の場合は True（ファイルがない場合は False）
+    """
+    
+    try:
+        with open(lbl_filename, 'r', encoding='latin-1') as file:
+            lines = [line.strip() for line in file if line.strip()]
+    except OSError:
+        return False
+    return bool(lines) and lines[-1] == "END"
+
+
+# ラベルから画像のバイト数を求める
+def image_size(lbl_filename):
+    """
+    Arg:
+    lbl_filename: lblファイルの名前
+    
+    Return:
+    size: 画像のバイト数（ラベルに記載がない場合は None）
+    """
+    
+    label = read.parse_lbl(lbl_filename)
+    if not label or read.find_number(label, "LINES") is None or read.find_number(label, "LINE_SAMPLES") is None:
+        return None
+    sample_bits = read.find_number(label, "SAMPLE_BITS", 16)
+    return (read.get_image_offset(label) + int(read.find_number(label, "LINES"))
+            * int(read.find_number(label, "LINE_SAMPLES")) * int(sample_bits) // 8)
+
+
+# imgをラベルの記載と照合する
+def verify_image(img_filename, lbl_filename, checksum=False):
+    """
+    Args:
+    img_filename: imgファイルの名前
+    lbl_filename: lblファイルの名前
+    checksum: MD5_CHECKSUM が記載されている場合に照合するか
+    
+    Return:
+    None（一致しない場合は ValueError）
+    """
+    
+    expected_size = image_size(lbl_filename)
+    actual_size = os.path.getsize(img_filename)
+    if expected_size is not None and actual_size != expected_size:
+        raise ValueError(f'{img_filename} のサイズがラベルと一致しません ({actual_size} != {expected_size} bytes)')
+    
+    if checksum:
+        expected_md5 = read.find_value(read.parse_lbl(lbl_filename), "MD5_CHECKSUM")
+        if expected_md5:
+            md5 = hashlib.md5()
+            with open(img_filename, 'rb') as file:
+                for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                    md5.update(chunk)
+            if md5.hexdigest().lower() != str(expected_md5).lower():
+                os.remove(img_filename)
+                raise ValueError(f'{img_filename} のチェックサムがラベルと一致しません')
\ No newline at end of file
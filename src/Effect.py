@@ -2,41 +2,324 @@
 
 """
 与えられたデータに計算処理を行うモジュールです。
+大きなデータは行方向のブロックに分け、スレッドで並列に計算します（結果は一括で計算した場合と一致します）。
 This module performs computational processing on the given data.
+Large windows are split into row blocks with halo overlap and processed on a thread pool.
 """
 
-from matplotlib.colors import LightSource
-from scipy.ndimage import gaussian_filter
+import os
+import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import Lazy as lazy
+
+# scipy はスムージングを行う時点で読み込む
+ndimage = lazy.lazy_import("scipy.ndimage")
+
+# 1ブロックの行数（これ以下の行数のデータは分割しない）
+BLOCK_ROWS = 512
+# 並列に計算するスレッド数
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+# スムージングの標準偏差 <pixel> と打ち切り（標準偏差の倍数）
+SMOOTHING_SIGMA = 3
+SMOOTHING_TRUNCATE = 4.0
+# 勾配の計算に必要な上下の行数（中心差分）
+GRADIENT_HALO = 1
+# 月の1日（日の出から日の入り）の太陽の位置の数（時角 5 度ごと）
+SUN_PATH_FRAMES = 37
+
+
+# 行方向のブロックごとに関数を並列に実行する
+def run_row_blocks(block_function, rows, halo, block_rows=BLOCK_ROWS, workers=MAX_WORKERS):
+    """
+    Args:
+    block_function: block_function(start, stop, halo_start, halo_stop) の形の関数
+                    halo_start から halo_stop の行を読み、start から stop の行の結果を書き込む
+    rows: データの行数
+    halo: ブロックの上下に追加して読む行数（ステンシル、フィルタの半径）
+    block_rows: 1ブロックの行数
+    workers: 並列に計算するスレッド数
+    
+    Return:
+    None
+    
+    各ブロックは互いに重ならない範囲に書き込むため、出力は事前に確保した配列を共有する。
+    """
+    
+    blocks = [(start, min(start + block_rows, rows), max(start - halo, 0), min(start + block_rows + halo, rows))
+              for start in range(0, rows, block_rows)]
+    if len(blocks) <= 1 or workers <= 1:
+        for block in blocks:
+            block_function(*block)
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(blocks))) as executor:
+        # 例外はここで呼び出し元に伝える
+        for future in [executor.submit(block_function, *block) for block in blocks]:
+            future.result()
+
 
 # hillshadeを計算
-def calculate_hillshade(elevation_data, azdeg, altdeg):
+# LightSource.hillshade(vert_exag=1.0, dx=1, dy=1, fraction=1) と同じ定義を float32 で計算する
+def calculate_hillshade(elevation_data, azdeg, altdeg, block_rows=BLOCK_ROWS, workers=MAX_WORKERS):
     """
     Args:
     elevation_data: 標高データ
     azdeg: 太陽（光源）の方位
     altdeg: 太陽（光源）の仰角
+    block_rows: 1ブロックの行数
+    workers: 並列に計算するスレッド数
     
     Return: 
-    hillshade: 陰影起伏
+    hillshade: 陰影起伏（float32）
     """
     
     print("陰影起伏の計算中...")
     
-    ls = LightSource(azdeg, altdeg)
-    hillshade = ls.hillshade(elevation_data, vert_exag=1.0, dx=1, dy=1, fraction=1)
+    elevation = np.asarray(elevation_data)
+    direction = sun_directions([azdeg], [altdeg])[0].astype(np.float32)
+    hillshade = np.empty(elevation.shape, dtype=np.float32)
+    
+    # 第1段階 ブロックごとに法線ベクトルと太陽の方向の内積（照度）を求める
+    def shade_block(start, stop, halo_start, halo_stop):
+        normals = calculate_normals(elevation[halo_start:halo_stop], block_rows=None)
+        normals = normals[:, start - halo_start:stop - halo_start]
+        out = hillshade[start:stop]
+        np.multiply(normals[0], direction[0], out=out)
+        out += normals[1] * direction[1]
+        out += normals[2] * direction[2]
+    run_row_blocks(shade_block, elevation.shape[0], GRADIENT_HALO, block_rows, workers)
+    
+    # 第2段階 全体の最小値と最大値で 0 から 1 に正規化する
+    imin, imax = hillshade.min(), hillshade.max()
+    if (imax - imin) > 1e-6:
+        def normalize_block(start, stop, halo_start, halo_stop):
+            out = hillshade[start:stop]
+            out -= imin
+            out /= (imax - imin)
+            np.clip(out, 0, 1, out=out)
+        run_row_blocks(normalize_block, elevation.shape[0], 0, block_rows, workers)
+    else:
+        np.clip(hillshade, 0, 1, out=hillshade)
     return hillshade
 
 # データのスムージング
-def smoothing_data(data):
+def smoothing_data(data, sigma=SMOOTHING_SIGMA, block_rows=BLOCK_ROWS, workers=MAX_WORKERS):
     """
-    Arg:
-    data: 多次元配列データ
+    Args:
+    data: 2次元配列データ
+    sigma: ガウシアンフィルタの標準偏差 <pixel>
+    block_rows: 1ブロックの行数
+    workers: 並列に計算するスレッド数
     
     Return: 
-    smoothed_data: スムージング処理後のデータ
+    smoothed_data: スムージング処理後のデータ（float32）
+    
+    gaussian_filter(data, sigma, output=np.float32) と一致する。
+    ブロックの上下にはフィルタの半径分の行を追加して読み、境界の処理は全体の端でのみ行われる。
     """
     
     print("スムージング処理の実行中...")
     
-    smoothed_data = gaussian_filter(data, sigma=3)
-    return smoothed_data
\ No newline at end of file
+    data = np.asarray(data)
+    smoothed_data = np.empty(data.shape, dtype=np.float32)
+    # スレッドで使う前に読み込みを済ませる
+    gaussian_filter1d = lazy.resolve(ndimage).gaussian_filter1d
+    radius = int(SMOOTHING_TRUNCATE * sigma + 0.5)
+    
+    # gaussian_filter と同じく、行方向、列方向の順に1次元のフィルタをかける
+    def smooth_block(start, stop, halo_start, halo_stop):
+        vertical = gaussian_filter1d(data[halo_start:halo_stop], sigma, axis=0, output=np.float32,
+                                     truncate=SMOOTHING_TRUNCATE)
+        gaussian_filter1d(vertical[start - halo_start:stop - halo_start], sigma, axis=1,
+                          output=smoothed_data[start:stop], truncate=SMOOTHING_TRUNCATE)
+    run_row_blocks(smooth_block, data.shape[0], radius, block_rows, workers)
+    return smoothed_data
+
+
+# 標高データの単位法線ベクトルを計算
+# LightSource.hillshade(vert_exag=1.0, dx=1, dy=1) と同じ定義（1行目が北側）
+def calculate_normals(elevation_data, dtype=np.float32, block_rows=BLOCK_ROWS, workers=MAX_WORKERS):
+    """
+    Args:
+    elevation_data: 標高データ
+    dtype: 計算に使用するデータ型
+    block_rows: 1ブロックの行数（None の場合は分割しない）
+    workers: 並列に計算するスレッド数
+    
+    Return:
+    normals: 単位法線ベクトル (3, 行数, 列数)
+    """
+    
+    elevation = np.asarray(elevation_data)
+    normals = np.empty((3,) + elevation.shape, dtype=dtype)
+    
+    def normal_block(start, stop, halo_start, halo_stop):
+        e_dy, e_dx = np.gradient(np.asarray(elevation[halo_start:halo_stop], dtype=dtype), -1, 1)
+        out = normals[:, start:stop]
+        np.negative(e_dx[start - halo_start:stop - halo_start], out=out[0])
+        np.negative(e_dy[start - halo_start:stop - halo_start], out=out[1])
+        out[2] = 1
+        out /= np.sqrt(np.einsum('ijk,ijk->jk', out, out))
+    run_row_blocks(normal_block, elevation.shape[0], GRADIENT_HALO, block_rows or max(elevation.shape[0], 1), workers)
+    return normals
+
+
+# 太陽（光源）の方向の単位ベクトルを計算
+def sun_directions(azdegs, altdegs):
+    """
+    Args:
+    azdegs: 太陽（光源）の方位の配列
+    altdegs: 太陽（光源）の仰角の配列
+    
+    Return:
+    directions: 太陽の方向の単位ベクトル (組み合わせ数, 3)
+    """
+    
+    # 北から時計回りの方位を、東から反時計回りの角度に変換する
+    az = np.radians(90 - np.asarray(azdegs, dtype=np.float64))
+    alt = np.radians(np.asarray(altdegs, dtype=np.float64))
+    return np.stack([np.cos(az) * np.cos(alt), np.sin(az) * np.cos(alt), np.sin(alt)], axis=-1)
+
+
+# 月の1日（日の出から日の入りまで）の太陽の方位と仰角を求める
+# 月の自転軸の傾き（約 1.5 度）は無視し、太陽の赤緯を 0 度とする
+def sun_path(latitude, frames=SUN_PATH_FRAMES):
+    """
+    Args:
+    latitude: 地点の緯度
+    frames: 太陽の位置の数（時角 -90 度から 90 度を等分する）
+    
+    Return:
+    sun_positions: (方位, 仰角) のリスト（方位は北0度、東90度）
+    """
+    
+    phi = math.radians(latitude)
+    sun_positions = []
+    for hour_angle in np.linspace(-90, 90, frames):
+        h = math.radians(hour_angle)
+        altdeg = math.degrees(math.asin(max(-1.0, min(1.0, math.cos(phi) * math.cos(h)))))
+        # 南中時（時角 0 度）は赤道側、午前は東側、午後は西側
+        azimuth = (math.degrees(math.atan2(math.sin(h), math.cos(h) * math.sin(phi))) + 180) % 360
+        sun_positions.append((round(azimuth, 2), round(max(altdeg, 0.0), 2)))
+    return sun_positions
+
+
+# 照度を 0 から 1 に正規化する（LightSource.shade_normals と同じ処理）
+def _normalize_intensity(intensity):
+    imin, imax = intensity.min(), intensity.max()
+    if (imax - imin) > 1e-6:
+        intensity -= imin
+        intensity /= (imax - imin)
+    return np.clip(intensity, 0, 1, out=intensity)
+
+
+# 複数の太陽の位置に対する陰影起伏をまとめて計算
+# 勾配と法線ベクトルは1度だけ計算し、各太陽の位置で使い回す
+def calculate_hillshade_sweep(elevation_data, azdegs, altdegs, as_generator=False):
+    """
+    Args:
+    elevation_data: 標高データ
+    azdegs: 太陽（光源）の方位の配列
+    altdegs: 太陽（光源）の仰角の配列（azdegs と同じ長さ）
+    as_generator: True の場合は陰影起伏を1枚ずつ返すジェネレータを返す
+    
+    Return:
+    hillshades: 陰影起伏 (組み合わせ数, 行数, 列数) の float 32 配列、又はそのジェネレータ
+    
+    各陰影起伏は calculate_hillshade の結果と float 32 の丸め誤差の範囲で一致する。
+    """
+    
+    print("陰影起伏の一括計算中...")
+    
+    normals = calculate_normals(elevation_data)
+    directions = sun_directions(azdegs, altdegs).astype(np.float32)
+    flat_normals = normals.reshape(3, -1)
+    
+    # 1枚ずつ計算して返す（メモリ使用量は1枚分）
+    if as_generator:
+        return (_normalize_intensity(np.dot(direction, flat_normals)).reshape(normals.shape[1:])
+                for direction in directions)
+    
+    # 行列積で全ての太陽の位置を一度に計算する
+    hillshades = np.dot(directions, flat_normals).reshape((len(directions),) + normals.shape[1:])
+    for hillshade in hillshades:
+        _normalize_intensity(hillshade)
+    return hillshades
+
+
+# 地形が落とす影（投影）を計算
+# 太陽の方向に沿って各列を1度ずつ走査し、太陽側から伝わる遮蔽の高さと比較する（O(ピクセル数)）
+def calculate_shadow(elevation_data, azdeg, altdeg, dx, dy):
+    """
+    Args:
+    elevation_data: 曲率補正された標高データ（1行目が北側） <m>
+    azdeg: 太陽（光源）の方位
+    altdeg: 太陽（光源）の仰角
+    dx: 列方向（東西）のピクセル間隔 <m>
+    dy: 行方向（南北）のピクセル間隔 <m>
+    
+    Return:
+    shadow: 影になるピクセルが True の配列
+    """
+    
+    print("影の計算中...")
+    
+    elevation = np.asarray(elevation_data, dtype=np.float64)
+    # 太陽の方向をピクセル単位に変換（東が列の正方向、北が行の負方向）
+    step_row = -math.cos(math.radians(azdeg)) / dy
+    step_col = math.sin(math.radians(azdeg)) / dx
+    
+    # 走査方向を列に揃える（行方向の成分が大きい場合は転置する）
+    transposed = abs(step_row) > abs(step_col)
+    if transposed:
+        elevation = elevation.T
+        step_row, step_col = step_col, step_row
+        dx, dy = dy, dx
+    # 太陽が列番号の小さい側になるように揃える
+    flipped = step_col > 0
+    if flipped:
+        elevation = elevation[:, ::-1]
+    
+    # 1列進むごとの行のずれと水平距離
+    row_shift = step_row / abs(step_col)
+    distance = math.hypot(dx, row_shift * dy)
+    # 1列進むごとに太陽光線が下がる高さ
+    drop = distance * math.tan(math.radians(altdeg))
+    
+    shadow = np.zeros(elevation.shape, dtype=bool)
+    # 太陽側の列から伝わる、太陽光線を遮る高さの上限
+    horizon = elevation[:, 0].copy()
+    occluder = np.empty_like(horizon)
+    for col in range(1, elevation.shape[1]):
+        # 太陽光線をピクセル上の直線（デジタル直線）として追跡する
+        # 列ごとの行のずれは 0 又は ±1 で、補間によるぼやけは生じない（横方向の誤差は 0.5 ピクセル以内）
+        shift = round(col * row_shift) - round((col - 1) * row_shift)
+        occluder.fill(-np.inf)
+        if shift >= 0:
+            occluder[:len(horizon) - shift] = horizon[shift:]
+        else:
+            occluder[-shift:] = horizon[:shift]
+        occluder -= drop
+        shadow[:, col] = occluder > elevation[:, col]
+        np.maximum(occluder, elevation[:, col], out=horizon)
+    
+    if flipped:
+        shadow = shadow[:, ::-1]
+    if transposed:
+        shadow = shadow.T
+    return np.ascontiguousarray(shadow)
+
+
+# 陰影起伏に影を合成
+def apply_shadow(hillshade, shadow, shadow_level=0.0):
+    """
+    Args:
+    hillshade: 陰影起伏
+    shadow: 影になるピクセルが True の配列
+    shadow_level: 影の部分の明るさの倍率（0 で真っ黒）
+    
+    Return:
+    shaded: 影を合成した陰影起伏
+    """
+    
+    return np.where(shadow, hillshade * shadow_level, hillshade).astype(hillshade.dtype, copy=False)
\ No newline at end of file
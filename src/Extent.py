@@ -0,0 +1,242 @@
+# Extent.py
+
+"""
+描画範囲（東西と南北の大きさ <m>）と、描画範囲に応じた各種の設定を求めるモジュールです。
+プロット管理番号 [0, 1, 2, 3] は、従来の4つの描画範囲の別名として扱います。
+This module defines plot extents as arbitrary east-west / north-south sizes in metres
+and derives every range-dependent setting (extraction half-range, z range, tick spacing, viewpoint, file symbol) from them.
+The legacy plot numbers 0-3 remain as presets with their original settings.
+"""
+
+import math
+import re
+from collections import namedtuple
+
+# 月の半径 <m>
+R = 1737400
+# 緯度1度あたりの距離 <m>
+METERS_PER_DEG = 2 * math.pi * R / 360
+# 指定できる描画範囲の大きさ <m>
+MIN_SIZE = 50
+MAX_SIZE = 100000
+# 描画範囲の大きさに対する視点の高さの比率（プロット管理番号 2, 3 と同じ比率）
+VIEWPOINT_RATIO = 0.006
+# x,y軸の目盛りの数の目安
+AXIS_TICKS = 10
+
+# 描画範囲
+# width: 東西の大きさ <m>
+# height: 南北の大きさ <m>
+# preset: プロット管理番号（大きさを直接指定した場合は None）
+Extent = namedtuple("Extent", ["width", "height", "preset"], defaults=[None])
+
+# プロット管理番号ごとの従来の設定
+# range_deg: 抽出範囲（ターゲットからの片側の幅、東西南北で共通）<deg>
+# axis_span: x,y軸の間隔 <deg>
+# viewpoint: 視点の高さ <m>
+# symbol: 保存ファイル名の描画範囲のシンボル
+PRESETS = {
+    0: dict(width=6000, height=6000, range_deg=0.1, axis_span=0.02, viewpoint=36, symbol="60_"),
+    1: dict(width=3000, height=3000, range_deg=0.05, axis_span=0.01, viewpoint=20, symbol="30_"),
+    2: dict(width=600, height=600, range_deg=0.01, axis_span=0.003, viewpoint=3.6, symbol="06_"),
+    3: dict(width=300, height=300, range_deg=0.005, axis_span=0.001, viewpoint=1.8, symbol="03_"),
+}
+
+
+# プロット管理番号又は描画範囲を描画範囲に揃える
+def resolve(plot_range):
+    """
+    Arg:
+    plot_range: プロット管理番号、Extent、(東西, 南北) <m> 又は parse で読める文字列
+    
+    Return:
+    extent: 描画範囲
+    """
+    
+    if isinstance(plot_range, Extent):
+        return plot_range
+    if isinstance(plot_range, str):
+        return parse(plot_range)
+    if isinstance(plot_range, (tuple, list)):
+        return from_size(*plot_range)
+    if plot_range not in PRESETS:
+        raise ValueError(f"有効なプロット管理番号は {list(PRESETS)} のいずれかです。")
+    preset = PRESETS[int(plot_range)]
+    return Extent(preset["width"], preset["height"], int(plot_range))
+
+
+# 東西と南北の大きさから描画範囲を作る
+def from_size(width, height=None):
+    """
+    Args:
+    width: 東西の大きさ <m>
+    height: 南北の大きさ <m>（None の場合は width と同じ）
+    
+    Return:
+    extent: 描画範囲
+    """
+    
+    width = float(width)
+    height = width if height is None else float(height)
+    for size in (width, height):
+        if not MIN_SIZE <= size <= MAX_SIZE:
+            raise ValueError(f"描画範囲の大きさは {MIN_SIZE:,}m から {MAX_SIZE:,}m の間で指定してください。")
+    return Extent(width, height)
+
+
+# 文字列から描画範囲を読み取る
+# 例: "1"（プロット管理番号）, "2000"（2,000m 四方）, "2000x1000"（東西 2,000m、南北 1,000m）
+def parse(text):
+    """
+    Arg:
+    text: プロット管理番号、又は 東西x南北 の大きさ <m>
+    
+    Return:
+    extent: 描画範囲
+    """
+    
+    text = str(text).strip().lower()
+    if text in [str(number) for number in PRESETS]:
+        return resolve(int(text))
+    sizes = re.split(r"\s*[x×*,]\s*", text)
+    try:
+        if len(sizes) not in (1, 2):
+            raise ValueError
+        values = [float(size) for size in sizes]
+    except ValueError:
+        raise ValueError(f"描画範囲 '{text}' を読み取れません。[0, 1, 2, 3] 又は 東西x南北 <m> で指定してください。")
+    return from_size(*values)
+
+
+# 抽出範囲（ターゲットからの片側の幅）を求める
+def half_range_deg(plot_range, target_latitude):
+    """
+    Args:
+    plot_range: プロット管理番号又は描画範囲
+    target_latitude: ターゲットの緯度（経度方向の換算に使う）
+    
+    Returns:
+    lat_range: 南北の抽出範囲 <deg>
+    lon_range: 東西の抽出範囲 <deg>
+    
+    プロット管理番号の場合は、従来どおり緯度経度ともに同じ角度とする。
+    """
+    
+    extent = resolve(plot_range)
+    if extent.preset is not None:
+        range_deg = PRESETS[extent.preset]["range_deg"]
+        return range_deg, range_deg
+    
+    # 経度1度あたりの距離は緯度の余弦に比例する（極付近では経度全周までに抑える）
+    cos_latitude = max(math.cos(math.radians(target_latitude)), 1e-9)
+    lat_range = extent.height / 2 / METERS_PER_DEG
+    lon_range = min(extent.width / 2 / (METERS_PER_DEG * cos_latitude), 180)
+    return lat_range, lon_range
+
+
+# z軸の範囲（中央値からの片側の幅）を求める
+def z_range(plot_range):
+    """
+    Arg:
+    plot_range: プロット管理番号又は描画範囲
+    
+    Return:
+    z_range: z軸の範囲 <m>
+    
+    x,y軸の長い方と同じ縮尺になるよう、長い辺の半分とする。
+    """
+    
+    extent = resolve(plot_range)
+    return max(extent.width, extent.height) / 2
+
+
+# x,y軸の間隔を求める
+def axis_spans(plot_range, target_latitude):
+    """
+    Args:
+    plot_range: プロット管理番号又は描画範囲
+    target_latitude: ターゲットの緯度
+    
+    Returns:
+    lon_span: x軸（経度）の間隔 <deg>
+    lat_span: y軸（緯度）の間隔 <deg>
+    """
+    
+    extent = resolve(plot_range)
+    if extent.preset is not None:
+        axis_span = PRESETS[extent.preset]["axis_span"]
+        return axis_span, axis_span
+    
+    lat_range, lon_range = half_range_deg(extent, target_latitude)
+    return _round_span(2 * lon_range / AXIS_TICKS), _round_span(2 * lat_range / AXIS_TICKS)
+
+
+# 間隔を 1, 2, 5 × 10^n に丸める
+def _round_span(span):
+    exponent = math.floor(math.log10(span))
+    for step in (1, 2, 5, 10):
+        if span <= step * 10 ** exponent:
+            return step * 10 ** exponent
+
+
+# 3Dプロットの縦横比を求める
+def aspect_ratio(plot_range):
+    """
+    Arg:
+    plot_range: プロット管理番号又は描画範囲
+    
+    Return:
+    aspectratio: x, y, z の比率の辞書（長い辺とz軸を 1 とする）
+    """
+    
+    extent = resolve(plot_range)
+    longest = max(extent.width, extent.height)
+    return dict(x=extent.width / longest, y=extent.height / longest, z=1)
+
+
+# 描画範囲に応じた視点の高さ
+def viewpoint(plot_range):
+    """
+    Arg:
+    plot_range: プロット管理番号又は描画範囲
+    
+    Return:
+    viewpoint: 視点の高さ <m>
+    """
+    
+    extent = resolve(plot_range)
+    if extent.preset is not None:
+        return PRESETS[extent.preset]["viewpoint"]
+    return round(max(extent.width, extent.height) * VIEWPOINT_RATIO, 1)
+
+
+# タイトルに表示する描画範囲のテキスト
+def label(plot_range):
+    """
+    Arg:
+    plot_range: プロット管理番号又は描画範囲
+    
+    Return:
+    label: 描画範囲のテキスト（例: "6,000m per side", "2,000m (E-W) x 1,000m (N-S)"）
+    """
+    
+    extent = resolve(plot_range)
+    if extent.width == extent.height:
+        return f"{extent.width:,.0f}m per side"
+    return f"{extent.width:,.0f}m (E-W) x {extent.height:,.0f}m (N-S)"
+
+
+# 保存ファイル名の描画範囲のシンボル
+def symbol(plot_range):
+    """
+    Arg:
+    plot_range: プロット管理番号又は描画範囲
+    
+    Return:
+    symbol: シンボル（例: "60_", "2000x1000m_"）
+    """
+    
+    extent = resolve(plot_range)
+    if extent.preset is not None:
+        return PRESETS[extent.preset]["symbol"]
+    return f"{extent.width:.0f}x{extent.height:.0f}m_"
@@ -0,0 +1,264 @@
+# Horizon.py
+
+"""
+抽出範囲の各ピクセルについて、方位ごとの地平線高度（周囲の地形が見える最大の仰角）を事前計算して保存するモジュールです。
+保存した地平線高度を参照することで、任意の太陽の位置の影を比較だけで求めることができます。
+This module precomputes and stores, for every pixel of a window, the horizon elevation angle at quantised azimuths.
+With the stored horizon, the shadow for any sun position is obtained by a lookup and a comparison.
+"""
+
+import os
+import math
+import time
+import hashlib
+import argparse
+import numpy as np
+
+import Area as area
+import Cache as cache
+
+# 保存先の設定
+HORIZON_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "horizon")
+# 保存先の容量上限 <byte>（超えた場合は最も長く使用されていないものから削除する）
+HORIZON_BUDGET = 2 * 1024 * 1024 * 1024
+# 方位の分割数（360度を等分する）
+N_AZIMUTHS = 32
+# 月の半径 <m>
+R = 1737400
+
+
+# 地平線高度を計算
+def compute_horizon(elevation_data, dx, dy, n_azimuths=N_AZIMUTHS, max_distance=None):
+    """
+    Args:
+    elevation_data: 標高データ（曲率補正前、1行目が北側） <m>
+    dx: 列方向（東西）のピクセル間隔 <m>
+    dy: 行方向（南北）のピクセル間隔 <m>
+    n_azimuths: 方位の分割数（方位 k * 360 / n_azimuths について計算する）
+    max_distance: 探索する最大距離 <m>（None の場合は抽出範囲の対角線の長さ）
+    
+    Return:
+    horizon: 地平線高度 (n_azimuths, 行数, 列数) <deg>。0 度未満は 0 度とする
+    
+    探索する距離は近くは1ピクセルごと、遠くは約10%ずつ広げる（等比数列）。
+    月の曲率は各ピクセルから見た距離 d に対して d^2 / 2R の低下として考慮する。
+    """
+    
+    print("地平線高度の計算中...")
+    
+    elevation = np.asarray(elevation_data, dtype=np.float32)
+    lines, samples = elevation.shape
+    if max_distance is None:
+        max_distance = math.hypot(lines * dy, samples * dx)
+    
+    # 探索する距離の一覧
+    step = min(dx, dy)
+    distances = []
+    distance = step
+    while distance <= max_distance:
+        distances.append(distance)
+        distance = max(distance * 1.1, distance + step)
+    
+    # 地平線高度の正接の最大値（抽出範囲外は平坦とみなす）
+    horizon = np.zeros((n_azimuths, lines, samples), dtype=np.float32)
+    for k in range(n_azimuths):
+        azimuth = math.radians(k * 360 / n_azimuths)
+        checked = set()
+        for distance in distances:
+            # 東が列の正方向、北が行の負方向
+            row_offset = round(-math.cos(azimuth) * distance / dy)
+            col_offset = round(math.sin(azimuth) * distance / dx)
+            if (row_offset, col_offset) in checked or abs(row_offset) >= lines or abs(col_offset) >= samples:
+                continue
+            checked.add((row_offset, col_offset))
+            actual_distance = math.hypot(row_offset * dy, col_offset * dx)
+            
+            # 比較する2つの領域（自分自身と、その方位に actual_distance 離れたピクセル）
+            own = (slice(max(0, -row_offset), lines - max(0, row_offset)),
+                   slice(max(0, -col_offset), samples - max(0, col_offset)))
+            other = (slice(max(0, row_offset), lines - max(0, -row_offset)),
+                     slice(max(0, col_offset), samples - max(0, -col_offset)))
+            
+            # 曲率による低下を差し引いた高さの差から正接を求める
+            tangent = elevation[other] - elevation[own]
+            tangent -= actual_distance ** 2 / (2 * R)
+            tangent /= actual_distance
+            np.maximum(horizon[k][own], tangent, out=horizon[k][own])
+    
+    np.arctan(horizon, out=horizon)
+    horizon *= 180 / math.pi
+    return horizon
+
+
+# 地平線高度を保存形式に変換
+def encode_horizon(horizon, dtype="uint8"):
+    """
+    Args:
+    horizon: 地平線高度 <deg>
+    dtype: 保存形式（"uint8" は 90/255 度刻み、"float16" は約 0.05 度刻み）
+    
+    Returns:
+    codes: 保存形式の地平線高度
+    scale: 角度 <deg> への変換係数（角度 = codes * scale）
+    """
+    
+    if dtype == "uint8":
+        scale = 90 / 255
+        codes = np.rint(np.clip(horizon, 0, 90) / scale).astype(np.uint8)
+    else:
+        scale = 1.0
+        codes = np.clip(horizon, 0, 90).astype(np.float16)
+    return codes, scale
+
+
+# 抽出範囲とデータのファイルから保存用のキーを作る
+def horizon_key(source_path, selected_x, selected_y, MAP_RESOLUTION, n_azimuths=N_AZIMUTHS, dtype="uint8"):
+    """
+    Args:
+    source_path: 標高データのファイルのパス（複数のタイルを組み合わせた場合はそのリスト）
+    selected_x: 抽出範囲の経度データ
+    selected_y: 抽出範囲の緯度データ
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    n_azimuths: 方位の分割数
+    dtype: 保存形式
+    
+    Return:
+    key: 保存用のキー（ファイル名）
+    """
+    
+    # いずれかのファイル（隣接タイルを含む）が更新された場合は別のキーになる
+    sources = []
+    for path in source_paths(source_path):
+        stat = os.stat(path)
+        sources.append(f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}")
+    window = (round(float(selected_y[0, 0]), 9), round(float(selected_x[0, 0]), 9),
+              selected_x.shape, round(float(MAP_RESOLUTION), 9))
+    text = f"{'|'.join(sources)}|{window}|{n_azimuths}|{dtype}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+# 1つのパス又はパスのリストを、重複のないパスのリストにする
+def source_paths(source_path):
+    if isinstance(source_path, (str, os.PathLike)):
+        return [source_path]
+    return sorted(set(source_path), key=lambda path: os.path.abspath(path))
+
+
+# 保存された地平線高度を読み込む（ない場合は計算して保存する）
+def get_horizon(source_path, selected_data, selected_x, selected_y, MAP_RESOLUTION, target_latitude,
+                n_azimuths=N_AZIMUTHS, dtype="uint8", compute=True):
+    """
+    Args:
+    source_path: 標高データのファイルのパス（複数のタイルを組み合わせた場合はそのリスト）
+    selected_data: 抽出範囲の標高データ（曲率補正前）
+    selected_x: 抽出範囲の経度データ
+    selected_y: 抽出範囲の緯度データ
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    target_latitude: ターゲットの緯度
+    n_azimuths: 方位の分割数
+    dtype: 保存形式（"uint8" 又は "float16"）
+    compute: 保存されていない場合に計算するか
+    
+    Returns:
+    codes: 保存形式の地平線高度 (n_azimuths, 行数, 列数)（メモリマップ）。保存されておらず compute が False の場合は None
+    scale: 角度 <deg> への変換係数
+    """
+    
+    key = horizon_key(source_path, selected_x, selected_y, MAP_RESOLUTION, n_azimuths, dtype)
+    codes_path = os.path.join(HORIZON_DIRECTORY, key + ".npy")
+    meta_path = os.path.join(HORIZON_DIRECTORY, key + ".json")
+    
+    # 保存されている場合はメモリマップとして開く
+    # 索引が読めない場合や、他のプロセスが同時に削除した場合は保存されていないものとして扱う
+    meta = cache.read_meta(meta_path)
+    if meta is not None and "scale" in meta:
+        try:
+            codes = np.load(codes_path, mmap_mode="r")
+        except (OSError, ValueError):
+            codes = None
+        if codes is not None:
+            meta["last_used"] = time.time()
+            cache.write_json(meta_path, meta)
+            return codes, meta["scale"]
+    if not compute:
+        return None, None
+    
+    dx, dy = area.pixel_size(MAP_RESOLUTION, target_latitude)
+    codes, scale = encode_horizon(compute_horizon(selected_data, dx, dy, n_azimuths), dtype)
+    
+    # 書き込み途中のファイルが残らないように、一時ファイルに書いてから置き換える（索引も同様）
+    os.makedirs(HORIZON_DIRECTORY, exist_ok=True)
+    partial_path = cache.temporary_path(codes_path)
+    try:
+        with open(partial_path, 'wb') as file:
+            np.save(file, codes)
+        os.replace(partial_path, codes_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    meta = {"sources": [os.path.abspath(path) for path in source_paths(source_path)], "upper_left_latitude": float(selected_y[0, 0]),
+            "upper_left_longitude": float(selected_x[0, 0]), "shape": list(codes.shape[1:]),
+            "map_resolution": float(MAP_RESOLUTION), "n_azimuths": n_azimuths, "dtype": dtype, "scale": scale,
+            "nbytes": os.path.getsize(codes_path), "last_used": time.time()}
+    cache.write_json(meta_path, meta)
+    
+    # 展開済みタイルのキャッシュと同じく、容量上限を超えた分を削除する
+    cache.evict_disk(HORIZON_BUDGET, HORIZON_DIRECTORY)
+    return np.load(codes_path, mmap_mode="r"), scale
+
+
+# 地平線高度から影を求める
+def shadow_from_horizon(codes, scale, azdeg, altdeg):
+    """
+    Args:
+    codes: 保存形式の地平線高度 (n_azimuths, 行数, 列数)
+    scale: 角度 <deg> への変換係数
+    azdeg: 太陽（光源）の方位
+    altdeg: 太陽（光源）の仰角
+    
+    Return:
+    shadow: 影になるピクセルが True の配列
+    """
+    
+    print("地平線高度から影を計算中...")
+    
+    # 太陽の方位を挟む2つの方位の地平線高度を線形補間する
+    n_azimuths = codes.shape[0]
+    position = (azdeg % 360) / (360 / n_azimuths)
+    k0 = int(position) % n_azimuths
+    k1 = (k0 + 1) % n_azimuths
+    weight = position - int(position)
+    
+    # 太陽の仰角を保存形式の単位に変換して比較する
+    threshold = np.float32(altdeg / scale)
+    if weight == 0:
+        return codes[k0] > threshold
+    horizon = np.multiply(codes[k0], np.float32(1 - weight), dtype=np.float32)
+    horizon += np.multiply(codes[k1], np.float32(weight), dtype=np.float32)
+    return horizon > threshold
+
+
+if __name__ == "__main__":
+    
+    import Mosaic as mosaic
+    import Extent as extent
+    
+    # KAGUYA のタイルについて、地点と描画範囲を指定して地平線高度を事前計算する
+    parser = argparse.ArgumentParser(description="地平線高度の事前計算")
+    parser.add_argument("latitude", type=float, help="ターゲットの緯度")
+    parser.add_argument("longitude", type=float, help="ターゲットの経度")
+    parser.add_argument("plot_range", type=extent.parse,
+                        help="プロット管理番号 [0, 1, 2, 3] 又は 東西x南北の大きさ <m>（例: 2000x1000）")
+    parser.add_argument("--azimuths", type=int, default=N_AZIMUTHS, help="方位の分割数")
+    parser.add_argument("--dtype", choices=["uint8", "float16"], default="uint8", help="保存形式")
+    args = parser.parse_args()
+    
+    (elevation_data, window_samples, window_lines, window_latitude, window_longitude, window_resolution,
+     sources) = mosaic.get_elevation_mosaic(args.latitude, args.longitude, args.plot_range, return_sources=True)
+    selected_data, selected_x, selected_y, haversine_data = area.select_area(elevation_data, args.latitude, args.longitude,
+                                                            window_samples, window_lines, window_latitude,
+                                                            window_longitude, window_resolution, args.plot_range)
+    codes, scale = get_horizon(sources, selected_data, selected_x, selected_y, window_resolution, args.latitude,
+                               args.azimuths, args.dtype)
+    print(f"地平線高度を保存しました: {codes.shape} {codes.dtype}")
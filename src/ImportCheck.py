@@ -0,0 +1,95 @@
+# ImportCheck.py
+
+"""
+実行ファイル（main.py, SLIM.py, Apollo17.py）の起動時の読み込み時間が上限以内かを確認するモジュールです。
+単独で実行でき、上限を超えた場合や重いライブラリが起動時に読み込まれた場合は終了コード 1 を返します。
+This module checks that the entry scripts import within IMPORT_BUDGET and do not load the deferred heavy libraries.
+It runs on its own, without the benchmark, and exits with status 1 on a regression.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+# 起動時の読み込み時間を計測する実行ファイル
+ENTRY_MODULES = ["main", "SLIM", "Apollo17"]
+# 起動時の読み込み時間の上限 <s>（対話モードの最初の入力が表示されるまでの待ち時間）
+IMPORT_BUDGET = 0.5
+# 起動時に読み込まれてはならない重いライブラリ（Lazy.lazy_import で初めて使う時点まで読み込まない）
+DEFERRED_MODULES = ["plotly.graph_objects", "plotly.subplots", "plotly.io", "scipy.ndimage", "requests", "tifffile"]
+
+
+# 実行ファイルの読み込み時間を計測する（python -X importtime の結果を使う）
+def measure_import_time(module_name, repeat=3):
+    """
+    Args:
+    module_name: 実行ファイルのモジュール名（例: "main"）
+    repeat: 計測の回数（最小値を使う）
+    
+    Returns:
+    seconds: 読み込み時間 <s>（インタプリタ自体の起動は含まない）
+    loaded: 読み込まれたモジュール名の集合
+    """
+    
+    src_directory = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ)
+    # 記録の有効化は計測に含めない
+    environment.pop("HVTS_TRACE", None)
+    best = None
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                                   cwd=src_directory, env=environment, capture_output=True, text=True, check=True)
+        # "import time: self [us] | cumulative | imported package" の形式
+        loaded, seconds = set(), None
+        for line in completed.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if not cumulative.strip().isdigit():
+                continue
+            loaded.add(name.strip())
+            if name.strip() == module_name:
+                seconds = int(cumulative) / 1e6
+        if seconds is not None and (best is None or seconds < best[0]):
+            best = (seconds, loaded)
+    return best
+
+
+# 実行ファイルの読み込み時間が上限以内か確認する
+def check_import_budget(modules=ENTRY_MODULES, budget=IMPORT_BUDGET, repeat=3):
+    """
+    Args:
+    modules: 実行ファイルのモジュール名のリスト
+    budget: 読み込み時間の上限 <s>
+    repeat: 計測の回数
+    
+    Return:
+    results: モジュールごとの {module, seconds, budget, eager, passed} のリスト
+    
+    eager は DEFERRED_MODULES のうち起動時に読み込まれてしまったもの。
+    """
+    
+    results = []
+    for module_name in modules:
+        seconds, loaded = measure_import_time(module_name, repeat)
+        eager = [name for name in DEFERRED_MODULES if name in loaded]
+        passed = seconds <= budget and not eager
+        results.append({"module": module_name, "seconds": seconds, "budget": budget, "eager": eager,
+                        "passed": passed})
+        print(f"{module_name}: {seconds * 1000:.0f} ms / {budget * 1000:.0f} ms"
+              + (f", 起動時に読み込まれたライブラリ: {', '.join(eager)}" if eager else "")
+              + ("" if passed else " [NG]"))
+    return results
+
+
+if __name__ == "__main__":
+
+    # 起動時の読み込み時間を確認する（上限を超えた場合は終了コード 1）
+    parser = argparse.ArgumentParser(description="起動時の読み込み時間の確認")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="起動時の読み込み時間の上限 <s>")
+    parser.add_argument("--repeat", type=int, default=3, help="計測の回数（最小値を使う）")
+    args = parser.parse_args()
+    
+    results = check_import_budget(budget=args.budget, repeat=args.repeat)
+    sys.exit(0 if all(result["passed"] for result in results) else 1)
@@ -5,6 +5,8 @@
 The module of input functions used by the user.
 """
 
+import Extent as extent
+
 # 変数を入力する
 # 緯度、経度、太陽（光源）の方位
 def validate_input_below(prompt, min_value, max_value):
@@ -72,29 +74,69 @@ def validate_input_yes_no(prompt):
             print("Error: y 又は n で入力してください。")
             
 # 描画範囲を設定する
-# プロット管理番号
+# プロット管理番号、又は東西と南北の大きさ <m>
 def validate_input_plot_range(prompt):
     """
     Args:
     prompt: 入力された値
     
     Returns:
-    plot_range: プロット管理番号
+    plot_range: プロット管理番号又は描画範囲（例: 1, 2000, 2000x1000）
     viewpoint: 視点の高さ
     """
     while True:
         number = input(prompt).strip()
-        # 6,000m range
-        if number == '0':
-            return 0, 36
-        # 3,000m range
-        elif number == '1':
-            return 1, 20
-        # 600m range
-        elif number == '2':
-            return 2, 3.6
-        # 300m range
-        elif number == '3':
-            return 3, 1.8
-        else:
-            print("Error: 有効な設定は [0, 1, 2, 3] のいずれかです。")
+        if number in ('0', '1', '2', '3'):
+            return int(number), default_viewpoint(int(number))
+        try:
+            plot_range = extent.parse(number)
+        except ValueError as e:
+            print(f"Error: {e}")
+            continue
+        return plot_range, default_viewpoint(plot_range)
+
+# 描画範囲に応じた視点の高さ
+def default_viewpoint(plot_range):
+    """
+    Arg:
+    plot_range: プロット管理番号又は描画範囲
+    
+    Return:
+    viewpoint: 視点の高さ <m>（プロット管理番号の場合は 36, 20, 3.6, 1.8）
+    """
+    return extent.viewpoint(plot_range)
+
+# 太陽（光源）の方位と仰角の組み合わせを入力する
+# 例: 90:20, 180:10, 270:5
+def validate_input_sun_sweep(prompt):
+    """
+    Args:
+    prompt: 入力された値
+    
+    Return:
+    sun_sweep: (方位, 仰角) のリスト
+    """
+    while True:
+        try:
+            return parse_sun_sweep(input(prompt))
+        except ValueError:
+            print("Error: 「方位:仰角」をカンマ区切りで入力してください。（方位は0以上360未満、仰角は0以上90以下）")
+
+# 「方位:仰角」のカンマ区切りの文字列を読み取る
+def parse_sun_sweep(text):
+    """
+    Args:
+    text: 文字列（例: "90:20, 180:10, 270:5"）
+    
+    Return:
+    sun_sweep: (方位, 仰角) のリスト
+    """
+    sun_sweep = []
+    for pair in text.split(','):
+        azimuth, altdeg = (float(value) for value in pair.split(':'))
+        # 方位は0以上360未満、仰角は0以上90以下
+        if not (0 <= azimuth < 360 and 0 <= altdeg <= 90):
+            raise ValueError(f"太陽の位置 {pair.strip()} が範囲外です。")
+        sun_sweep.append((azimuth, altdeg))
+    return sun_sweep
+
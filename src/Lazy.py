@@ -0,0 +1,57 @@
+# Lazy.py
+
+"""
+重いライブラリ（plotly, scipy, requests, tifffile など）を初めて使う時点まで読み込まないためのモジュールです。
+対話モードの最初の入力を待たせないように、各モジュールはこのモジュールを通して読み込みます。
+This module defers loading heavy dependencies until their first attribute access, so that the entry points start at once.
+"""
+
+import sys
+import threading
+import importlib.util
+
+# 読み込みを確定する際の排他制御（スレッドから同時に初めて使われる場合に備える）
+_lock = threading.Lock()
+
+
+# モジュールを遅延読み込みする
+def lazy_import(name):
+    """
+    Arg:
+    name: モジュール名（例: "plotly.graph_objects"）
+    
+    Return:
+    module: モジュール（属性を初めて参照した時点で読み込まれる）
+    
+    読み込み済みの場合はそのまま返す。モジュールが存在しない場合はこの時点で ModuleNotFoundError となる。
+    """
+    
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+# 遅延読み込みしたモジュールの読み込みを確定する
+def resolve(module):
+    """
+    Arg:
+    module: lazy_import で取得したモジュール
+    
+    Return:
+    module: 読み込みを済ませたモジュール
+    
+    スレッドプールで使う前に呼び出し、読み込みを1つのスレッドで済ませる。
+    """
+    
+    with _lock:
+        # 属性を参照すると読み込まれる
+        getattr(module, "__name__")
+    return module
@@ -0,0 +1,166 @@
+# Mosaic.py
+
+"""
+タイル境界付近のターゲットに対して、複数のタイルから抽出範囲を組み立てるモジュールです。
+This module assembles the plot window from several tiles when the target is near a tile boundary.
+"""
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+import Tile as tile
+import Download as dl
+import Read_lbl as read
+import Area as area
+
+# 開いたままにするタイルの上限（超えた場合は最も長く使用されていないものから閉じる）
+MAX_OPEN_TILES = 32
+
+# 開いたタイルを保持する
+# img_path: (メモリマップ, 地理情報)、最後に使用したものが末尾
+_open_tiles = OrderedDict()
+# 開いたタイルの排他制御（Server.py などで複数のスレッドから使う場合に備える）
+_tiles_lock = threading.Lock()
+# 開いている途中のタイルごとの排他制御（同じタイルを同時に開かないようにする）
+_opening_locks = {}
+
+
+# タイルをダウンロードし、メモリマップとして開く
+def open_tile(prefix, tile_name, plot_range=None, target_latitude=0, max_factor=None):
+    """
+    Args:
+    prefix: 経度の分類
+    tile_name: タイルの名前
+    plot_range: プロット管理番号又は描画範囲（指定した場合は描画範囲に応じた作成済みの概観データを開く）
+    target_latitude: ターゲットの緯度（東西の範囲の換算に使う）
+    max_factor: 概観データの倍率の上限
+    
+    Returns:
+    elevation_map: 標高データのメモリマップ（展開済みキャッシュ又は概観データ）
+    topographic_info: lblファイルから取得した地理情報（plot_range を指定した場合は選んだ段の地理情報と倍率 FACTOR）
+    """
+    
+    # 存在しない場合はダウンロードする
+    img_path, lbl_path = dl.download_data(prefix, tile_name)
+    elevation_map, topographic_info = _open_cached(img_path, lbl_path)
+    if plot_range is None:
+        return elevation_map, topographic_info
+    level_map, level_info = area.open_level(img_path, topographic_info, plot_range, target_latitude, max_factor)
+    return (elevation_map if level_map is None else level_map), level_info
+
+
+# 開いたタイルを取り出す（ない場合は開いて保持する）
+def _open_cached(img_path, lbl_path):
+    with _tiles_lock:
+        if img_path in _open_tiles:
+            _open_tiles.move_to_end(img_path)
+            return _open_tiles[img_path]
+        opening_lock = _opening_locks.setdefault(img_path, threading.Lock())
+    
+    # 同じタイルは1つのスレッドだけが開き、他のスレッドはその結果を使う
+    try:
+        with opening_lock:
+            with _tiles_lock:
+                if img_path in _open_tiles:
+                    _open_tiles.move_to_end(img_path)
+                    return _open_tiles[img_path]
+            
+            # データ型、エンディアン、データ先頭の位置はラベルの記載に従う
+            label = read.parse_lbl(lbl_path)
+            topographic_info = read.get_geometry(label)
+            elevation_map = area.open_elevation_cached(img_path, topographic_info["LINE_SAMPLES"],
+                                                       topographic_info["LINES"], read.get_sample_dtype(label),
+                                                       read.get_image_offset(label))
+            with _tiles_lock:
+                _open_tiles[img_path] = (elevation_map, topographic_info)
+                while len(_open_tiles) > MAX_OPEN_TILES:
+                    _open_tiles.popitem(last=False)
+    finally:
+        with _tiles_lock:
+            _opening_locks.pop(img_path, None)
+    return elevation_map, topographic_info
+
+
+# 抽出範囲に重なるすべてのタイルから標高データを取得する
+def get_elevation_mosaic(target_latitude, target_longitude, plot_range, return_sources=False):
+    """
+    Args:
+    target_latitude: 対象の緯度
+    target_longitude: 対象の経度
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    return_sources: True の場合は、読み込んだファイルのパスのリストも返す（Horizon.get_horizon のキーに使う）
+    
+    Returns:
+    elevation_data: 抽出範囲を含む標高データ
+    LINE_SAMPLES, LINES: 読み込んだデータのサイズ
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: 読み込んだデータ左上の緯度経度
+    MAP_RESOLUTION: マップスケーリング係数 <pixel/deg>
+    sources: 抽出範囲に重なるタイル（又はその概観データ）のパスのリスト（return_sources の場合のみ）
+    
+    戻り値は Area.get_elevation_window と同じ形式で、select_area にそのまま渡す。
+    各タイルからは抽出範囲と重なる部分だけを読み込み、タイル全体を連結することはない。
+    """
+    
+    # 第1段階 ターゲットを含むタイルを基準の格子とする
+    prefix, tile_name = tile.generate_name(target_latitude, target_longitude)
+    # 広い描画範囲では、全てのタイルで同じ倍率の概観データを使う
+    # 概観データが作成されていないタイルがある場合は、全てのタイルでそのタイルと同じ倍率まで下げる
+    factor = None
+    while True:
+        _, base_info = open_tile(prefix, tile_name, plot_range, target_latitude, factor)
+        factor = base_info["FACTOR"]
+        MAP_RESOLUTION = base_info["MAP_RESOLUTION"]
+        row_slice, col_slice = area.window_bounds(target_latitude, target_longitude, None, None,
+                                                  base_info["UPPER_LEFT_LATITUDE"], base_info["UPPER_LEFT_LONGITUDE"],
+                                                  MAP_RESOLUTION, plot_range, clip=False)
+        
+        # 極を越える行は含めない
+        first_row = int(np.ceil((base_info["UPPER_LEFT_LATITUDE"] - 90) * MAP_RESOLUTION))
+        last_row = int(np.floor((base_info["UPPER_LEFT_LATITUDE"] + 90) * MAP_RESOLUTION)) + 1
+        row_slice = slice(max(row_slice.start, first_row), min(row_slice.stop, last_row))
+        
+        # 第2段階 抽出範囲と重なるタイルを調べる
+        # 読み込む範囲の両端のピクセルの緯度経度で調べる
+        tiles = tile.generate_names_area(base_info["UPPER_LEFT_LATITUDE"] - (row_slice.stop - 1) / MAP_RESOLUTION,
+                                         base_info["UPPER_LEFT_LATITUDE"] - row_slice.start / MAP_RESOLUTION,
+                                         base_info["UPPER_LEFT_LONGITUDE"] + col_slice.start / MAP_RESOLUTION,
+                                         base_info["UPPER_LEFT_LONGITUDE"] + (col_slice.stop - 1) / MAP_RESOLUTION)
+        levels = [open_tile(tile_prefix, name, plot_range, target_latitude, factor) + (tile_west,)
+                  for tile_prefix, name, _, tile_west in tiles]
+        coarsest = min(topographic_info["FACTOR"] for _, topographic_info, _ in levels)
+        if coarsest == factor:
+            break
+        factor = coarsest
+    
+    # 第3段階 各タイルの重なる部分だけを読み込んで貼り付ける
+    elevation_data = None
+    sources = []
+    for elevation_map, topographic_info, tile_west in levels:
+        if elevation_data is None:
+            elevation_data = np.zeros((row_slice.stop - row_slice.start, col_slice.stop - col_slice.start),
+                                      dtype=elevation_map.dtype.newbyteorder("="))
+        
+        # 経度0度をまたぐ場合は、ターゲット側の経度に合わせる
+        tile_longitude = topographic_info["UPPER_LEFT_LONGITUDE"] + (tile_west - tile_west % 360)
+        # 基準の格子におけるタイル左上の行と列
+        top = round((base_info["UPPER_LEFT_LATITUDE"] - topographic_info["UPPER_LEFT_LATITUDE"]) * MAP_RESOLUTION)
+        left = round((tile_longitude - base_info["UPPER_LEFT_LONGITUDE"]) * MAP_RESOLUTION)
+        
+        # 抽出範囲と重なる行と列
+        y0, y1 = max(row_slice.start, top), min(row_slice.stop, top + elevation_map.shape[0])
+        x0, x1 = max(col_slice.start, left), min(col_slice.stop, left + elevation_map.shape[1])
+        if y0 >= y1 or x0 >= x1:
+            continue
+        sources.append(topographic_info["SOURCE"])
+        elevation_data[y0 - row_slice.start:y1 - row_slice.start, x0 - col_slice.start:x1 - col_slice.start] = \
+            area.read_window(elevation_map, slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+    
+    # 読み込んだ範囲の左上の緯度経度
+    window_latitude = base_info["UPPER_LEFT_LATITUDE"] - row_slice.start / MAP_RESOLUTION
+    window_longitude = base_info["UPPER_LEFT_LONGITUDE"] + col_slice.start / MAP_RESOLUTION
+    if return_sources:
+        return (elevation_data, elevation_data.shape[1], elevation_data.shape[0],
+                window_latitude, window_longitude, MAP_RESOLUTION, sources)
+    return (elevation_data, elevation_data.shape[1], elevation_data.shape[0],
+            window_latitude, window_longitude, MAP_RESOLUTION)
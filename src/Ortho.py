@@ -2,30 +2,154 @@
 
 """
 指定されたオルソ画像タイルを取得し、抽出範囲の調整を行うモジュールです。
+オルソ画像は独自のラベル（解像度、左上の緯度経度）を持つため、標高データの格子に合わせて再標本化します。
 This module obtains the elevation from the specified elevation tile and adjusts the calculation range.
+The ortho image has its own label geometry, so it is resampled onto the elevation grid.
 """
 
 import os
 import numpy as np
 
-def get_ortho(ortho_img_path, LINES, LINE_SAMPLES):
+import Area as area
+import Read_lbl as read
+import Tile as tile
+import Download as dl
+
+def get_ortho(ortho_img_path, LINES, LINE_SAMPLES, dtype=">u2", offset=0):
     """
     Args:
     img_path: オルソ画像のパス
-    LINES_SAMPLES, LINES: データサイズ
+    LINES_SAMPLES, LINES: データサイズ（オルソ画像のラベルの値）
+    dtype: データ型（Read_lbl.get_sample_dtype でラベルから求める）
+    offset: データ先頭までのバイト数（Read_lbl.get_image_offset でラベルから求める）
     
     Return:
-    ortho_image: オルソ画像 
+    ortho_image: オルソ画像のメモリマップ（この時点ではファイルを読み込まない）
     """
     
     print("オルソ画像の読み込み中...")
     
-    # バイナリモードでファイルを開く
-    with open(ortho_img_path, 'rb') as file:
-        # NumPyで画像を読み込み
-        image_array = np.fromfile(file, dtype=">u2")
-        ortho_image = image_array.reshape(LINES, LINE_SAMPLES)
-    return ortho_image
+    # 必要な部分だけを後で読み込む
+    return area.open_elevation(ortho_img_path, LINE_SAMPLES, LINES, dtype, offset)
+
+
+# 標高データの格子に合わせたオルソ画像を取得する
+def get_ortho_window(ortho_img_path, ortho_lbl_path, grid_latitude, grid_longitude):
+    """
+    Args:
+    ortho_img_path: オルソ画像のパス
+    ortho_lbl_path: オルソ画像のラベルのパス
+    grid_latitude: 標高データの各行の緯度（1次元配列、Area.select_area の selected_y[:, 0]）
+    grid_longitude: 標高データの各列の経度（1次元配列、Area.select_area の selected_x[0, :]）
+    
+    Return:
+    selected_ortho: 標高データと同じ形状のオルソ画像（float32）
+    """
+    
+    # オルソ画像自身のラベルから地理情報とデータ型を読み取る
+    label = read.parse_lbl(ortho_lbl_path)
+    geometry = read.get_geometry(label)
+    ortho_map = get_ortho(ortho_img_path, geometry["LINES"], geometry["LINE_SAMPLES"],
+                          read.get_sample_dtype(label, ">u2"), read.get_image_offset(label))
+    return resample_ortho(ortho_map, geometry["UPPER_LEFT_LATITUDE"], geometry["UPPER_LEFT_LONGITUDE"],
+                          geometry["MAP_RESOLUTION"], grid_latitude, grid_longitude)
+
+
+# 標高データの格子に重なるすべてのオルソ画像タイルから、格子に合わせたオルソ画像を組み立てる
+def get_ortho_mosaic(grid_latitude, grid_longitude):
+    """
+    Args:
+    grid_latitude: 標高データの各行の緯度（1次元配列、Area.select_area の selected_y[:, 0]）
+    grid_longitude: 標高データの各列の経度（1次元配列、Area.select_area の selected_x[0, :]）
+    
+    Return:
+    selected_ortho: 標高データと同じ形状のオルソ画像（float32、どのタイルにも含まれない部分は NaN）
+    
+    Mosaic.get_elevation_mosaic と同じく、タイル境界付近では隣接タイルもダウンロードして必要な部分だけを読み込む。
+    """
+    
+    grid_latitude = np.asarray(grid_latitude, dtype=np.float64)
+    grid_longitude = np.asarray(grid_longitude, dtype=np.float64)
+    selected_ortho = np.full((grid_latitude.size, grid_longitude.size), np.nan, dtype=np.float32)
+    
+    tiles = tile.generate_names_area(grid_latitude.min(), grid_latitude.max(), grid_longitude.min(), grid_longitude.max())
+    for prefix, tile_name, _, tile_west in tiles:
+        ortho_img_path, ortho_lbl_path = dl.download_ortho(prefix, tile_name)
+        label = read.parse_lbl(ortho_lbl_path)
+        geometry = read.get_geometry(label)
+        ortho_map = get_ortho(ortho_img_path, geometry["LINES"], geometry["LINE_SAMPLES"],
+                              read.get_sample_dtype(label, ">u2"), read.get_image_offset(label))
+        # 経度0度をまたぐ場合は、格子側の経度に合わせる
+        tile_longitude = geometry["UPPER_LEFT_LONGITUDE"] + (tile_west - tile_west % 360)
+        part = resample_ortho(ortho_map, geometry["UPPER_LEFT_LATITUDE"], tile_longitude, geometry["MAP_RESOLUTION"],
+                              grid_latitude, grid_longitude, fill=np.nan)
+        # 先に埋まった部分（タイル境界の重なり）は上書きしない
+        np.copyto(selected_ortho, part, where=np.isnan(selected_ortho))
+    return selected_ortho
+
+
+# オルソ画像の必要な部分だけを読み込み、標高データの格子へ双線形補間する
+def resample_ortho(ortho_map, UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION,
+                   grid_latitude, grid_longitude, fill=None):
+    """
+    Args:
+    ortho_map: オルソ画像のメモリマップ
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: オルソ画像左上の緯度経度
+    MAP_RESOLUTION: オルソ画像のマップスケーリング係数 <pixel/deg>
+    grid_latitude: 標高データの各行の緯度（1次元配列）
+    grid_longitude: 標高データの各列の経度（1次元配列）
+    fill: オルソ画像の外側に入れる値（None の場合は端のピクセルで埋める）
+    
+    Return:
+    selected_ortho: 標高データと同じ形状のオルソ画像（float32）
+    
+    格子は緯度と経度が行と列で独立しているため、行方向と列方向の補間を分けて行う。
+    fill を指定した場合、オルソ画像の外側（端のピクセルから半ピクセルより外）には fill を入れる（get_ortho_mosaic で使う）。
+    """
+    
+    print("オルソ画像整形中...")
+    
+    LINES, LINE_SAMPLES = ortho_map.shape
+    grid_latitude = np.asarray(grid_latitude, dtype=np.float64)
+    grid_longitude = np.asarray(grid_longitude, dtype=np.float64)
+    
+    # 標高データの格子点に対応するオルソ画像の行と列（小数）
+    rows = (UPPER_LEFT_LATITUDE - grid_latitude) * MAP_RESOLUTION
+    cols = (grid_longitude - UPPER_LEFT_LONGITUDE) * MAP_RESOLUTION
+    
+    # オルソ画像に含まれる格子点だけを補間する
+    if fill is None:
+        inside_rows = np.ones(rows.shape, dtype=bool)
+        inside_cols = np.ones(cols.shape, dtype=bool)
+    else:
+        inside_rows = (rows >= -0.5) & (rows < LINES - 0.5)
+        inside_cols = (cols >= -0.5) & (cols < LINE_SAMPLES - 0.5)
+    selected_ortho = np.full((rows.size, cols.size), 0 if fill is None else fill, dtype=np.float32)
+    if not (inside_rows.any() and inside_cols.any()):
+        return selected_ortho
+    rows = np.clip(rows[inside_rows], 0, LINES - 1)
+    cols = np.clip(cols[inside_cols], 0, LINE_SAMPLES - 1)
+    
+    # 補間に必要な範囲だけをメモリマップから読み込む
+    row_start, row_stop = int(np.floor(rows.min())), min(int(np.floor(rows.max())) + 2, LINES)
+    col_start, col_stop = int(np.floor(cols.min())), min(int(np.floor(cols.max())) + 2, LINE_SAMPLES)
+    window = area.read_window(ortho_map, slice(row_start, row_stop), slice(col_start, col_stop)).astype(np.float32)
+    
+    # 窓の中での左上の番号と重み
+    rows -= row_start
+    cols -= col_start
+    row0 = np.minimum(rows.astype(np.intp), window.shape[0] - 1)
+    col0 = np.minimum(cols.astype(np.intp), window.shape[1] - 1)
+    row1 = np.minimum(row0 + 1, window.shape[0] - 1)
+    col1 = np.minimum(col0 + 1, window.shape[1] - 1)
+    row_weight = (rows - row0).astype(np.float32)[:, np.newaxis]
+    col_weight = (cols - col0).astype(np.float32)
+    
+    # 列方向に補間してから行方向に補間する
+    upper = window[row0][:, col0] * (1 - col_weight) + window[row0][:, col1] * col_weight
+    lower = window[row1][:, col0] * (1 - col_weight) + window[row1][:, col1] * col_weight
+    selected_ortho[np.ix_(inside_rows, inside_cols)] = upper * (1 - row_weight) + lower * row_weight
+    return selected_ortho
 
 
 # 対象を中心として特定範囲のオルソ画像を抽出する
@@ -39,39 +163,19 @@ def selected_ortho(ortho_image, target_latitude, target_longitude, LINE_SAMPLES,
     LINE_SAMPLES, LINES: データサイズ
     UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: タイル左上の緯度経度
     MAP_RESOLUTION: マップスケーリング係数 <km/pixel>
-    plot_range: プロット管理番号
-
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    
     Return:
     selected_ortho: 抽出されたオルソ画像
     """
     
     print("オルソ画像整形中...")
     
-    # 第1段階 ピクセル座標を緯度と経度に変換
-    lon = UPPER_LEFT_LONGITUDE + np.arange(LINE_SAMPLES) / MAP_RESOLUTION
-    lat = UPPER_LEFT_LATITUDE - np.arange(LINES) / MAP_RESOLUTION
-    
-    # 第2段階 管理番号に基づいて抽出範囲を指定
-    if plot_range == 0:   # range: 6,000m
-        plot_range = 0.1    # <deg>
-    elif plot_range == 1: # range: 3,000m
-        plot_range = 0.05   # <deg>
-    elif plot_range == 2: # range: 600m
-        plot_range = 0.01   # <deg>
-    else:                 # range: 300m
-        plot_range = 0.005  # <deg>
-
-    # 通常の抽出（変更の必要なければこのまま）
-    x_indices = np.where((lon >= target_longitude - plot_range) & (lon <= target_longitude + plot_range))[0]
-    y_indices = np.where((lat >= target_latitude - plot_range) & (lat <= target_latitude + plot_range))[0]
-    
-    # 抽出範囲を変化させる場合はコチラ
-    # Plot.py のアスペクト比の変更をあわせて推奨します。
-    # 現在の記述： 経度の範囲を東西に半減、緯度の範囲を北方向に限定
-    #x_indices = np.where((lon >= target_longitude - (plot_range/2)) & (lon <= target_longitude + (plot_range/2)))[0]
-    #y_indices = np.where((lat >= target_latitude - 0) & (lat <= target_latitude + plot_range))[0]
-    
-    # 第3段階 範囲内のデータを抽出
-    selected_ortho = ortho_image[y_indices[:, np.newaxis], x_indices]
+    # 第1段階 抽出範囲の行と列を求める
+    row_slice, col_slice = area.select_bounds(target_latitude, target_longitude, LINE_SAMPLES, LINES,
+                                              UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range)
+    
+    # 第2段階 範囲内のデータを抽出
+    selected_ortho = ortho_image[row_slice, col_slice]
     
     return selected_ortho
\ No newline at end of file
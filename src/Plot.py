@@ -5,14 +5,90 @@
 This module returns 3D plots based on elevation data, hillshade, and latitude/longitude information.
 """
 
+import itertools
 import numpy as np
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import Lazy as lazy
+import Extent as extent
+
+# plotly は初めて使う時点で読み込む
+go = lazy.lazy_import("plotly.graph_objects")
+subplots = lazy.lazy_import("plotly.subplots")
+
+# 3Dプロットの頂点数の上限（描画範囲によらずファイルサイズと描画の重さをおおよそ一定にする）
+VERTEX_BUDGET = 250000
+# アニメーションの1フレームの表示時間 <ms>
+FRAME_DURATION = 200
+
+
+# 中心（ターゲット）付近は全ての点を残し、離れるほど間隔を広げた番号を選ぶ
+def lod_indices(size, samples, center):
+    """
+    Args:
+    size: 軸方向のデータ数
+    samples: 残す点の数の上限
+    center: 中心の番号
+    
+    Return:
+    indices: 残す点の番号（両端と中心を含む、昇順）
+    
+    間隔は中心からの距離 d に対して 1 + growth * d とし、点の数が上限に収まる最小の growth を二分探索で求める。
+    """
+    
+    if samples >= size:
+        return np.arange(size)
+    
+    def build(growth):
+        indices = {0, center, size - 1}
+        for direction, limit in ((-1, center), (1, size - 1 - center)):
+            distance = 0
+            while True:
+                step = int(1 + growth * distance)
+                # 端との間隔が狭くなりすぎる場合は、端で打ち切る
+                if limit - distance - step < step / 2:
+                    break
+                distance += step
+                indices.add(center + direction * distance)
+        return indices
+    
+    low, high = 0.0, 1.0
+    while len(build(high)) > samples and high < size:
+        high *= 2
+    for _ in range(40):
+        growth = (low + high) / 2
+        if len(build(growth)) > samples:
+            low = growth
+        else:
+            high = growth
+    return np.array(sorted(build(high)))
+
+
+# 頂点数の上限に収まるように、行と列を間引く番号を求める
+def lod_grid(shape, vertex_budget):
+    """
+    Args:
+    shape: データの形状 (行, 列)
+    vertex_budget: 頂点数の上限（None の場合は間引かない）
+    
+    Returns:
+    rows: 残す行の番号
+    cols: 残す列の番号
+    """
+    
+    lines, samples = shape
+    if vertex_budget is None:
+        return np.arange(lines), np.arange(samples)
+    # 縦横の比率を保って上限を行と列に振り分ける
+    row_samples = max(2, int(np.sqrt(vertex_budget * lines / samples)))
+    col_samples = max(2, int(vertex_budget / row_samples))
+    rows = lod_indices(lines, row_samples, int(lines / 2))
+    cols = lod_indices(samples, col_samples, int(samples / 2))
+    return rows, cols
 
 # 3Dプロットを作成
 def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
             target_latitude, target_longitude, sun_azimuth, sun_altdeg,
-            plot_range, viewpoint, smoothing_active, ortho_active):
+            plot_range, viewpoint, smoothing_active, ortho_active, shadow_active=False,
+            vertex_budget=VERTEX_BUDGET):
     """
     Args:
     selected_data: 指定範囲の標高データ
@@ -24,10 +100,12 @@ def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
     target_longitude: ターゲットの経度
     sun_azimuth: 太陽（光源）の方位
     sun_altdeg: 太陽（光源）の仰角
-    plot_range: プロット管理番号
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
     viewpoint: 視点の高さ
     smoothing_active: スムージングの有効化
     ortho_active: オルソ画像の使用
+    shadow_active: 影（投影）の合成
+    vertex_budget: 頂点数の上限（None の場合は間引かない）
     
     Return:
     fig: 3Dプロット
@@ -37,14 +115,22 @@ def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
     
     fig = go.Figure()
     
+    # 頂点数が上限を超える場合は、ターゲット付近を残して周辺ほど粗く間引く
+    # 経度と緯度は行と列ごとに共通なので1次元で渡す（間隔が不均一でもよい）
+    rows, cols = lod_grid(haversine_data.shape, vertex_budget)
+    lod_z = haversine_data[np.ix_(rows, cols)]
+    lod_surface = surface[np.ix_(rows, cols)]
+    lod_x = selected_x[0, cols]
+    lod_y = selected_y[rows, 0]
+    
     # 通常のホバー表示設定
     normal_hover = "Lat : %{y}<br>Lon: %{x}<br>Apparent elevation: %{z}<extra></extra>"
     # 標高データのプロット
     surface_plot = go.Surface(
-        z=haversine_data, x=selected_x, y=selected_y,
+        z=lod_z, x=lod_x, y=lod_y,
         colorscale='gray',
         showscale=False,
-        surfacecolor=surface,
+        surfacecolor=lod_surface,
         opacity=1,
         hoverinfo="x+y+z",
         hovertemplate=normal_hover,
@@ -74,22 +160,9 @@ def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
     
     # plot_rangeによる変数設定
     # z軸の範囲、x,y軸の間隔、抽出範囲を示すテキスト
-    if plot_range == 0:   # range: 6,000m
-        z_range = 3000
-        axis_span = 0.02
-        range_txt = "6,000m"
-    elif plot_range == 1: # range: 3,000m
-        z_range = 1500
-        axis_span = 0.01
-        range_txt = "3,000m"
-    elif plot_range == 2: # range: 600m
-        z_range = 300 
-        axis_span = 0.003
-        range_txt = "600m"
-    else:                 # range: 300m
-        z_range = 150 
-        axis_span = 0.001
-        range_txt = "300m"
+    z_range = extent.z_range(plot_range)
+    lon_span, lat_span = extent.axis_spans(plot_range, target_latitude)
+    range_txt = extent.label(plot_range)
     
     # 方角マーカーの高さを設定
     direction_elevation = np.median(selected_data) + (z_range/2)
@@ -141,8 +214,8 @@ def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
     z_max = standard_elevation + z_range
     
     # タイトルテキスト
-    parameter_txt0 = f'"HEVENTARS" simulation at ({target_latitude}, {target_longitude}) in plot range {range_txt} per side.'
-    parameter_txt1 = f'"HEVENTARS" simulation at ({target_latitude}, {target_longitude}) in plot range {range_txt} per side. Smoothing is on.'
+    parameter_txt0 = f'"HEVENTARS" simulation at ({target_latitude}, {target_longitude}) in plot range {range_txt}.'
+    parameter_txt1 = f'"HEVENTARS" simulation at ({target_latitude}, {target_longitude}) in plot range {range_txt}. Smoothing is on.'
     parameter_txt2 = f'<br>Expression method is hill shade; sun azimuth is {sun_azimuth} and sun altdeg is {sun_altdeg}.'
     parameter_txt3 = f'<br>Expression method is ortho image from KAGUYA.'
     # タイトルの設定
@@ -160,6 +233,9 @@ def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
         else:
             # スムージングあり、オルソ画像
             title_txt = parameter_txt1 + parameter_txt3
+    # 影を合成した場合
+    if shadow_active == True and ortho_active == False:
+        title_txt = title_txt + ' Cast shadows are on.'
     
     # 軸の設定
     layout = go.Layout(
@@ -169,26 +245,22 @@ def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
                 backgroundcolor="rgb(0, 0, 40, 0.5)",
                 gridcolor="#C0C0C0",
                 gridwidth=4,
-                dtick=axis_span,),
+                dtick=lon_span,),
             yaxis=dict(
                 title='Latitude',
                 backgroundcolor="rgb(0, 0, 40, 0.5)",
                 gridcolor="#C0C0C0",
                 gridwidth=4,
-                dtick=axis_span,),
+                dtick=lat_span,),
             zaxis=dict(
                 title='Elevation',
                 backgroundcolor="rgb(0, 0, 40, 0.5)",
                 gridcolor="#918D40",
                 gridwidth=3,
                 range=[z_min, z_max]),
-            # 通常のアスペクト比（変更の必要なければこのまま）
+            # アスペクト比は描画範囲の東西と南北の大きさに合わせる（正方形の場合は x=1, y=1, z=1）
             aspectmode="manual",
-            aspectratio=dict(x=1, y=1, z=1)
-            
-            # アスペクト比の設定はコチラ
-            # Area.py 及び Ortho.py の抽出範囲の変更をあわせて推奨します。
-            #aspectratio=dict(x=1, y=5, z=1)
+            aspectratio=extent.aspect_ratio(plot_range)
         ),
         margin=dict(l=0, r=0, b=0, t=60),
         title=title_txt,
@@ -204,8 +276,8 @@ def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
         )
     
     # サブプロットを作成
-    fig = make_subplots(rows=1, cols=1, specs=[[{'type': 'surface'}]])
-
+    fig = subplots.make_subplots(rows=1, cols=1, specs=[[{'type': 'surface'}]])
+    
     # surfaceを追加
     fig.add_trace(surface_plot, row=1, col=1)
     # ターゲットマーカーを追加
@@ -215,9 +287,100 @@ def plot_3d(selected_data, haversine_data, surface, selected_x, selected_y,
     fig.add_trace(west_marker, row=1, col=1)
     fig.add_trace(south_marker, row=1, col=1)
     fig.add_trace(north_marker, row=1, col=1)
-
+    
     # レイアウトを更新
     fig.update_layout(layout, scene_camera=camera, showlegend=False)
     
     # プロットを返す
-    return fig
\ No newline at end of file
+    return fig
+
+# 陰影起伏を 0 から 255 の uint8 に量子化する
+def quantize_surface(surface):
+    """
+    Arg:
+    surface: 0 から 1 の陰影起伏
+    
+    Return:
+    quantized: uint8 の陰影起伏
+    """
+    
+    return np.rint(np.clip(surface, 0, 1) * 255).astype(np.uint8)
+
+
+# 太陽の位置ごとの陰影起伏をフレームとする3Dアニメーションを作成
+# 地形の形状は1度だけ作成し、各フレームには表面の色（surfacecolor）だけを持たせる
+def plot_animation(selected_data, haversine_data, surfaces, selected_x, selected_y,
+                   target_latitude, target_longitude, sun_positions,
+                   plot_range, viewpoint, smoothing_active, shadow_active=False,
+                   vertex_budget=VERTEX_BUDGET, frame_duration=FRAME_DURATION):
+    """
+    Args:
+    selected_data: 指定範囲の標高データ
+    haversine_data: 曲率補正された標高データ
+    surfaces: 太陽の位置ごとの陰影起伏（0 から 1、ジェネレータでよい）
+    selected_x: 指定範囲の経度データ
+    selected_y: 指定範囲の緯度データ
+    target_latitude: ターゲットの緯度
+    target_longitude: ターゲットの経度
+    sun_positions: 太陽の (方位, 仰角) のリスト（surfaces と同じ順）
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    viewpoint: 視点の高さ
+    smoothing_active: スムージングの有効化
+    shadow_active: 影（投影）の合成
+    vertex_budget: 頂点数の上限（None の場合は間引かない）
+    frame_duration: 1フレームの表示時間 <ms>
+    
+    Returns:
+    fig: 最初の太陽の位置の3Dプロット（再生ボタンとスライダーつき）
+    frames: フレームの辞書を1つずつ返すジェネレータ（surfacecolor は間引いた後の uint8 配列）
+    
+    陰影起伏はフレームを取り出す時点で1枚ずつ求められるため、メモリ使用量は間引いた後のフレームの合計程度に収まる。
+    """
+    
+    surfaces = iter(surfaces)
+    first_surface = next(surfaces)
+    sun_azimuth, sun_altdeg = sun_positions[0]
+    fig = plot_3d(selected_data, haversine_data, first_surface, selected_x, selected_y,
+                  target_latitude, target_longitude, sun_azimuth, sun_altdeg,
+                  plot_range, viewpoint, smoothing_active, False, shadow_active, vertex_budget)
+    
+    print("アニメーションの構築中...")
+    
+    # plot_3d と同じ行と列を残し、全てのフレームで同じ色の範囲（0 から 255）を使う
+    rows, cols = lod_grid(haversine_data.shape, vertex_budget)
+    first_color = quantize_surface(first_surface[np.ix_(rows, cols)])
+    del first_surface
+    fig.update_traces(surfacecolor=first_color, cmin=0, cmax=255, selector=dict(type="surface"))
+    
+    # フレームの名前（スライダーの表示）
+    names = [f"{azimuth:g}:{altdeg:g}" for azimuth, altdeg in sun_positions]
+    
+    # 再生ボタンとスライダー（曲面は描き直しが必要なため redraw を有効にする）
+    play = dict(frame=dict(duration=frame_duration, redraw=True), transition=dict(duration=0), fromcurrent=True)
+    pause = dict(frame=dict(duration=0, redraw=False), transition=dict(duration=0), mode="immediate")
+    step = dict(frame=dict(duration=0, redraw=True), transition=dict(duration=0), mode="immediate")
+    fig.update_layout(
+        updatemenus=[dict(type="buttons", showactive=False, x=0.02, y=0.02, xanchor="left", yanchor="bottom",
+                          buttons=[dict(label="Play", method="animate", args=[None, play]),
+                                   dict(label="Pause", method="animate", args=[[None], pause])])],
+        sliders=[dict(active=0, x=0.15, len=0.8, y=0.02, yanchor="bottom",
+                      currentvalue=dict(prefix="Sun azimuth:altdeg = "),
+                      steps=[dict(label=name, method="animate", args=[[name], step]) for name in names])],
+    )
+    
+    # タイトルの設定
+    title_txt = f'"HEVENTARS" sun path animation at ({target_latitude}, {target_longitude}) in plot range {extent.label(plot_range)}.'
+    if smoothing_active == True:
+        title_txt = title_txt + ' Smoothing is on.'
+    title_txt = title_txt + f'<br>Expression method is hill shade for {len(sun_positions)} sun positions (azimuth:altdeg).'
+    if shadow_active == True:
+        title_txt = title_txt + ' Cast shadows are on.'
+    fig.update_layout(title=title_txt)
+    
+    # 各フレームは曲面（最初のトレース）の表面の色だけを置き換える
+    def frames():
+        for name, surface in zip(names, itertools.chain([None], surfaces)):
+            color = first_color if surface is None else quantize_surface(surface[np.ix_(rows, cols)])
+            yield {"name": name, "data": [{"type": "surface", "surfacecolor": color}], "traces": [0]}
+    
+    return fig, frames()
\ No newline at end of file
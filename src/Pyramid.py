@@ -0,0 +1,270 @@
+# Pyramid.py
+
+"""
+標高タイルごとに、2倍、4倍、8倍 ... に縮小した概観データ（ピラミッド）を作成して保持するモジュールです。
+広い描画範囲では、出力の解像度を満たす最も粗い段を読み込むことで、狭い範囲と同程度の処理量に抑えます。
+概観データは事前に作成します（このスクリプト又は Seed.py --pyramid）。描画時には作成済みの段だけを使います。
+This module builds a block-averaged overview pyramid (2x, 4x, 8x, ...) per elevation tile,
+stores the levels as memory-mappable .npy files next to the source with a small JSON index,
+and picks the coarsest level that still meets the output resolution.
+Levels are built only by an explicit precompute step (this script or Seed.py --pyramid), never while rendering.
+"""
+
+import os
+import json
+import argparse
+import threading
+import numpy as np
+
+import Plot as pl
+import Cache as cache
+
+# 概観データの使用（無効の場合は常に元の解像度で読み込む）
+PYRAMID_ACTIVE = True
+# 最も粗い段の短辺の最小ピクセル数（これより小さくなる段は作らない）
+MIN_LEVEL_SIZE = 256
+# 一度に縮小する行数（元の段の行数、偶数）
+BLOCK_ROWS = 2048
+# 欠損値とみなす値の上限（LRO NAC DTM の欠損値は -3.4028226550889045e+38）
+NODATA_THRESHOLD = -1e30
+# 有効な値を1つも含まないピクセルに入れる値
+NODATA_VALUE = np.float32(-3.4028226550889045e+38)
+
+# 開いた段
+# キー: (元のファイルのパス, 倍率)
+_open_levels = {}
+# 開いた段の辞書の排他制御
+_levels_lock = threading.Lock()
+# 作成中の元のファイルごとの排他制御（同じファイルを同時に作成せず、他のファイルの処理は妨げない）
+_building_locks = {}
+
+
+# 概観データの索引と各段のファイルのパス
+def pyramid_paths(source_path, factor=None):
+    """
+    Args:
+    source_path: 元のファイルのパス
+    factor: 縮小の倍率（None の場合は索引のパス）
+    
+    Return:
+    path: 保存先のパス（元のファイルと同じディレクトリ）
+    """
+    
+    stem = os.path.splitext(source_path)[0]
+    if factor is None:
+        return stem + "_pyramid.json"
+    return stem + f"_x{factor}.npy"
+
+
+# 縦横2倍に縮小する（2×2 ピクセルのうち有効な値の平均）
+def downsample(block):
+    """
+    Arg:
+    block: 縮小する配列（行数と列数が奇数の場合は端のピクセルを1つで平均する）
+    
+    Return:
+    reduced: 縮小した配列（float32）
+    """
+    
+    rows, cols = block.shape
+    padded = np.zeros((rows + rows % 2, cols + cols % 2), dtype=np.float64)
+    count = np.zeros(padded.shape, dtype=np.uint8)
+    values = np.asarray(block, dtype=np.float64)
+    valid = np.isfinite(values) & (values > NODATA_THRESHOLD)
+    padded[:rows, :cols] = np.where(valid, values, 0)
+    count[:rows, :cols] = valid
+    
+    shape = (padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    total = padded.reshape(shape).sum(axis=(1, 3))
+    count = count.reshape(shape).sum(axis=(1, 3))
+    reduced = np.full(total.shape, NODATA_VALUE, dtype=np.float32)
+    np.divide(total, count, out=reduced, where=count > 0, casting="unsafe")
+    return reduced
+
+
+# 概観データを作成する（元の段から順に 1/2 ずつ縮小する）
+def build_pyramid(source_path, base):
+    """
+    Args:
+    source_path: 元のファイルのパス
+    base: 元の解像度の標高データ（メモリマップなど、行ごとに読めるもの）
+    
+    Return:
+    index: 索引（元のファイルの更新時刻、サイズ、各段の倍率と形状）
+    """
+    
+    print("概観データの作成中...")
+    
+    stat = os.stat(source_path)
+    index = {"source": os.path.basename(source_path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+             "shape": list(base.shape), "levels": []}
+    
+    previous, factor = base, 1
+    while min((previous.shape[0] + 1) // 2, (previous.shape[1] + 1) // 2) >= MIN_LEVEL_SIZE:
+        factor *= 2
+        level_path = pyramid_paths(source_path, factor)
+        shape = ((previous.shape[0] + 1) // 2, (previous.shape[1] + 1) // 2)
+    
+        # 書き込み途中のファイルが残らないように、プロセスごとに別名の一時ファイルに書き込んでから置き換える
+        partial_path = cache.temporary_path(level_path)
+        try:
+            level = np.lib.format.open_memmap(partial_path, mode="w+", dtype=np.float32, shape=shape)
+            for start in range(0, previous.shape[0], BLOCK_ROWS):
+                level[start // 2:(start + BLOCK_ROWS + 1) // 2] = downsample(previous[start:start + BLOCK_ROWS])
+            level.flush()
+            del level
+            os.replace(partial_path, level_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+    
+        index["levels"].append({"factor": factor, "file": os.path.basename(level_path), "shape": list(shape)})
+        previous = np.load(level_path, mmap_mode="r")
+    
+    cache.write_json(pyramid_paths(source_path), index)
+    return index
+
+
+# 保存済みの索引を読み込む（元のファイルが更新されている場合は None）
+def load_index(source_path):
+    """
+    Arg:
+    source_path: 元のファイルのパス
+    
+    Return:
+    index: 索引（ない場合、古い場合は None）
+    """
+    
+    index_path = pyramid_paths(source_path)
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with open(index_path, 'r', encoding='utf-8') as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(source_path)
+    if index.get("mtime_ns") != stat.st_mtime_ns or index.get("size") != stat.st_size:
+        return None
+    if not all(os.path.exists(pyramid_paths(source_path, level["factor"])) for level in index["levels"]):
+        return None
+    return index
+
+
+# 描画範囲に対して、出力の解像度を満たす最も粗い倍率を求める
+def choose_factor(window_lines, window_samples, target_vertices=None):
+    """
+    Args:
+    window_lines, window_samples: 元の解像度での描画範囲のピクセル数
+    target_vertices: 出力に必要な頂点数（None の場合は Plot.VERTEX_BUDGET）
+    
+    Return:
+    factor: 縮小の倍率（2 のべき乗、1 の場合は元の解像度）
+    """
+    
+    target_vertices = target_vertices or pl.VERTEX_BUDGET
+    factor = 1
+    while (window_lines / (factor * 2)) * (window_samples / (factor * 2)) >= target_vertices:
+        factor *= 2
+    return factor
+
+
+# 指定した倍率以下で最も粗い段を開く（作成済みの概観データだけを使い、描画時には作成しない）
+def open_level(source_path, factor):
+    """
+    Args:
+    source_path: 元のファイルのパス
+    factor: 希望する縮小の倍率
+    
+    Returns:
+    level: 概観データの float32 のメモリマップ（使用できる段がない場合は None）
+    factor: 実際の倍率（使用できる段がない場合は 1）
+    
+    概観データがない場合や元のファイルより古い場合は、元の解像度から抽出範囲だけを読み込む。
+    """
+    
+    if not PYRAMID_ACTIVE or factor <= 1:
+        return None, 1
+    
+    key = (os.path.abspath(source_path), factor)
+    with _levels_lock:
+        if key in _open_levels:
+            return _open_levels[key]
+    
+    index = load_index(source_path)
+    factors = [level["factor"] for level in index["levels"] if level["factor"] <= factor] if index else []
+    if not factors:
+        # 後から作成された場合に使えるように、見つからなかった結果は保持しない
+        return None, 1
+    level = (np.load(pyramid_paths(source_path, max(factors)), mmap_mode="r"), max(factors))
+    with _levels_lock:
+        _open_levels[key] = level
+    return level
+
+
+# 概観データを作成する（作成済みで元のファイルが更新されていない場合は何もしない）
+def ensure_pyramid(source_path, open_base):
+    """
+    Args:
+    source_path: 元のファイルのパス
+    open_base: 元の解像度の標高データを返す関数（作成する場合のみ呼ばれる）
+    
+    Return:
+    index: 索引
+    """
+    
+    source = os.path.abspath(source_path)
+    with _levels_lock:
+        building_lock = _building_locks.setdefault(source, threading.Lock())
+    
+    # 作成は元のファイルごとに排他制御し、他のファイルの処理は待たせない
+    try:
+        with building_lock:
+            index = load_index(source_path)
+            if index is None:
+                index = build_pyramid(source_path, open_base())
+                # 作り直す前に開いた段は使わない
+                with _levels_lock:
+                    for key in [key for key in _open_levels if key[0] == source]:
+                        del _open_levels[key]
+    finally:
+        with _levels_lock:
+            _building_locks.pop(source, None)
+    return index
+
+
+# 縮小した段の地理情報を求める
+def level_geometry(UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, factor):
+    """
+    Args:
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: 元のデータ左上の緯度経度
+    MAP_RESOLUTION: 元のマップスケーリング係数 <pixel/deg>
+    factor: 縮小の倍率
+    
+    Returns:
+    UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE: 縮小した段の左上のピクセルの緯度経度
+    MAP_RESOLUTION: 縮小した段のマップスケーリング係数 <pixel/deg>
+    
+    縮小した段の各ピクセルは、元の factor × factor ピクセルの中心の位置とする。
+    """
+    
+    shift = (factor - 1) / 2 / MAP_RESOLUTION
+    return UPPER_LEFT_LATITUDE - shift, UPPER_LEFT_LONGITUDE + shift, MAP_RESOLUTION / factor
+
+
+if __name__ == "__main__":
+    
+    import Area as area
+    
+    # 標高データを指定して概観データを事前に作成する
+    parser = argparse.ArgumentParser(description="概観データ（ピラミッド）の事前作成")
+    parser.add_argument("paths", nargs="+",
+                        help="標高データのパス（KAGUYA の .img は同じ名前の .lbl を読む、LRO は .tif）")
+    args = parser.parse_args()
+    
+    for path in args.paths:
+        stem, extension = os.path.splitext(path)
+        lbl_path = None if extension.lower() in (".tif", ".tiff") else stem + ".lbl"
+        index = area.precompute_pyramid(path, lbl_path)
+        print(f"{path}: {[level['factor'] for level in index['levels']]}")
@@ -7,6 +7,35 @@ This module returns information from a downloaded lbl file.
 
 import os
 import re
+import threading
+from collections import namedtuple, OrderedDict
+
+# 単位つきの値（例: 25.0548146 <DEG>）
+Quantity = namedtuple("Quantity", ["value", "unit"])
+
+# 字句の種類（コメント、文字列、単位、記号、それ以外の語）
+TOKEN_PATTERN = re.compile(r'/\*.*?\*/|"[^"]*"|\'[^\']*\'|<[^>]*>|[=(){},]|[^\s=(){},"\'<>]+', re.S)
+
+# SAMPLE_TYPE とデータ型（エンディアン、種類）の対応
+SAMPLE_TYPES = {
+    "MSB_INTEGER": ">i", "SUN_INTEGER": ">i", "MAC_INTEGER": ">i", "INTEGER": ">i",
+    "LSB_INTEGER": "<i", "PC_INTEGER": "<i", "VAX_INTEGER": "<i",
+    "MSB_UNSIGNED_INTEGER": ">u", "SUN_UNSIGNED_INTEGER": ">u", "MAC_UNSIGNED_INTEGER": ">u",
+    "UNSIGNED_INTEGER": ">u",
+    "LSB_UNSIGNED_INTEGER": "<u", "PC_UNSIGNED_INTEGER": "<u", "VAX_UNSIGNED_INTEGER": "<u",
+    "IEEE_REAL": ">f", "SUN_REAL": ">f", "MAC_REAL": ">f", "REAL": ">f", "FLOAT": ">f",
+    "PC_REAL": "<f",
+}
+
+# 保持する読み取り済みのラベルの上限（超えた場合は最も長く使用されていないものから削除する）
+MAX_PARSED_LABELS = 256
+
+# 読み取り済みのラベル
+# キー: (パス, 更新時刻, サイズ)、最後に使用したものが末尾
+_parsed_labels = OrderedDict()
+# 読み取り済みのラベルの排他制御（Server.py などで複数のスレッドから使う場合に備える）
+_labels_lock = threading.Lock()
+
 
 # lblファイルから特定の値を読み取る
 def get_lbl(file_path, target_keys):
@@ -21,29 +50,250 @@ def get_lbl(file_path, target_keys):
     
     print("地理情報の読み取り中...")
     
+    # ファイルを読み込む（存在しない場合は None）
+    label = parse_lbl(file_path)
+    if label is None:
+        return None
+    
+    # 結果を格納
+    topographic_info = {}
+    
+    for target_key in target_keys:
+        # 数値の項目のみを辞書に追加（単位は取り除く）
+        value = find_value(label, target_key)
+        if isinstance(value, Quantity):
+            value = value.value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            topographic_info[target_key] = float(value)
+    
+    return topographic_info
+
+
+# lblファイル全体を1度だけ走査して、入れ子の辞書に変換する
+def parse_lbl(file_path):
+    """
+    Arg:
+    file_path: 対象のlblファイルのパス
+    
+    Return:
+    label: ラベルの内容（OBJECT, GROUP は入れ子の辞書、数値は int/float、単位つきは Quantity）
+    
+    同じファイル（パス、更新時刻、サイズが同じ）は2回目以降読み直さない。
+    """
+    
     # ファイルが存在するか確認
     if not os.path.exists(file_path):
         print(f"File not found: {file_path}")
         return None
+    
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    with _labels_lock:
+        if key in _parsed_labels:
+            _parsed_labels.move_to_end(key)
+            return _parsed_labels[key]
+    
+    # 読み取りは排他制御の外で行う（同時に読み取った場合は先に登録された結果を使う）
+    with open(file_path, 'r', encoding='latin-1') as file:
+        label = parse_lbl_text(file.read())
+    with _labels_lock:
+        label = _parsed_labels.setdefault(key, label)
+        _parsed_labels.move_to_end(key)
+        while len(_parsed_labels) > MAX_PARSED_LABELS:
+            _parsed_labels.popitem(last=False)
+    return label
 
-    # ファイルを読み込む
-    with open(file_path, 'r') as file:
-        # ファイルの内容を取得
-        lbl_content = file.read()
-        
-    # 結果を格納
-    topographic_info = {}
 
-    for target_key in target_keys:
-        # 正規表現パターンを構築
-        pattern = re.compile(rf'{target_key}\s*=\s*([-+]?\d*\.\d+|\d+)')
+# ラベルの文字列を入れ子の辞書に変換する
+def parse_lbl_text(lbl_content):
+    """
+    Arg:
+    lbl_content: ラベルの文字列
+    
+    Return:
+    label: ラベルの内容
+    """
+    
+    tokens = [token for token in TOKEN_PATTERN.findall(lbl_content) if not token.startswith("/*")]
+    label = {}
+    # 開いている OBJECT, GROUP の辞書
+    stack = [label]
+    position = 0
+    
+    while position < len(tokens):
+        name = tokens[position]
+        if name == "END":
+            break
+        if position + 1 >= len(tokens) or tokens[position + 1] != "=":
+            # 値を持たない語は読み飛ばす
+            position += 1
+            continue
+        value, position = _parse_value(tokens, position + 2)
+    
+        if name in ("OBJECT", "GROUP"):
+            child = {}
+            _add_item(stack[-1], value, child)
+            stack.append(child)
+        elif name in ("END_OBJECT", "END_GROUP"):
+            if len(stack) > 1:
+                stack.pop()
+        else:
+            _add_item(stack[-1], name, value)
+    
+    return label
 
-        # ファイルの各行を検査
-        for line in lbl_content.split('\n'):
-            match = pattern.search(line)
-            if match:
-                # 一致した行から数値を抽出して辞書に追加
-                topographic_info[target_key] = float(match.group(1))
-                break
 
-    return topographic_info
+# 値を1つ読み取る
+def _parse_value(tokens, position):
+    token = tokens[position] if position < len(tokens) else ""
+    
+    # 列 ( ... ) 又は集合 { ... }
+    if token in ("(", "{"):
+        closing = ")" if token == "(" else "}"
+        values = []
+        position += 1
+        while position < len(tokens) and tokens[position] != closing:
+            if tokens[position] == ",":
+                position += 1
+                continue
+            value, position = _parse_value(tokens, position)
+            values.append(value)
+        return values, position + 1
+    
+    # 文字列
+    if token.startswith('"') or token.startswith("'"):
+        return token[1:-1].strip(), position + 1
+    
+    # 数値（単位が続く場合は Quantity）
+    value = _parse_scalar(token)
+    position += 1
+    if position < len(tokens) and tokens[position].startswith("<"):
+        return Quantity(value, tokens[position][1:-1].strip()), position + 1
+    return value, position
+
+
+def _parse_scalar(token):
+    for convert in (int, float):
+        try:
+            return convert(token)
+        except ValueError:
+            pass
+    # 基数つきの整数（例: 16#FF#）
+    match = re.fullmatch(r'(\d+)#([0-9A-Fa-f]+)#', token)
+    if match:
+        return int(match.group(2), int(match.group(1)))
+    return token
+
+
+# 同じ名前の OBJECT, GROUP が繰り返される場合はリストにまとめる
+def _add_item(container, name, value):
+    if name in container and isinstance(value, dict):
+        previous = container[name]
+        container[name] = (previous if isinstance(previous, list) else [previous]) + [value]
+    else:
+        container[name] = value
+
+
+# 見つからないことを表す値
+_MISSING = object()
+
+
+# 入れ子の中も含めて、最初に現れる項目の値を取り出す
+def find_value(label, key, default=None):
+    """
+    Args:
+    label: parse_lbl で読み取ったラベル
+    key: 項目名
+    default: 見つからない場合の値
+    
+    Return:
+    value: 項目の値
+    """
+    
+    for name, value in label.items():
+        if name == key:
+            return value
+        children = value if isinstance(value, list) else [value]
+        for child in children:
+            if isinstance(child, dict):
+                found = find_value(child, key, _MISSING)
+                if found is not _MISSING:
+                    return found
+    return default
+
+
+# 単位を取り除いた数値を取り出す
+def find_number(label, key, default=None):
+    value = find_value(label, key, default)
+    return value.value if isinstance(value, Quantity) else value
+
+
+# 地理情報（データサイズ、左上の緯度経度、マップスケーリング係数）を取り出す
+def get_geometry(label):
+    """
+    Arg:
+    label: parse_lbl で読み取ったラベル
+    
+    Return:
+    geometry: LINES, LINE_SAMPLES, UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, MAP_RESOLUTION の辞書
+    
+    UPPER_LEFT_* がない場合（LRO NAC DTM など）は MAXIMUM_LATITUDE, WESTERNMOST_LONGITUDE を使用する。
+    """
+    
+    geometry = {
+        "LINES": int(find_number(label, "LINES")),
+        "LINE_SAMPLES": int(find_number(label, "LINE_SAMPLES")),
+        "UPPER_LEFT_LATITUDE": find_number(label, "UPPER_LEFT_LATITUDE", find_number(label, "MAXIMUM_LATITUDE")),
+        "UPPER_LEFT_LONGITUDE": find_number(label, "UPPER_LEFT_LONGITUDE",
+                                            find_number(label, "WESTERNMOST_LONGITUDE")),
+        "MAP_RESOLUTION": find_number(label, "MAP_RESOLUTION"),
+    }
+    return geometry
+
+
+# SAMPLE_TYPE と SAMPLE_BITS から NumPy のデータ型を求める
+def get_sample_dtype(label, default=">i2"):
+    """
+    Args:
+    label: parse_lbl で読み取ったラベル
+    default: 記載がない場合のデータ型
+    
+    Return:
+    dtype: データ型の文字列（例: ">i2"）
+    """
+    
+    sample_type = find_value(label, "SAMPLE_TYPE")
+    sample_bits = find_number(label, "SAMPLE_BITS")
+    if sample_type not in SAMPLE_TYPES or sample_bits is None:
+        return default
+    kind = SAMPLE_TYPES[sample_type]
+    nbytes = int(sample_bits) // 8
+    # 1バイトの場合はエンディアンを持たない
+    if nbytes == 1:
+        return "|" + kind[1] + "1"
+    return kind + str(nbytes)
+
+
+# データ先頭までのバイト数を求める（^IMAGE のポインタ）
+def get_image_offset(label):
+    """
+    Arg:
+    label: parse_lbl で読み取ったラベル
+    
+    Return:
+    offset: データ先頭までのバイト数（別ファイルの先頭から始まる場合は 0）
+    """
+    
+    pointer = label.get("^IMAGE")
+    # ("ファイル名", 位置) の形式
+    if isinstance(pointer, list):
+        pointer = pointer[-1] if len(pointer) > 1 else 1
+    # 位置の単位がバイトの場合
+    if isinstance(pointer, Quantity):
+        if pointer.unit.upper() == "BYTES":
+            return int(pointer.value) - 1
+        pointer = pointer.value
+    # 位置の単位がレコードの場合
+    if isinstance(pointer, int):
+        return (pointer - 1) * int(find_number(label, "RECORD_BYTES", 0))
+    return 0
@@ -0,0 +1,213 @@
+# Render.py
+
+"""
+ブラウザや GPU を使わずに、探査機の視点から見た地形の透視図を PNG 画像として出力するモジュールです。
+This module renders perspective PNG views from the rover eye position with NumPy column ray-casting, without a browser or GPU.
+"""
+
+import os
+import zlib
+import struct
+import argparse
+import numpy as np
+
+import Extent as extent
+
+# 画像の大きさの初期値 <pixel>
+DEFAULT_WIDTH = 640
+DEFAULT_HEIGHT = 360
+# 水平方向の視野角の初期値 <deg>
+DEFAULT_FOV = 60.0
+# 最も近い奥行き <m>
+NEAR_DISTANCE = 0.5
+
+
+# 探査機の視点から見た透視図を作成する
+def render_view(haversine_data, surface, dx, dy, viewpoint, heading=0.0, fov=DEFAULT_FOV,
+                width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, pitch=0.0, steps=None):
+    """
+    Args:
+    haversine_data: 曲率補正された標高データ
+    surface: 表現方式（陰影起伏 or オルソ画像）、haversine_data と同じ形状
+    dx, dy: 列方向（東西）と行方向（南北）のピクセル間隔 <m>
+    viewpoint: 視点の高さ <m>（Input.validate_input_plot_range の値）
+    heading: 視線の方位（北0度、東90度、南180度、西270度）
+    fov: 水平方向の視野角 <deg>
+    width, height: 画像の大きさ <pixel>
+    pitch: 視線の仰角 <deg>（上向きが正）
+    steps: 奥行き方向の標本数（None の場合は画像の高さの2倍）
+    
+    Return:
+    image: 透視図（uint8 の濃淡画像、地形のない部分は黒）
+    
+    視点は Plot.plot_3d と同じく抽出範囲の中央（ターゲット）の標高 + viewpoint とする。
+    画像の列ごとに奥行き方向へ標本を取り、手前から順に見える部分だけを塗る（column ray-casting）。
+    """
+    
+    lines, samples = haversine_data.shape
+    steps = steps or 2 * height
+    
+    # 視点（Plot.plot_3d と同じく抽出範囲の中央）
+    center_row, center_col = int(lines / 2), int(samples / 2)
+    eye_elevation = float(haversine_data[center_row, center_col]) + viewpoint
+    
+    # 奥行きは手前ほど細かく、等比的に取る（最も遠いのは抽出範囲の対角）
+    far_distance = np.hypot(lines * dy, samples * dx) / 2
+    depth = NEAR_DISTANCE * (far_distance / NEAR_DISTANCE) ** (np.arange(1, steps + 1) / steps)
+    
+    # 各列の視線の向き（東, 北）: 正面の向き + tan(列の角度) × 右の向き
+    focal = width / 2 / np.tan(np.radians(fov) / 2)
+    offsets = (np.arange(width) + 0.5 - width / 2) / focal
+    heading = np.radians(heading)
+    forward = np.array([np.sin(heading), np.cos(heading)])
+    right = np.array([np.cos(heading), -np.sin(heading)])
+    east = forward[0] + offsets * right[0]
+    north = forward[1] + offsets * right[1]
+    
+    # 奥行き × 列 の標本位置（ピクセル番号）
+    cols = np.rint(center_col + depth[:, np.newaxis] * east / dx).astype(np.intp)
+    rows = np.rint(center_row - depth[:, np.newaxis] * north / dy).astype(np.intp)
+    inside = (rows >= 0) & (rows < lines) & (cols >= 0) & (cols < samples)
+    np.clip(rows, 0, lines - 1, out=rows)
+    np.clip(cols, 0, samples - 1, out=cols)
+    
+    # 画面上の行（上が 0）: 地平線の行 - 高さの差 / 奥行き × 焦点距離
+    horizon_row = height / 2 + np.tan(np.radians(pitch)) * focal
+    screen = horizon_row - (haversine_data[rows, cols] - eye_elevation) / depth[:, np.newaxis] * focal
+    # 範囲外の標本は画面の下端とし、何も塗らない
+    screen[~inside] = height
+    
+    # 手前から順に、それまでに塗った最も上の行より上に出た部分だけが見える
+    # 行 r を塗るのは、最も上の行が r 以下になった最初の標本
+    top = np.clip(np.minimum.accumulate(screen, axis=0), -1, height)
+    # 列ごとに昇順となるように並べ、全ての列をまとめて探索する
+    span = height + 2.0
+    keys = (-top + np.arange(width) * span).T.ravel()
+    queries = -np.arange(height)[:, np.newaxis] + np.arange(width) * span
+    first = np.searchsorted(keys, queries.T.ravel(), side="left").reshape(width, height).T
+    first -= np.arange(width) * steps
+    visible = first < steps
+    first = np.minimum(first, steps - 1)
+    
+    # 濃淡を 0 から 255 に正規化する（Plot.plot_3d の colorscale と同じく最小値から最大値）
+    shade = surface[rows, cols].astype(np.float32)
+    shade_min, shade_max = float(np.nanmin(surface)), float(np.nanmax(surface))
+    shade = (shade - shade_min) / (shade_max - shade_min) if shade_max > shade_min else np.zeros_like(shade)
+    column_index = np.broadcast_to(np.arange(width), (height, width))
+    image = np.zeros((height, width), dtype=np.uint8)
+    image[visible] = np.clip(shade[first[visible], column_index[visible]] * 255 + 0.5, 0, 255).astype(np.uint8)
+    return image
+
+
+# 濃淡画像を PNG として保存する（標準ライブラリのみ）
+def write_png(png_path, image, level=6):
+    """
+    Args:
+    png_path: 保存先のパス
+    image: uint8 の濃淡画像
+    level: 圧縮レベル（0 から 9）
+    
+    Return:
+    png_path: 保存先のパス
+    """
+    
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape
+    
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    
+    # 各行の先頭にフィルタの種類（0: なし）を付ける
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), image]).tobytes()
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    with open(png_path, 'wb') as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", header))
+        file.write(chunk(b"IDAT", zlib.compress(raw, level)))
+        file.write(chunk(b"IEND", b""))
+    return png_path
+
+
+# 透視図を保存する
+def save_view(image, target_latitude, target_longitude, sun_azimuth, sun_altdeg, plot_range, heading):
+    """
+    Args:
+    image: render_view で作成した透視図
+    target_latitude: ターゲットの緯度
+    target_longitude: ターゲットの経度
+    sun_azimuth: 太陽（光源）の方位
+    sun_altdeg: 太陽（光源の仰角）
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    heading: 視線の方位
+    
+    Return:
+    save_filename: 保存したファイルのパス
+    """
+    
+    # 保存先の設定
+    save_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "result")
+    
+    # 緯度経度のシンボル設定
+    lat_symbol = "S" if target_latitude < 0 else "N"
+    lon_symbol = "E"
+    
+    # 各引数の表記整理
+    # 小数点以下５桁に丸め、整数に直す
+    target_latitude = int(abs(round(target_latitude, 5) * pow(10, 5)))
+    target_longitude = int(abs(round(target_longitude, 5) * pow(10, 5)))
+    sun_azimuth = int(round(sun_azimuth, 5) * pow(10, 5))
+    sun_altdeg = int(round(sun_altdeg, 5) * pow(10, 5))
+    heading = int(round(heading % 360, 5) * pow(10, 5))
+    
+    # プロット範囲のシンボル設定
+    plot_symbol = extent.symbol(plot_range)
+    
+    # 保存ファイル名の設定
+    save_name = "HVTS_VIEW_KGY_" + plot_symbol + f"{lat_symbol}{target_latitude:07}{lon_symbol}{target_longitude:08}_azim{sun_azimuth:08}alt{sun_altdeg:07}_head{heading:08}.png"
+    return write_png(os.path.join(save_directory, save_name), image)
+
+
+if __name__ == "__main__":
+
+    import time
+    import Area as area
+    import Effect as ef
+    import Input as input
+    import Mosaic as mosaic
+    
+    # KAGUYA のタイルについて、地点と視線の方位を指定して透視図を保存する
+    parser = argparse.ArgumentParser(description="探査機視点の透視図の作成")
+    parser.add_argument("latitude", type=float, help="ターゲットの緯度")
+    parser.add_argument("longitude", type=float, help="ターゲットの経度")
+    parser.add_argument("sun_azimuth", type=float, help="太陽の方位")
+    parser.add_argument("sun_altdeg", type=float, help="太陽の仰角")
+    parser.add_argument("plot_range", type=extent.parse,
+                        help="プロット管理番号 [0, 1, 2, 3] 又は 東西x南北の大きさ <m>（例: 2000x1000）")
+    parser.add_argument("--headings", type=float, nargs="+", default=[0, 90, 180, 270], help="視線の方位")
+    parser.add_argument("--viewpoint", type=float, help="視点の高さ <m>（省略時は描画範囲に応じた値）")
+    parser.add_argument("--fov", type=float, default=DEFAULT_FOV, help="水平方向の視野角 <deg>")
+    parser.add_argument("--size", type=int, nargs=2, default=[DEFAULT_WIDTH, DEFAULT_HEIGHT], metavar=("WIDTH", "HEIGHT"),
+                        help="画像の大きさ")
+    parser.add_argument("--shadow", action="store_true", help="地形が落とす影を合成する")
+    args = parser.parse_args()
+    viewpoint = args.viewpoint if args.viewpoint is not None else input.default_viewpoint(args.plot_range)
+    
+    (elevation_data, window_samples, window_lines, window_latitude,
+     window_longitude, window_resolution) = mosaic.get_elevation_mosaic(args.latitude, args.longitude, args.plot_range)
+    selected_data, selected_x, selected_y, haversine_data = area.select_area(elevation_data, args.latitude, args.longitude,
+                                                            window_samples, window_lines, window_latitude,
+                                                            window_longitude, window_resolution, args.plot_range)
+    hillshade = ef.calculate_hillshade(haversine_data, args.sun_azimuth, args.sun_altdeg)
+    dx, dy = area.pixel_size(window_resolution, args.latitude)
+    if args.shadow:
+        hillshade = ef.apply_shadow(hillshade, ef.calculate_shadow(haversine_data, args.sun_azimuth, args.sun_altdeg,
+                                                                    dx, dy))
+    
+    print("透視図の作成中...")
+    start = time.perf_counter()
+    for heading in args.headings:
+        image = render_view(haversine_data, hillshade, dx, dy, viewpoint, heading, args.fov, *args.size)
+        print(save_view(image, args.latitude, args.longitude, args.sun_azimuth, args.sun_altdeg, args.plot_range,
+                        heading))
+    elapsed = time.perf_counter() - start
+    print(f"{len(args.headings)} 枚, {elapsed:.2f} s ({len(args.headings) / elapsed * 60:.0f} 枚/分)")
@@ -6,10 +6,150 @@ This module saves and expands 3D plot data.
 """
 
 import os
+import base64
 import webbrowser
+import numpy as np
+import Lazy as lazy
+import Extent as extent
+
+# plotly は初めて使う時点で読み込む
+pio = lazy.lazy_import("plotly.io")
+offline = lazy.lazy_import("plotly.offline")
+
+# 軽量な形式で保存する（配列を float 32 の base64 で埋め込み、plotly.js は result 内の1つのファイルを共有する）
+COMPACT_OUTPUT = True
+# 軽量な形式で float 32 に変換する配列
+ARRAY_KEYS = ("x", "y", "z", "surfacecolor")
+# アニメーションの HTML でフレームを書き込む位置の目印
+FRAMES_PLACEHOLDER = "__HVTS_FRAMES__"
+
+
+# 配列を plotly.js の型付き配列（base64）に変換する
+def encode_array(array, dtype=np.float32):
+    """
+    Args:
+    array: 配列
+    dtype: 変換後のデータ型
+    
+    Return:
+    encoded: {"dtype", "bdata", "shape"} の辞書
+    """
+    
+    array = np.ascontiguousarray(array, dtype=dtype)
+    encoded = {"dtype": array.dtype.str.lstrip("<>|="), "bdata": base64.b64encode(array.tobytes()).decode("ascii")}
+    if array.ndim > 1:
+        encoded["shape"] = ", ".join(str(size) for size in array.shape)
+    return encoded
+
+
+# プロットの値を配列に戻す（plotly のバージョンによっては既に型付き配列になっている）
+def decode_array(value):
+    if isinstance(value, dict) and "bdata" in value:
+        array = np.frombuffer(base64.b64decode(value["bdata"]), dtype=value["dtype"])
+        if "shape" in value:
+            array = array.reshape([int(size) for size in str(value["shape"]).split(",")])
+        return array
+    if isinstance(value, (list, tuple)):
+        value = np.asarray(value)
+    return value if isinstance(value, np.ndarray) else None
+
+
+# 3Dプロットを軽量な形式に変換する
+def compact_figure(fig):
+    """
+    Arg:
+    fig: 3Dプロット
+    
+    Return:
+    figure: 配列を型付き配列に変換したプロットの辞書
+    
+    Surface の経度と緯度が2次元の格子の場合は、1次元の軸に直す。
+    """
+    
+    figure = fig.to_plotly_json()
+    for trace in figure["data"]:
+        arrays = {key: decode_array(trace.get(key)) for key in ARRAY_KEYS}
+        if trace.get("type") == "surface":
+            x, y = arrays["x"], arrays["y"]
+            if x is not None and x.ndim == 2 and np.all(x == x[:1]):
+                arrays["x"] = x[0]
+            if y is not None and y.ndim == 2 and np.all(y == y[:, :1]):
+                arrays["y"] = y[:, 0]
+        for key, array in arrays.items():
+            # マーカーなどの要素が少ないものはそのまま
+            if array is not None and array.size > 1 and array.dtype.kind in "fiu":
+                trace[key] = encode_array(array)
+    return figure
+
+
+# 3Dプロットを保存する
+def write_figure(fig, save_filename, compact=COMPACT_OUTPUT):
+    """
+    Args:
+    fig: 3Dプロット
+    save_filename: 保存先のファイル名
+    compact: 軽量な形式で保存するか
+    
+    Return:
+    None
+    """
+    
+    if compact:
+        # plotly.js は保存先に plotly.min.js がない場合のみ書き出される
+        pio.write_html(compact_figure(fig), save_filename, include_plotlyjs="directory", validate=False)
+    else:
+        fig.write_html(save_filename)
+
+
+# 3Dアニメーションを保存する（フレームは1つずつ取り出して変換する）
+def write_animation(fig, frames, save_filename, compact=COMPACT_OUTPUT):
+    """
+    Args:
+    fig: 最初のフレームの3Dプロット
+    frames: フレームの辞書のイテラブル（Plot.plot_animation の戻り値）
+    save_filename: 保存先のファイル名
+    compact: 軽量な形式で保存するか
+    
+    Return:
+    None
+    
+    軽量な形式では、各フレームの surfacecolor を uint8 の型付き配列として埋め込む。
+    フレームは取り出すたびに HTML へ書き込むため、フレーム数に関わらずメモリ上には1フレーム分しか保持しない。
+    """
+    
+    if compact:
+        figure = compact_figure(fig)
+        # 最初のフレームの表面の色も uint8 のまま埋め込む
+        for trace in figure["data"]:
+            if trace.get("type") == "surface":
+                trace["surfacecolor"] = encode_array(decode_array(trace["surfacecolor"]), np.uint8)
+    else:
+        figure = fig.to_plotly_json()
+    
+    # フレームの位置に目印を置いた HTML を作り、目印の前後の間にフレームを1つずつ書き込む
+    figure["frames"] = [{"name": FRAMES_PLACEHOLDER}]
+    html = pio.to_html(figure, include_plotlyjs="directory" if compact else True, validate=False, auto_play=False)
+    head, tail = html.split(pio.json.to_json_plotly(figure["frames"]))
+    
+    with open(save_filename, 'w', encoding='utf-8') as file:
+        file.write(head + "[")
+        for index, frame in enumerate(frames):
+            if compact:
+                for trace in frame["data"]:
+                    trace["surfacecolor"] = encode_array(trace["surfacecolor"], np.uint8)
+            file.write(("," if index else "") + pio.json.to_json_plotly(frame))
+        file.write("]" + tail)
+    
+    # plotly.js は保存先に plotly.min.js がない場合のみ書き出す（write_figure と同じ）
+    if compact:
+        bundle_path = os.path.join(os.path.dirname(os.path.abspath(save_filename)), "plotly.min.js")
+        if not os.path.exists(bundle_path):
+            with open(bundle_path, 'w', encoding='utf-8') as file:
+                file.write(offline.get_plotlyjs())
 
 def save_expand(fig, target_latitude, target_longitude, 
-                sun_azimuth, sun_altdeg, smoothing_active, ortho_active, plot_range):
+                sun_azimuth, sun_altdeg, smoothing_active, ortho_active, plot_range, open_browser=True,
+                shadow_active=False, compact=COMPACT_OUTPUT):
     """
     Args:
     fig: 3Dプロット
@@ -19,10 +159,13 @@ def save_expand(fig, target_latitude, target_longitude,
     sun_altdeg: 太陽（光源の仰角）
     smoothing_active: スムージング機能の有効化
     ortho_active: オルソ画像の使用
-    plot_range: プロット管理番号
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    open_browser: 保存後にブラウザで展開するか
+    shadow_active: 影（投影）の合成
+    compact: 軽量な形式で保存するか（result 内の plotly.min.js を参照する）
     
     Return:
-    None
+    save_filename: 保存したファイルのパス
     """
     
     print("プロットの保存中...")
@@ -42,12 +185,13 @@ def save_expand(fig, target_latitude, target_longitude,
     sun_altdeg = int(round(sun_altdeg, 5) * pow(10, 5))
     
     # ファイル名の設定
+    # 影を合成した陰影起伏は "h" の代わりに "c" (cast shadow)
     
     # スムージングが無効の場合
     if smoothing_active == False:
         if ortho_active == False:
             # スムージングなし、陰影起伏
-            sava_option = "HVTS_SIM_h_KGY_"
+            sava_option = "HVTS_SIM_c_KGY_" if shadow_active else "HVTS_SIM_h_KGY_"
         else:
             # スムージングなし、オルソ画像
             sava_option = "HVTS_SIM_o_KGY_"
@@ -55,33 +199,29 @@ def save_expand(fig, target_latitude, target_longitude,
     else:
         if ortho_active == False:
             # スムージングあり、陰影起伏
-            sava_option = "HVTS_SIMs_h_KGY_"
+            sava_option = "HVTS_SIMs_c_KGY_" if shadow_active else "HVTS_SIMs_h_KGY_"
         else:
             # スムージングあり、オルソ画像
             sava_option = "HVTS_SIMs_o_KGY_"
     
     # プロット範囲のシンボル設定
-    if plot_range == 0:
-        plot_symbol = "60_"
-    elif plot_range == 1:
-        plot_symbol = "30_"
-    elif plot_range == 2:
-        plot_symbol = "06_"
-    else:
-        plot_symbol = "03_"
+    plot_symbol = extent.symbol(plot_range)
     
     # 保存ファイル名の設定
     save_name = sava_option + plot_symbol + f"{lat_symbol}{target_latitude:07}{lon_symbol}{target_longitude:08}_azim{sun_azimuth:08}alt{sun_altdeg:07}.html"
     save_filename = os.path.join(save_directory, save_name)
     
     # 3Dプロットの保存
-    fig.write_html(save_filename)
+    write_figure(fig, save_filename, compact)
     # プロット表示
-    webbrowser.open('file:///' + save_filename, new=2)
+    if open_browser:
+        webbrowser.open('file:///' + save_filename, new=2)
+    return save_filename
     
 
 def save_expand_LRO(fig, target_latitude, target_longitude, 
-                sun_azimuth, sun_altdeg, smoothing_active, plot_range):
+                sun_azimuth, sun_altdeg, smoothing_active, plot_range, open_browser=True,
+                shadow_active=False, compact=COMPACT_OUTPUT):
     """
     Args:
     fig: 3Dプロット
@@ -90,10 +230,13 @@ def save_expand_LRO(fig, target_latitude, target_longitude,
     sun_azimuth: 太陽（光源）の方位
     sun_altdeg: 太陽（光源の仰角）
     smoothing_active: スムージング機能の有効化
-    plot_range: プロット管理番号
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    open_browser: 保存後にブラウザで展開するか
+    shadow_active: 影（投影）の合成
+    compact: 軽量な形式で保存するか（result 内の plotly.min.js を参照する）
     
     Return:
-    None
+    save_filename: 保存したファイルのパス
     """
     
     print("プロットの保存中...")
@@ -117,22 +260,76 @@ def save_expand_LRO(fig, target_latitude, target_longitude,
         sava_option = "HVTS_SIMs_LRO_"
     else:
         sava_option = "HVTS_SIM_LRO_"
+    # 影を合成した場合
+    if shadow_active == True:
+        sava_option = sava_option + "c_"
         
     # プロット範囲のシンボル設定
-    if plot_range == 0:
-        plot_symbol = "60_"
-    elif plot_range == 1:
-        plot_symbol = "30_"
-    elif plot_range == 2:
-        plot_symbol = "06_"
-    else:
-        plot_symbol = "03_"
+    plot_symbol = extent.symbol(plot_range)
     
     # 保存ファイル名の設定
     save_name = sava_option + plot_symbol + f"{lat_symbol}{target_latitude:07}{lon_symbol}{target_longitude:08}_azim{sun_azimuth:08}alt{sun_altdeg:07}.html"
     save_filename = os.path.join(save_directory, save_name)
     
     # 3Dプロットの保存
-    fig.write_html(save_filename)
+    write_figure(fig, save_filename, compact)
+    # プロット表示
+    if open_browser:
+        webbrowser.open('file:///' + save_filename, new=2)
+    return save_filename
+
+
+# 3Dアニメーションを保存して展開する
+def save_animation(fig, frames, target_latitude, target_longitude, sun_positions,
+                   smoothing_active, plot_range, open_browser=True, shadow_active=False, compact=COMPACT_OUTPUT):
+    """
+    Args:
+    fig: 最初のフレームの3Dプロット
+    frames: フレームの辞書のイテラブル（Plot.plot_animation の戻り値）
+    target_latitude: ターゲットの緯度
+    target_longitude: ターゲットの経度
+    sun_positions: 太陽の (方位, 仰角) のリスト
+    smoothing_active: スムージング機能の有効化
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    open_browser: 保存後にブラウザで展開するか
+    shadow_active: 影（投影）の合成
+    compact: 軽量な形式で保存するか（result 内の plotly.min.js を参照する）
+    
+    Return:
+    save_filename: 保存したファイルのパス
+    """
+    
+    print("アニメーションの保存中...")
+    
+    # 保存先の設定
+    save_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "result")
+    
+    # 緯度経度のシンボル設定
+    lat_symbol = "S" if target_latitude < 0 else "N"
+    lon_symbol = "E"
+    
+    # 各引数の表記整理
+    # 小数点以下５桁に丸め、整数に直す
+    target_latitude = int(abs(round(target_latitude, 5) * pow(10, 5)))
+    target_longitude = int(abs(round(target_longitude, 5) * pow(10, 5)))
+    sun_azimuth = int(round(sun_positions[0][0], 5) * pow(10, 5))
+    sun_altdeg = int(round(sun_positions[0][1], 5) * pow(10, 5))
+    
+    # ファイル名の設定
+    # 影を合成した陰影起伏は "h" の代わりに "c" (cast shadow)
+    sava_option = "HVTS_ANIMs_" if smoothing_active == True else "HVTS_ANIM_"
+    sava_option = sava_option + ("c_KGY_" if shadow_active else "h_KGY_")
+    
+    # プロット範囲のシンボル設定
+    plot_symbol = extent.symbol(plot_range)
+    
+    # 保存ファイル名の設定（最初の太陽の位置とフレーム数）
+    save_name = sava_option + plot_symbol + f"{lat_symbol}{target_latitude:07}{lon_symbol}{target_longitude:08}_azim{sun_azimuth:08}alt{sun_altdeg:07}_frames{len(sun_positions):03}.html"
+    save_filename = os.path.join(save_directory, save_name)
+    
+    # 3Dアニメーションの保存
+    write_animation(fig, frames, save_filename, compact)
     # プロット表示
-    webbrowser.open('file:///' + save_filename, new=2)
\ No newline at end of file
+    if open_browser:
+        webbrowser.open('file:///' + save_filename, new=2)
+    return save_filename
\ No newline at end of file
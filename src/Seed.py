@@ -0,0 +1,280 @@
+# Seed.py
+
+"""
+指定された範囲（緯度経度の矩形又は多角形）に含まれるタイルを事前にまとめてダウンロードするモジュールです。
+This module pre-seeds every tile in a bounding box or polygon, downloading the missing ones in parallel.
+"""
+
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import Tile as tile
+import Download as dl
+import Area as area
+
+# 同時にダウンロードするタイル数の初期値
+DEFAULT_WORKERS = 4
+
+
+# "緯度:経度, 緯度:経度, ..." の形式で入力された多角形を読み取る
+def parse_polygon(text):
+    """
+    Arg:
+    text: 多角形の頂点（3点以上）
+    
+    Return:
+    polygon: (緯度, 経度) のリスト
+    """
+    
+    polygon = []
+    for vertex in text.split(","):
+        latitude, longitude = vertex.split(":")
+        polygon.append((float(latitude), float(longitude)))
+    if len(polygon) < 3:
+        raise ValueError("多角形には3点以上の頂点が必要です")
+    return polygon
+
+
+# 点が多角形の内側にあるか判定する
+def point_in_polygon(latitude, longitude, polygon):
+    inside = False
+    for (lat1, lon1), (lat2, lon2) in zip(polygon, polygon[1:] + polygon[:1]):
+        if (lat1 > latitude) != (lat2 > latitude):
+            crossing = lon1 + (latitude - lat1) * (lon2 - lon1) / (lat2 - lat1)
+            if longitude < crossing:
+                inside = not inside
+    return inside
+
+
+# 2つの線分が交差するか判定する
+def segments_intersect(p1, p2, q1, q2):
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+    d1, d2 = cross(q1, q2, p1), cross(q1, q2, p2)
+    d3, d4 = cross(p1, p2, q1), cross(p1, p2, q2)
+    return d1 * d2 <= 0 and d3 * d4 <= 0
+
+
+# タイル（南端, 西端から3度四方）が多角形と重なるか判定する
+def tile_in_polygon(south, west, polygon):
+    """
+    Args:
+    south, west: タイル南端の緯度と西端の経度
+    polygon: (緯度, 経度) のリスト
+    
+    Return:
+    overlap: 重なる場合は True
+    """
+    
+    north, east = south + tile.DEGREE_INTERVAL, west + tile.DEGREE_INTERVAL
+    corners = [(south, west), (south, east), (north, east), (north, west)]
+    
+    # タイルの角が多角形の内側にある
+    if any(point_in_polygon(latitude, longitude, polygon) for latitude, longitude in corners):
+        return True
+    # 多角形の頂点がタイルの内側にある
+    if any(south <= latitude <= north and west <= longitude <= east for latitude, longitude in polygon):
+        return True
+    # 辺どうしが交差する
+    for p1, p2 in zip(polygon, polygon[1:] + polygon[:1]):
+        for q1, q2 in zip(corners, corners[1:] + corners[:1]):
+            if segments_intersect(p1, p2, q1, q2):
+                return True
+    return False
+
+
+# 西端から東端までの経度の範囲を 0 以上 360 未満の区間に分ける（0度/360度をまたぐ場合は2つに分ける）
+def longitude_intervals(west, east):
+    """
+    Args:
+    west: 西端の経度（負の値、360 以上でもよい）
+    east: 東端の経度（西端より小さい場合は 0度/360度をまたぐ範囲とする）
+    
+    Return:
+    intervals: (西端, 東端) のリスト
+    """
+    
+    # 全周を含む場合
+    if east - west >= tile.MAX_LONGITUDE:
+        return [(0, tile.MAX_LONGITUDE)]
+    # Tile.generate_names_area と同じく 360 で割った余りに揃える
+    west, east = west % tile.MAX_LONGITUDE, east % tile.MAX_LONGITUDE
+    if west <= east:
+        return [(west, east)]
+    return [(west, tile.MAX_LONGITUDE), (0, east)]
+
+
+# 多角形の経度を、隣り合う頂点の差が180度以内になるように連続させる（0度/360度をまたぐ多角形に対応する）
+def unwrap_polygon(polygon):
+    """
+    Arg:
+    polygon: (緯度, 経度) のリスト
+    
+    Return:
+    polygon: 経度を連続させた (緯度, 経度) のリスト（最初の頂点の経度は 0 以上 360 未満）
+    """
+    
+    unwrapped = []
+    for latitude, longitude in polygon:
+        if not unwrapped:
+            longitude = longitude % tile.MAX_LONGITUDE
+        else:
+            previous = unwrapped[-1][1]
+            longitude = previous + (longitude - previous + tile.MAX_LONGITUDE / 2) % tile.MAX_LONGITUDE \
+                - tile.MAX_LONGITUDE / 2
+        unwrapped.append((latitude, longitude))
+    return unwrapped
+
+
+# 範囲に含まれるタイルの一覧を作る
+def list_tiles(bbox=None, polygon=None):
+    """
+    Args:
+    bbox: (南端, 北端, 西端, 東端) の緯度経度（西端が東端より大きい場合は 0度/360度をまたぐ範囲）
+    polygon: (緯度, 経度) のリスト（指定した場合は bbox より優先）
+    
+    Return:
+    tiles: (prefix, tile_name, タイル南端の緯度, タイル西端の経度) のリスト（西端の経度は 0 以上 360 未満）
+    """
+    
+    if polygon is not None:
+        # 経度を連続させると、0度/360度をまたいでも1つの範囲として扱える（Tile.generate_names_area は 360 を超えてもよい）
+        polygon = unwrap_polygon(polygon)
+        latitudes = [latitude for latitude, _ in polygon]
+        longitudes = [longitude for _, longitude in polygon]
+        tiles = tile.generate_names_area(min(latitudes), max(latitudes), min(longitudes), max(longitudes))
+        tiles = [t for t in tiles if tile_in_polygon(t[2], t[3], polygon)]
+    else:
+        south, north, west, east = bbox
+        tiles = []
+        for interval_west, interval_east in longitude_intervals(west, east):
+            tiles.extend(tile.generate_names_area(south, north, interval_west, interval_east))
+    
+    # 区間の境界で重なるタイルは1つにまとめ、西端の経度を 0 以上 360 未満に揃える
+    unique = {}
+    for prefix, tile_name, south, west in tiles:
+        unique.setdefault(tile_name, (prefix, tile_name, south, west % tile.MAX_LONGITUDE))
+    return list(unique.values())
+
+
+# 1つのファイル組（標高データ又はオルソ）をダウンロードする
+def seed_file(base_url, prefix, stem):
+    """
+    Args:
+    base_url: ダウンロード元
+    prefix: 経度の分類
+    stem: 拡張子を除いたファイル名
+    
+    Returns:
+    stem: 拡張子を除いたファイル名
+    nbytes: 保存したバイト数
+    error: 失敗した場合のエラー（成功した場合は None）
+    """
+    
+    # サーバーやバッチモードと同時に実行しても同じファイルを書き込まないように、ファイル組ごとの排他制御を通す
+    try:
+        img_filename, lbl_filename = dl.download_pair(base_url, prefix, stem)
+        return stem, os.path.getsize(img_filename) + os.path.getsize(lbl_filename), None
+    except dl.DownloadError as e:
+        return stem, 0, e
+
+
+# 範囲に含まれるタイルをまとめてダウンロードする
+def seed(tiles, ortho=True, workers=DEFAULT_WORKERS):
+    """
+    Args:
+    tiles: list_tiles で作ったタイルの一覧
+    ortho: オルソもダウンロードするか
+    workers: 同時にダウンロードするファイル組の数
+    
+    Return:
+    failed: ダウンロードに失敗したファイル名のリスト
+    """
+    
+    # ダウンロードが必要なファイル組を選ぶ（正しく保存済みのものは飛ばす）
+    sources = [(dl.DTM_BASE_URL, "DTM_MAPs02_{}SC")]
+    if ortho:
+        sources.append((dl.ORTHO_BASE_URL, "TCO_MAPs02_{}SC"))
+    pending = []
+    for prefix, tile_name, _, _ in tiles:
+        for base_url, pattern in sources:
+            stem = pattern.format(tile_name)
+            if not dl.is_complete(*dl.tile_paths(stem)):
+                pending.append((base_url, prefix, stem))
+    
+    total = len(tiles) * len(sources)
+    print(f"タイル数: {len(tiles)}, ファイル組: {total}, 保存済み: {total - len(pending)}, ダウンロード: {len(pending)}")
+    if not pending:
+        return []
+    
+    # 並列にダウンロードし、完了するごとに進み具合と速度を表示する
+    failed = []
+    received = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(seed_file, *job) for job in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            stem, nbytes, error = future.result()
+            received += nbytes
+            elapsed = time.perf_counter() - start
+            rate = received / elapsed / 1024 / 1024 if elapsed > 0 else 0.0
+            if error is None:
+                print(f"[{done}/{len(pending)}] {stem} {nbytes / 1024 / 1024:.1f} MB ({rate:.1f} MB/s)")
+            else:
+                failed.append(stem)
+                print(f"[{done}/{len(pending)}] {stem} Error: {error}")
+    
+    elapsed = time.perf_counter() - start
+    print(f"ダウンロード完了: {received / 1024 / 1024:.1f} MB, {elapsed:.1f} s, "
+          f"{received / max(elapsed, 1e-9) / 1024 / 1024:.1f} MB/s, 失敗: {len(failed)}")
+    return failed
+
+
+# ダウンロード済みの標高タイルについて概観データを事前に作成する（描画時には作成されない）
+def seed_pyramids(tiles):
+    """
+    Arg:
+    tiles: list_tiles で作ったタイルの一覧
+    
+    Return:
+    failed: 作成できなかったファイル名のリスト
+    """
+    
+    failed = []
+    for prefix, tile_name, _, _ in tiles:
+        img_filename, lbl_filename = dl.tile_paths(f"DTM_MAPs02_{tile_name}SC")
+        if not dl.is_complete(img_filename, lbl_filename):
+            failed.append(img_filename)
+            print(f"{img_filename} Error: ダウンロードされていません")
+            continue
+        index = area.precompute_pyramid(img_filename, lbl_filename)
+        print(f"{img_filename} 概観データ: {[level['factor'] for level in index['levels']]}")
+    return failed
+
+
+if __name__ == "__main__":
+
+    # 範囲を指定してタイルを事前にダウンロードする
+    parser = argparse.ArgumentParser(description="タイルの事前ダウンロード")
+    area_group = parser.add_mutually_exclusive_group(required=True)
+    area_group.add_argument("--bbox", type=float, nargs=4, metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"),
+                            help="範囲の南端と北端の緯度、西端と東端の経度")
+    area_group.add_argument("--polygon", type=parse_polygon, metavar="LAT:LON,LAT:LON,...",
+                            help="範囲を表す多角形の頂点")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="同時にダウンロードする数")
+    parser.add_argument("--no-ortho", action="store_true", help="オルソをダウンロードしない")
+    parser.add_argument("--list", action="store_true", help="タイルの一覧を表示するだけでダウンロードしない")
+    parser.add_argument("--pyramid", action="store_true", help="ダウンロード後に標高タイルの概観データを作成する")
+    args = parser.parse_args()
+    
+    tiles = list_tiles(args.bbox, args.polygon)
+    if args.list:
+        for prefix, tile_name, _, _ in tiles:
+            print(f"{prefix}/{tile_name}")
+    else:
+        failed = seed(tiles, ortho=not args.no_ortho, workers=args.workers)
+        if args.pyramid:
+            failed += seed_pyramids(tiles)
+        if failed:
+            raise SystemExit(1)
@@ -0,0 +1,317 @@
+# Server.py
+
+"""
+モジュールと標高タイルを読み込んだまま常駐し、HTTP/JSON でシミュレーションを受け付けるモジュールです。
+リクエストは上限つきのワーカー（スレッド）で並列に実行され、2回目以降は開いたタイル、ラベル、概観データを使い回します。
+This module runs a long-lived local server (HTTP/JSON on localhost or a Unix socket) that keeps modules,
+memory-mapped tiles, parsed labels and overview levels open, and runs simulation requests on a bounded worker pool.
+"""
+
+import os
+import json
+import stat
+import time
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+import Lazy as lazy
+import Input as input
+import Batch as batch
+import Simulation as sim
+import Effect as ef
+import Plot as pl
+import Save as sv
+
+# 待ち受けるアドレス（他の端末から接続できないように localhost のみとする）
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# シミュレーションを同時に実行する数
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+# 実行待ちを含めて受け付けるリクエストの上限（超えた場合は 503 を返す）
+MAX_PENDING = 16
+# リクエスト本文の上限 <byte>
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class SimulationService:
+    """
+    上限つきのワーカーでシミュレーションを実行します。
+    タイルなどは各モジュールのキャッシュ（Mosaic, Cache, Read_lbl, Pyramid）に残るため、リクエストをまたいで使い回されます。
+    """
+    
+    def __init__(self, workers=MAX_WORKERS, max_pending=MAX_PENDING):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="simulation")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.number = 0
+        self.started = time.time()
+    
+    def preload(self):
+        """
+        遅延読み込みしているライブラリを起動時に読み込み、最初のリクエストを待たせないようにする。
+        """
+    
+        print("ライブラリの読み込み中...")
+        for module in (ef.ndimage, pl.go, pl.subplots, sv.pio):
+            lazy.resolve(module)
+    
+    def status(self):
+        """
+        Return:
+        status: 実行中、完了、失敗の件数などの辞書
+        """
+    
+        with self.lock:
+            return {"status": "ok", "workers": self.workers, "running": self.running,
+                    "completed": self.completed, "failed": self.failed,
+                    "uptime": round(time.time() - self.started, 3)}
+    
+    def submit(self, record):
+        """
+        Arg:
+        record: シミュレーション条件（バッチモードのマニフェストの1行と同じ項目、及び sun_sweep, animation, return）
+    
+        Return:
+        future: 結果の辞書を返す Future（受け付けられない場合は None）
+        """
+    
+        if not self.slots.acquire(blocking=False):
+            return None
+        with self.lock:
+            self.number += 1
+            number = self.number
+        try:
+            job = parse_request(record, number)
+        except (KeyError, TypeError, ValueError):
+            self.slots.release()
+            raise
+        future = self.executor.submit(self.run, job)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+    
+    def run(self, job):
+        """
+        Arg:
+        job: parse_request で作成したシミュレーション条件
+    
+        Return:
+        result: 結果の辞書（出力先のパス、又は配列）
+        """
+    
+        with self.lock:
+            self.running += 1
+        start = time.perf_counter()
+        result = {"id": job["id"]}
+        try:
+            output = sim.simulate(job["latitude"], job["longitude"], job["sun_azimuth"], job["sun_altdeg"],
+                                  job["smoothing"], job["plot_range"], job["viewpoint"], job["ortho"],
+                                  open_browser=False, sun_sweep=job["sun_sweep"], shadow_active=job["shadow"],
+                                  return_arrays=job["return"] == "arrays", animation_active=job["animation"])
+            if job["return"] == "arrays":
+                result["arrays"] = [encode_arrays(arrays) for arrays in (output if isinstance(output, list) else [output])]
+            else:
+                result["output"] = output
+            result["status"] = "ok"
+        # ダウンロードの失敗（Download.DownloadError）も、このリクエストのエラーとして返す
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = round(time.perf_counter() - start, 3)
+    
+        with self.lock:
+            self.running -= 1
+            if result["status"] == "ok":
+                self.completed += 1
+            else:
+                self.failed += 1
+        return result
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+# リクエストをシミュレーション条件に変換する
+def parse_request(record, number):
+    """
+    Args:
+    record: リクエストの JSON（辞書）
+    number: 受け付けた順の番号
+    
+    Return:
+    job: シミュレーション条件の辞書（Batch.parse_job の項目と sun_sweep, animation, return）
+    
+    検証はバッチモードと同じ。sun_sweep は [[方位, 仰角], ...]、"90:20, 180:10" 又は "day" の形式とする。
+    """
+    
+    if not isinstance(record, dict):
+        raise ValueError("リクエストは JSON のオブジェクトで指定してください。")
+    job = batch.parse_job(record, number)
+    
+    sun_sweep = record.get("sun_sweep")
+    # "day" の場合は月の1日（日の出から日の入り）の太陽の経路とする
+    if sun_sweep == "day":
+        sun_sweep = ef.sun_path(job["latitude"])
+    elif isinstance(sun_sweep, str):
+        sun_sweep = input.parse_sun_sweep(sun_sweep)
+    elif sun_sweep:
+        sun_sweep = input.parse_sun_sweep(", ".join(f"{azimuth}:{altdeg}" for azimuth, altdeg in sun_sweep))
+    job["sun_sweep"] = sun_sweep or None
+    # sun_sweep の各位置をフレームとする1つのアニメーションとして保存する
+    job["animation"] = bool(record.get("animation", False))
+    
+    job["return"] = record.get("return", "path")
+    if job["return"] not in ("path", "arrays"):
+        raise ValueError("return は path 又は arrays のいずれかです。")
+    return job
+
+
+# 配列を JSON で返せる形式（plotly.js と同じ base64 の型付き配列）に変換する
+def encode_arrays(arrays):
+    """
+    Arg:
+    arrays: Simulation.simulate(return_arrays=True) の配列の辞書
+    
+    Return:
+    encoded: 名前ごとの {"dtype", "bdata", "shape"} の辞書（shape は常にリスト）
+    """
+    
+    encoded = {}
+    for name, array in arrays.items():
+        encoded[name] = sv.encode_array(array)
+        encoded[name]["shape"] = list(array.shape)
+    return encoded
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /health で状態を、POST /simulate でシミュレーションの結果を JSON で返します。
+    """
+    
+    # SimulationService（サーバーの作成時に設定する）
+    service = None
+    
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, self.service.status())
+        else:
+            self.send_json(404, {"status": "error", "error": f"not found: {self.path}"})
+    
+    def do_POST(self):
+        if self.path != "/simulate":
+            self.send_json(404, {"status": "error", "error": f"not found: {self.path}"})
+            return
+    
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self.send_json(413, {"status": "error", "error": "request body is too large"})
+            return
+        try:
+            record = json.loads(self.rfile.read(length) or b"{}")
+            future = self.service.submit(record)
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {"status": "error", "error": f"{type(e).__name__}: {e}"})
+            return
+        if future is None:
+            self.send_json(503, {"status": "error", "error": "too many pending requests"})
+            return
+    
+        # ワーカーの結果を待って返す（接続ごとのスレッドで待つため、他のリクエストは妨げない）
+        result = future.result()
+        self.send_json(200 if result["status"] == "ok" else 500, result)
+    
+    def send_json(self, code, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def address_string(self):
+        # Unix ソケットの場合は接続元のアドレスがない
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix ソケットで待ち受ける HTTP サーバーです。
+    """
+    
+    daemon_threads = True
+
+
+# サーバーを作成する
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """
+    Args:
+    service: SimulationService
+    host, port: 待ち受けるアドレス
+    socket_path: Unix ソケットのパス（指定した場合は host, port を使わない）
+    
+    Return:
+    server: HTTP サーバー
+    """
+    
+    handler = type("Handler", (RequestHandler,), {"service": service})
+    if socket_path is not None:
+        # 前回の終了時に残ったソケットファイルは削除する
+        remove_socket(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+# ソケットファイルを削除する（ソケット以外のファイルは削除しない）
+def remove_socket(socket_path):
+    """
+    Arg:
+    socket_path: Unix ソケットのパス
+    
+    Return:
+    None（ソケット以外のファイルが存在する場合は FileExistsError）
+    """
+    
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    # --socket の指定を誤った場合に、通常のファイルを削除しないようにする
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{socket_path} はソケットではないため削除しません。別のパスを指定してください。")
+    os.remove(socket_path)
+
+
+# サーバーを起動する（Ctrl+C で終了する）
+def run_server(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, workers=None):
+    """
+    Args:
+    host, port: 待ち受けるアドレス
+    socket_path: Unix ソケットのパス
+    workers: シミュレーションを同時に実行する数（None の場合は MAX_WORKERS）
+    
+    Return:
+    None
+    """
+    
+    service = SimulationService(workers or MAX_WORKERS)
+    service.preload()
+    server = create_server(service, host, port, socket_path)
+    address = socket_path if socket_path is not None else f"http://{host}:{server.server_address[1]}"
+    print(f"シミュレーションサーバーを起動しました: {address}（ワーカー {service.workers}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("シミュレーションサーバーを終了します。")
+    finally:
+        server.server_close()
+        service.shutdown()
+        if socket_path is not None:
+            remove_socket(socket_path)
+
@@ -0,0 +1,264 @@
+# Simulation.py
+
+"""
+指定された条件で "HEVENTARS" のシミュレーションを1回実行するモジュールです。
+main.py の対話モードとバッチモードの両方から使用されます。
+This module runs a single "HEVENTARS" simulation with the given conditions.
+It is used by both the interactive mode and the batch mode of main.py.
+"""
+
+import os
+
+import Tile as tile
+import Download as dl
+import Read_lbl as read
+import Area as area
+import Effect as ef
+import Plot as pl
+import Save as sv
+import Ortho as ort
+import Mosaic as mosaic
+import Horizon as hz
+import Trace as trace
+
+# シミュレーションを実行する
+def simulate(target_latitude, target_longitude, sun_azimuth, sun_altdeg,
+             smoothing_active, plot_range, viewpoint, ortho_active, open_browser=True, sun_sweep=None,
+             shadow_active=False, horizon_cache=False, return_arrays=False, animation_active=False):
+    """
+    Args:
+    target_latitude: ターゲットの緯度
+    target_longitude: ターゲットの経度
+    sun_azimuth: 太陽（光源）の方位
+    sun_altdeg: 太陽（光源）の仰角
+    smoothing_active: スムージング機能の有効化
+    plot_range: プロット管理番号又は描画範囲（Extent.resolve で読めるもの）
+    viewpoint: 視点の高さ
+    ortho_active: オルソ画像の使用
+    open_browser: 保存後にブラウザで展開するか
+    sun_sweep: 太陽の (方位, 仰角) のリスト。指定した場合は位置ごとに結果を保存する（オルソ画像使用時は無効）
+    shadow_active: 地形が落とす影（投影）を陰影起伏に合成するか（オルソ画像使用時は無効）
+    horizon_cache: 影の計算に使う地平線高度を事前計算して保存するか
+                   （保存済みの場合は horizon_cache に関わらず使用する）
+    return_arrays: True の場合はプロットと保存を行わず、描画に使う配列を返す（Server.py から使用する）
+    animation_active: sun_sweep の各位置をフレームとする1つのアニメーション（HTML）として保存するか
+    
+    Return:
+    save_filename: 保存したファイルのパス（スイープの場合はそのリスト、アニメーションの場合は1つのパス）
+                   return_arrays の場合は配列の辞書（elevation, surface, latitude, longitude）
+    """
+    
+    # 対象地点を含むタイルを調べる
+    # 各段階の所要時間とメモリ使用量は Trace で記録する（無効の場合は何もしない）
+    with trace.stage("tile_lookup"):
+        prefix, tile_name = tile.generate_name(target_latitude, target_longitude)
+    
+    # 該当するタイルをダウンロード
+    with trace.stage("download", tile=tile_name):
+        img_path, lbl_path = dl.download_data(prefix, tile_name)
+    
+    # ラベルを読み取る（simulate_LRO と同じく段階を分けて記録する）
+    # 読み取った結果はキャッシュされ、Mosaic.open_tile で地理情報を求める際に再利用される
+    with trace.stage("label_parse"):
+        read.parse_lbl(lbl_path)
+    
+    # 標高データを取得する
+    # 地理情報は Mosaic.open_tile で Read_lbl.get_geometry から求める
+    # タイル全体ではなく、描画範囲を含む部分だけを読み込む
+    # タイル境界付近では隣接タイルもダウンロードし、必要な部分だけを組み合わせる
+    with trace.stage("elevation_load", plot_range=plot_range) as event:
+        (elevation_data, window_samples, window_lines, window_latitude, window_longitude, window_resolution,
+         elevation_sources) = mosaic.get_elevation_mosaic(target_latitude, target_longitude, plot_range,
+                                                          return_sources=True)
+        event.arrays(elevation_data=elevation_data)
+    
+    # 描画範囲のデータを抽出する（曲率補正は Area.select_area の中で記録する）
+    with trace.stage("extraction") as event:
+        selected_data, selected_x, selected_y, haversine_data = area.select_area(elevation_data, target_latitude, target_longitude, 
+                                                                window_samples, window_lines, window_latitude,
+                                                                window_longitude, window_resolution, plot_range)
+        event.arrays(selected_data=selected_data, haversine_data=haversine_data)
+    
+    # オルソ画像を使用する場合
+    selected_ortho = None
+    if ortho_active == True:
+        # オルソ画像を取得し、抽出する
+        with trace.stage("download", tile=tile_name, ortho=True):
+            dl.download_ortho(prefix, tile_name)
+        # オルソ画像自身のラベルの地理情報を使い、標高データの格子に合わせる
+        # タイル境界付近では標高データと同じく隣接タイルのオルソ画像も使う
+        with trace.stage("ortho_load") as event:
+            selected_ortho = ort.get_ortho_mosaic(selected_y[:, 0], selected_x[0, :])
+            event.arrays(selected_ortho=selected_ortho)
+    
+    # キーには抽出範囲に重なるすべてのタイルを含める（隣接タイルが更新された場合も地平線高度を作り直す）
+    return render(selected_data, selected_x, selected_y, haversine_data, window_resolution, elevation_sources,
+                  target_latitude, target_longitude, sun_azimuth, sun_altdeg, smoothing_active, plot_range, viewpoint,
+                  selected_ortho, open_browser, sun_sweep, shadow_active, horizon_cache, return_arrays,
+                  animation_active)
+
+
+# LRO: 指定した GeoTIFF でシミュレーションを実行する（SLIM.py, Apollo17.py から使用する）
+def simulate_LRO(tif_name, lbl_name, target_latitude, target_longitude, sun_azimuth, sun_altdeg,
+                 smoothing_active, plot_range, viewpoint, open_browser=True, sun_sweep=None,
+                 shadow_active=False, horizon_cache=False):
+    """
+    Args:
+    tif_name: 標高データ（"data" ディレクトリ内の GeoTIFF）のファイル名
+    lbl_name: ラベルのファイル名（データサイズ、左上の緯度経度、マップスケールを読み取る）
+    その他: simulate と同じ（オルソ画像は使用できない）
+    
+    Return:
+    save_filename: 保存したファイルのパス（スイープの場合はそのリスト、ラベルがない場合は None）
+    """
+    
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+    
+    # LBLファイルから地理情報を取得する
+    # 左上の緯度経度は MAXIMUM_LATITUDE, WESTERNMOST_LONGITUDE から求める
+    with trace.stage("label_parse"):
+        label = read.parse_lbl(os.path.join(data_directory, lbl_name))
+    if label is None:
+        return None
+    geometry = read.get_geometry(label)
+    
+    # 標高データを取得する
+    # ファイル全体ではなく、描画範囲を含むストリップだけを読み込む
+    with trace.stage("elevation_load", plot_range=plot_range) as event:
+        (elevation_data, window_samples, window_lines, window_latitude,
+         window_longitude, window_resolution) = area.get_elevation_LRO_window(tif_name, geometry["LINE_SAMPLES"],
+                                                                             geometry["LINES"],
+                                                                             geometry["UPPER_LEFT_LATITUDE"],
+                                                                             geometry["UPPER_LEFT_LONGITUDE"],
+                                                                             geometry["MAP_RESOLUTION"],
+                                                                             target_latitude, target_longitude,
+                                                                             plot_range)
+        event.arrays(elevation_data=elevation_data)
+    
+    # 描画範囲のデータを抽出する
+    with trace.stage("extraction") as event:
+        selected_data, selected_x, selected_y, haversine_data = area.select_area(elevation_data, target_latitude, target_longitude,
+                                                                window_samples, window_lines, window_latitude,
+                                                                window_longitude, window_resolution, plot_range)
+        event.arrays(selected_data=selected_data, haversine_data=haversine_data)
+    
+    return render(selected_data, selected_x, selected_y, haversine_data, window_resolution,
+                  os.path.join(data_directory, tif_name), target_latitude, target_longitude, sun_azimuth, sun_altdeg,
+                  smoothing_active, plot_range, viewpoint, open_browser=open_browser, sun_sweep=sun_sweep,
+                  shadow_active=shadow_active, horizon_cache=horizon_cache, dataset="LRO")
+
+
+# 抽出した標高データから陰影起伏（又はオルソ画像）、影、スムージングを適用し、プロットして保存する
+def render(selected_data, selected_x, selected_y, haversine_data, window_resolution, horizon_source,
+           target_latitude, target_longitude, sun_azimuth, sun_altdeg, smoothing_active, plot_range, viewpoint,
+           selected_ortho=None, open_browser=True, sun_sweep=None, shadow_active=False, horizon_cache=False,
+           return_arrays=False, animation_active=False, dataset="KGY"):
+    """
+    Args:
+    selected_data, selected_x, selected_y, haversine_data: Area.select_area の戻り値
+    window_resolution: 抽出範囲のマップスケーリング係数 <pixel/deg>
+    horizon_source: 地平線高度のキーに使う標高データのパス（複数のタイルを組み合わせた場合はそのリスト）
+    selected_ortho: 標高データの格子に合わせたオルソ画像（None の場合は陰影起伏を使う）
+    dataset: 保存ファイル名の種類（"KGY": KAGUYA, "LRO": LRO NAC DTM）
+    その他: simulate と同じ
+    
+    Return:
+    save_filename: simulate と同じ
+    """
+    
+    ortho_active = selected_ortho is not None
+    # オルソ画像を使用する場合
+    if ortho_active:
+        sun_positions = [(sun_azimuth, sun_altdeg)]
+        surfaces = [selected_ortho]
+    # スイープする場合
+    # 勾配を1度だけ計算し、太陽の位置ごとの陰影起伏を順に求める
+    elif sun_sweep:
+        sun_positions = sun_sweep
+        surfaces = ef.calculate_hillshade_sweep(haversine_data, [azimuth for azimuth, _ in sun_sweep],
+                                                [altdeg for _, altdeg in sun_sweep], as_generator=True)
+        # 陰影起伏は取り出すたびに計算されるため、取り出すごとに記録する
+        surfaces = trace.iterate("shading", surfaces, sweep=True)
+    # オルソ画像を使用しない場合
+    else:
+        # 陰影起伏を計算する
+        sun_positions = [(sun_azimuth, sun_altdeg)]
+        with trace.stage("shading") as event:
+            surfaces = [ef.calculate_hillshade(haversine_data, sun_azimuth, sun_altdeg)]
+            event.arrays(hillshade=surfaces[0])
+    
+    # スムージングが有効の場合
+    if smoothing_active == True:
+        # 標高データに対してスムージング
+        with trace.stage("smoothing", target="elevation"):
+            adjusted_data = ef.smoothing_data(haversine_data)
+    # スムージングが無効の場合
+    else:
+        # 標高データはそのまま
+        adjusted_data = selected_data
+    
+    # 影の計算に使用するピクセル間隔 <m>
+    dx, dy = area.pixel_size(window_resolution, target_latitude)
+    # 地平線高度が保存されている場合は、影を比較だけで求める
+    horizon_codes = None
+    if shadow_active == True and ortho_active == False:
+        with trace.stage("horizon"):
+            horizon_codes, horizon_scale = hz.get_horizon(horizon_source, selected_data, selected_x, selected_y,
+                                                          window_resolution, target_latitude, compute=horizon_cache)
+    
+    # 太陽の位置ごとに、影とスムージングを適用した表面を順に求める
+    def adjusted_surfaces():
+        for (sun_azimuth, sun_altdeg), surface in zip(sun_positions, surfaces):
+            # 影が有効の場合、曲率補正された地形が落とす影を陰影起伏に合成する
+            if shadow_active == True and ortho_active == False:
+                with trace.stage("shadow", azimuth=sun_azimuth, altdeg=sun_altdeg):
+                    if horizon_codes is not None:
+                        shadow = hz.shadow_from_horizon(horizon_codes, horizon_scale, sun_azimuth, sun_altdeg)
+                    else:
+                        shadow = ef.calculate_shadow(haversine_data, sun_azimuth, sun_altdeg, dx, dy)
+                    surface = ef.apply_shadow(surface, shadow)
+            
+            # 陰影起伏を使用し、スムージングが有効の場合はスムージング
+            if smoothing_active == True and ortho_active == False:
+                with trace.stage("smoothing", target="surface"):
+                    surface = ef.smoothing_data(surface)
+            yield sun_azimuth, sun_altdeg, surface
+    
+    # アニメーションの場合は、地形の形状を1度だけ作成し、フレームごとに表面の色だけを保存する
+    # フレームは保存中に1枚ずつ計算される
+    if animation_active and sun_sweep and not ortho_active and not return_arrays:
+        with trace.stage("animation", frames=len(sun_positions)):
+            fig, frames = pl.plot_animation(adjusted_data, haversine_data,
+                                            (surface for _, _, surface in adjusted_surfaces()),
+                                            selected_x, selected_y, target_latitude, target_longitude, sun_positions,
+                                            plot_range, viewpoint, smoothing_active, shadow_active)
+            return sv.save_animation(fig, frames, target_latitude, target_longitude, sun_positions,
+                                     smoothing_active, plot_range, open_browser, shadow_active)
+    
+    save_filenames = []
+    for sun_azimuth, sun_altdeg, adjusted_surface in adjusted_surfaces():
+        # 配列を返す場合は、プロットと保存を行わない
+        if return_arrays:
+            save_filenames.append({"elevation": haversine_data, "surface": adjusted_surface,
+                                   "latitude": selected_y[:, 0], "longitude": selected_x[0, :]})
+            continue
+        
+        # 3Dプロットを作成する
+        with trace.stage("plotting", azimuth=sun_azimuth, altdeg=sun_altdeg):
+            fig = pl.plot_3d(adjusted_data, haversine_data, adjusted_surface, selected_x, selected_y,
+                        target_latitude, target_longitude, sun_azimuth, sun_altdeg,
+                        plot_range, viewpoint, smoothing_active, ortho_active, shadow_active)
+        
+        # 3Dプロットを保存して展開する
+        # スイープの場合は展開しない
+        with trace.stage("saving", azimuth=sun_azimuth, altdeg=sun_altdeg):
+            if dataset == "LRO":
+                save_filenames.append(sv.save_expand_LRO(fig, target_latitude, target_longitude, sun_azimuth,
+                                                         sun_altdeg, smoothing_active, plot_range,
+                                                         open_browser and not sun_sweep, shadow_active))
+            else:
+                save_filenames.append(sv.save_expand(fig, target_latitude, target_longitude, sun_azimuth, sun_altdeg, 
+                                                     smoothing_active, ortho_active, plot_range,
+                                                     open_browser and not sun_sweep, shadow_active))
+    
+    return save_filenames if sun_sweep and not ortho_active else save_filenames[0]
@@ -5,6 +5,8 @@
 This module returns the name of the tile containing the point based on the input coordinate information.
 """
 
+import math
+
 # 定数
 DEGREE_INTERVAL = 3
 MAX_LONGITUDE = 360
@@ -16,18 +18,20 @@ MAX_LONGITUDE = 360
 """
 
 # タイル名を生成する
-def generate_name(latitude, longitude):
+def generate_name(latitude, longitude, verbose=True):
     """
     Args:
     latitude: ターゲットの緯度
     longitude: ターゲットの経度
+    verbose: 進み具合を表示するか（generate_names_area から呼ぶ場合は表示しない）
     
     Returns:
     prefix: 経度の分類
     tile_name: タイルの名前
     """
     
-    print("タイル名の生成中...")
+    if verbose:
+        print("タイル名の生成中...")
     
     # 緯度がマイナスの場合、南半球の処理
     if latitude < 0:
@@ -39,6 +43,34 @@ def generate_name(latitude, longitude):
         return generate_name_north(latitude, longitude)
     
     
+# 指定された緯度経度の範囲に重なるすべてのタイル名を生成する
+def generate_names_area(latitude_min, latitude_max, longitude_min, longitude_max):
+    """
+    Args:
+    latitude_min, latitude_max: 範囲の南端と北端の緯度
+    longitude_min, longitude_max: 範囲の西端と東端の経度（360度をまたいでもよい）
+    
+    Return:
+    tiles: (prefix, tile_name, タイル南端の緯度, タイル西端の経度) のリスト
+    """
+    
+    # 極を越える範囲は切り捨てる
+    latitude_min, latitude_max = max(latitude_min, -90), min(latitude_max, 90)
+    
+    # タイルの北端の緯度と西端の経度のピクセルはそのタイルに含まれる
+    tiles = []
+    south = math.ceil(latitude_min / DEGREE_INTERVAL) * DEGREE_INTERVAL - DEGREE_INTERVAL
+    while south < latitude_max:
+        west = math.floor(longitude_min / DEGREE_INTERVAL) * DEGREE_INTERVAL
+        while west <= longitude_max:
+            # タイルの中心でタイル名を生成する（generate_name と同じ規則）
+            prefix, tile_name = generate_name(south + DEGREE_INTERVAL / 2, west + DEGREE_INTERVAL / 2, verbose=False)
+            tiles.append((prefix, tile_name, south, west))
+            west += DEGREE_INTERVAL
+        south += DEGREE_INTERVAL
+    return tiles
+
+
 # 南半球かつ緯度が0から-3の場合のタイル名を生成する関数
 def generate_name_ex(latitude, longitude):
     # 緯度と経度を3度ごとに丸める
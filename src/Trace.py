@@ -0,0 +1,254 @@
+# Trace.py
+
+"""
+処理の段階ごとに所要時間（実時間と CPU 時間）、メモリ使用量のピーク、配列の大きさを記録するモジュールです。
+記録は JSON Lines（1行に1つの JSON）として出力し、無効の場合はほとんど処理を行いません。
+This module records wall time, CPU time, peak memory and array sizes per pipeline stage as a JSON event stream.
+It is off by default and costs close to nothing when disabled.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+
+# 記録の有効化（環境変数 HVTS_TRACE に出力先のパスを指定する、"-" 又は "1" の場合は標準エラー出力）
+TRACE_ACTIVE = False
+_output = None
+_owns_output = False
+# 実行中の段階（スレッドごと、入れ子の場合は外側から順）
+_local = threading.local()
+# 出力の排他制御（Server.py などで複数のスレッドから記録する場合に備える）
+_output_lock = threading.Lock()
+# 段階を記録中のスレッドの数と、記録を始めたスレッドの延べ数
+# tracemalloc のピークはプロセス全体で共通のため、他のスレッドと重なった段階のピークは記録しない
+_threads_lock = threading.Lock()
+_active_threads = 0
+_activations = 0
+# 段階の名前ごとの合計（記録は出力するたびに集計し、個々の記録は保持しない）
+# Server.py のように常駐する場合も、メモリ使用量は段階の種類の数で決まる
+_totals = {}
+
+
+class _Stage:
+    """
+    記録中の段階です。with 文で使用し、arrays() で配列の大きさを追加します。
+    """
+    
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.array_info = {}
+        self.peak = 0
+    
+    def arrays(self, **arrays):
+        """
+        Arg:
+        arrays: 名前と配列（形状、データ型、バイト数を記録する）
+        """
+        for name, array in arrays.items():
+            if hasattr(array, "shape"):
+                self.array_info[name] = {"shape": list(array.shape), "dtype": str(array.dtype),
+                                         "nbytes": int(array.nbytes)}
+    
+    def __enter__(self):
+        global _active_threads, _activations
+        stack = _current_stack()
+        with _threads_lock:
+            if not stack:
+                _active_threads += 1
+                _activations += 1
+            self.shared = _active_threads > 1
+            self.start_activations = _activations
+    
+        # 外側の段階のピークを確定してから、この段階のピークを計測し直す
+        current, peak = tracemalloc.get_traced_memory()
+        for outer in stack:
+            outer.peak = max(outer.peak, peak)
+        tracemalloc.reset_peak()
+        self.start_memory = current
+        stack.append(self)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_threads
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        stack = _current_stack()
+        stack.pop()
+        for outer in stack:
+            outer.peak = max(outer.peak, peak)
+        # 段階の途中で他のスレッドが記録していた（ピークを計測し直した）か
+        with _threads_lock:
+            shared = self.shared or _active_threads > 1 or _activations != self.start_activations
+            if not stack:
+                _active_threads -= 1
+    
+        event = {
+            "stage": self.name,
+            "depth": len(stack),
+            "wall": wall,
+            "cpu": cpu,
+            # 段階の開始時点から増えた分のピーク <byte>（他のスレッドと重なった場合は None）
+            "peak_bytes": None if shared else max(peak - self.start_memory, 0),
+            "arrays": self.array_info,
+        }
+        event.update(self.fields)
+        if exc_type is not None:
+            event["error"] = repr(exc_value)
+        _emit(event)
+        return False
+
+
+class _NullStage:
+    """
+    記録が無効の場合の段階です。何も行いません。
+    """
+    
+    def arrays(self, **arrays):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+# このスレッドで実行中の段階
+def _current_stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+# 段階を記録する
+def stage(name, **fields):
+    """
+    Args:
+    name: 段階の名前
+    fields: 記録に追加する値（地点や描画範囲など）
+    
+    Return:
+    stage: with 文で使用する記録（無効の場合は何もしない）
+    
+    例:
+        with trace.stage("shading") as event:
+            hillshade = ef.calculate_hillshade(...)
+            event.arrays(hillshade=hillshade)
+    """
+    
+    if not TRACE_ACTIVE:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+# 反復ごとに段階を記録する（スイープの陰影起伏など、値を順に求める場合）
+def iterate(name, iterable, **fields):
+    """
+    Args:
+    name: 段階の名前
+    iterable: 値を順に返すもの
+    fields: 記録に追加する値
+    
+    Return:
+    iterable: 同じ値を順に返すもの（無効の場合は iterable をそのまま返す）
+    """
+    
+    if not TRACE_ACTIVE:
+        return iterable
+    
+    def traced():
+        iterator = iter(iterable)
+        index = 0
+        while True:
+            with stage(name, index=index, **fields) as event:
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    event.fields["exhausted"] = True
+                    break
+                event.arrays(value=value)
+            yield value
+            index += 1
+    return traced()
+
+
+# 記録を有効にする
+def enable(path=None):
+    """
+    Arg:
+    path: 出力先のパス（None 又は "-" の場合は標準エラー出力）
+    
+    Return:
+    None
+    """
+    
+    global TRACE_ACTIVE, _output, _owns_output
+    disable()
+    if path in (None, "-", "1"):
+        _output, _owns_output = sys.stderr, False
+    else:
+        _output, _owns_output = open(path, 'a', encoding='utf-8'), True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    TRACE_ACTIVE = True
+
+
+# 記録を無効にする
+def disable():
+    global TRACE_ACTIVE, _output, _owns_output
+    TRACE_ACTIVE = False
+    if _owns_output and _output is not None:
+        _output.close()
+    _output, _owns_output = None, False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+# 段階ごとの合計を求める
+def summary():
+    """
+    Return:
+    totals: 段階の名前ごとの {count, wall, cpu, peak_bytes} の辞書（記録した順、peak_bytes は他のスレッドと重ならなかった段階のみ）
+    """
+    
+    with _output_lock:
+        return {name: dict(total) for name, total in _totals.items()}
+
+
+# 段階ごとの合計を出力する
+def emit_summary():
+    if TRACE_ACTIVE:
+        _emit({"summary": summary()}, keep=False)
+
+
+def _emit(event, keep=True):
+    event = {"time": time.time(), **event}
+    with _output_lock:
+        if keep:
+            _add_to_totals(event)
+        _output.write(json.dumps(event, ensure_ascii=False) + "\n")
+        _output.flush()
+
+
+def _add_to_totals(event):
+    total = _totals.setdefault(event["stage"], {"count": 0, "wall": 0.0, "cpu": 0.0, "peak_bytes": 0})
+    total["count"] += 1
+    total["wall"] += event["wall"]
+    total["cpu"] += event["cpu"]
+    if event["peak_bytes"] is not None:
+        total["peak_bytes"] = max(total["peak_bytes"], event["peak_bytes"])
+
+
+# 環境変数で有効にする
+if os.environ.get("HVTS_TRACE"):
+    enable(os.environ["HVTS_TRACE"])
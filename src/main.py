@@ -5,18 +5,58 @@
 This is the main file of the software "HEVENTARS", which visualizes the topography of the Moon from the rover's viewpoint using lunar elevation data.
 """
 
+import argparse
+import os
+import sys
+
 import Input as input
-import Tile as tile
 import Download as dl
-import Read_lbl as read
-import Area as area
+import Simulation as sim
 import Effect as ef
-import Plot as pl
-import Save as sv
-import Ortho as ort
+import Trace as trace
 
 if __name__ == "__main__":
     
+    # コマンドライン引数の設定
+    # 引数なしの場合は対話モード、--batch を指定した場合はバッチモード、--serve を指定した場合はサーバーモード
+    parser = argparse.ArgumentParser(description="HEVENTARS")
+    parser.add_argument("--batch", metavar="MANIFEST", help="ジョブ一覧（CSV 又は JSON）のパス")
+    parser.add_argument("--workers", type=int, default=None, help="バッチモードの並列プロセス数（サーバーモードでは同時に実行する数）")
+    parser.add_argument("--summary", metavar="PATH", default=None, help="バッチモードの結果一覧の保存先")
+    parser.add_argument("--serve", action="store_true", help="常駐して HTTP/JSON でシミュレーションを受け付ける")
+    parser.add_argument("--port", type=int, default=None, help="サーバーモードで待ち受けるポート（localhost のみ）")
+    parser.add_argument("--socket", metavar="PATH", default=None, help="サーバーモードで待ち受ける Unix ソケットのパス")
+    parser.add_argument("--trace", metavar="PATH", nargs="?", const="-", default=None,
+                        help="段階ごとの所要時間とメモリ使用量を JSON Lines で記録する（PATH 省略時は標準エラー出力）")
+    args = parser.parse_args()
+    
+    # 段階ごとの記録（環境変数 HVTS_TRACE でも有効にできる）
+    # バッチモードの各プロセスにも引き継ぐ
+    if args.trace is not None:
+        os.environ["HVTS_TRACE"] = args.trace
+        trace.enable(args.trace)
+    
+    # バッチモード
+    if args.batch is not None:
+        import Batch as batch
+        try:
+            batch.run_batch(args.batch, workers=args.workers, summary_path=args.summary)
+        except dl.DownloadError:
+            # ダウンロードに失敗した場合、プログラムを終了
+            sys.exit(1)
+        sys.exit()
+    
+    # サーバーモード
+    if args.serve:
+        import Server as server
+        try:
+            server.run_server(port=args.port or server.DEFAULT_PORT, socket_path=args.socket, workers=args.workers)
+        except FileExistsError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        trace.emit_summary()
+        sys.exit()
+    
     # 調査地点の入力
     print("=== 調査対象とする地点を指定 ===")
     # 緯度経度の入力
@@ -25,77 +65,34 @@ if __name__ == "__main__":
     # 月からの太陽の方位と高度の入力
     sun_azimuth = input.validate_input_below("・太陽の方位を入力してください。\n北0度、東90度、南180度、西270度（0以上360未満の間）: ", 0, 360)
     sun_altdeg = input.validate_input_less("・太陽の仰角（高度）を入力してください。\n地平線0度、直上90度（0から90度の間）: ", 0, 90)
+    # 複数の太陽の位置で描画する場合（位置ごとに結果を保存）
+    sun_sweep = None
+    animation_active = False
+    if input.validate_input_yes_no("・複数の太陽の位置で描画（スイープ）しますか？ <y/n> : "):
+        # 月の1日の太陽の経路は、地点の緯度から求める
+        if input.validate_input_yes_no("・月の1日（日の出から日の入り）の太陽の経路を使用しますか？ <y/n> : "):
+            sun_sweep = ef.sun_path(target_latitude)
+        else:
+            sun_sweep = input.validate_input_sun_sweep("・太陽の方位と仰角を「方位:仰角」のカンマ区切りで入力してください。\n例: 90:20, 180:10, 270:5 : ")
+        # 1つのアニメーションとして保存する場合
+        animation_active = input.validate_input_yes_no("・1つのアニメーション（HTML）として保存しますか？\n（地形は1度だけ保存し、太陽の位置ごとに陰影だけを切り替えます） <y/n> : ")
+    # 影（投影）の合成
+    shadow_active = input.validate_input_yes_no("・地形が落とす影を合成しますか？\n（低い太陽高度でクレーターの縁などの影を表現します） <y/n> : ")
     # スムージング機能の有効化
     smoothing_active = input.validate_input_yes_no("・データにスムージングを適応しますか？\n（より滑らかな描画を可能にするが、実際のデータからは変化します） <y/n> : ")
     # 描画範囲の設定
-    plot_range, viewpoint = input.validate_input_plot_range("・プロットの描画範囲を [0, 1, 2, 3] のいずれかで設定してください。\n[0: 6,000m, 1: 3,000m, 2: 600m, 3: 300m] : ")
+    plot_range, viewpoint = input.validate_input_plot_range("・プロットの描画範囲を [0, 1, 2, 3] のいずれか、又は 東西x南北の大きさ <m>（例: 2000x1000）で設定してください。\n[0: 6,000m, 1: 3,000m, 2: 600m, 3: 300m] : ")
     # オルソ画像の貼り付け
     ortho_active = input.validate_input_yes_no("・オルソ画像を貼り付けますか？\n（陰影起伏は無効化されます） <y/n> : ")
     
+    # シミュレーションを実行する
+    try:
+        sim.simulate(target_latitude, target_longitude, sun_azimuth, sun_altdeg,
+                     smoothing_active, plot_range, viewpoint, ortho_active, sun_sweep=sun_sweep,
+                     shadow_active=shadow_active, animation_active=animation_active)
+    except dl.DownloadError:
+        # ダウンロードに失敗した場合、プログラムを終了
+        sys.exit(1)
     
-    # 対象地点を含むタイルを調べる
-    prefix, tile_name = tile.generate_name(target_latitude, target_longitude)
-    
-    # 該当するタイルをダウンロード
-    img_path, lbl_path = dl.download_data(prefix, tile_name)
-    
-    # lblファイルから情報を取得する
-    lbl_keys = ["BANDS", "LINES", "LINE_SAMPLES", "UPPER_LEFT_LATITUDE",
-                        "UPPER_LEFT_LONGITUDE", "MAP_RESOLUTION"]
-    topographic_info = read.get_lbl(lbl_path, lbl_keys)
-    
-    # 標高データを取得する
-    LINE_SAMPLES = int(topographic_info.get("LINE_SAMPLES"))
-    LINES = int(topographic_info.get("LINES"))
-    elevation_data = area.get_elevation(img_path, LINE_SAMPLES, LINES)
-    
-    # 描画範囲のデータを抽出する
-    UPPER_LEFT_LATITUDE = topographic_info.get("UPPER_LEFT_LATITUDE")
-    UPPER_LEFT_LONGITUDE = topographic_info.get("UPPER_LEFT_LONGITUDE")
-    MAP_RESOLUTION = topographic_info.get("MAP_RESOLUTION")
-    selected_data, selected_x, selected_y, haversine_data = area.select_area(elevation_data, target_latitude, target_longitude, 
-                                                            LINE_SAMPLES, LINES, UPPER_LEFT_LATITUDE,
-                                                            UPPER_LEFT_LONGITUDE, MAP_RESOLUTION, plot_range)
-
-    # オルソ画像を使用する場合
-    if ortho_active == True:
-        # オルソ画像を取得し、抽出する
-        ortho_img_path, ortho_lbl_path = dl.download_ortho(prefix, tile_name)
-        ortho_image = ort.get_ortho(ortho_img_path, LINES, LINE_SAMPLES)
-        selected_ortho = ort.selected_ortho(ortho_image, target_latitude, target_longitude, 
-                                            LINE_SAMPLES, LINES,UPPER_LEFT_LATITUDE, UPPER_LEFT_LONGITUDE, 
-                                            MAP_RESOLUTION, plot_range)
-    # オルソ画像を使用しない場合
-    else:
-        # 陰影起伏を計算する
-        hillshade = ef.calculate_hillshade(haversine_data, sun_azimuth, sun_altdeg)
-    
-    # スムージングが有効の場合
-    if smoothing_active == True:
-        # 標高データに対してスムージング
-        adjusted_data = ef.smoothing_data(haversine_data)
-        if ortho_active == False:
-            # かつ陰影起伏を使用する場合、スムージング
-            adjusted_surface = ef.smoothing_data(hillshade)
-        else:
-            # かつオルソ画像を使用する
-            adjusted_surface = selected_ortho
-    # スムージングが無効の場合
-    else:
-        # 標高データはそのまま
-        adjusted_data = selected_data
-        if ortho_active == False:
-        # かつ陰影起伏を使用する
-            adjusted_surface = hillshade
-        else:
-        # かつオルソ画像を使用する
-            adjusted_surface = selected_ortho
-
-    # 3Dプロットを作成する
-    fig = pl.plot_3d(adjusted_data, haversine_data, adjusted_surface, selected_x, selected_y,
-                target_latitude, target_longitude, sun_azimuth, sun_altdeg,
-                plot_range, viewpoint, smoothing_active, ortho_active)
-
-    # 3Dプロットを保存して展開する
-    sv.save_expand(fig, target_latitude, target_longitude, sun_azimuth, sun_altdeg, 
-                smoothing_active, ortho_active, plot_range)
\ No newline at end of file
+    # 段階ごとの合計を出力する（記録が無効の場合は何もしない）
+    trace.emit_summary()
\ No newline at end of file